@@ -2,8 +2,12 @@
 of matrix in addition to its gradients.
 """
 
+import collections
+import contextlib
 import cPickle as pickle
 import numpy as np
+import sys
+import threading
 
 
 # pylint: disable=R0903
@@ -19,14 +23,76 @@ class Blob(object):
 
     The diff matrix will not be created unless you explicitly run init_diff,
     as many Blobs do not need the gradients to be computed.
+
+    If a BlobPool is set with Blob.set_pool(), blobs allocate their data and
+    diff from the pool, and return the memory to it when they reallocate.
     """
+    # The pool that blobs allocate their memory from. If None, blobs
+    # allocate with numpy.
+    _pool = None
+
     def __init__(self, shape=None, dtype=None, filler=None):
         self._data = None
         self._diff = None
         self._filler = filler
+        self._buffer = None
+        # the pooled memory backing the data and the diff, if any, together
+        # with the pools they came from.
+        self._data_memory = None
+        self._data_pool = None
+        self._diff_memory = None
+        self._diff_pool = None
         if shape is not None:
             self.init_data(shape, dtype)
 
+    @staticmethod
+    def set_pool(pool):
+        """Sets the BlobPool that blobs allocate their data and diff from.
+        Pass None to let blobs allocate with numpy again. Memory that is
+        already allocated goes back to the pool it came from.
+        """
+        Blob._pool = pool
+
+    @staticmethod
+    def pool():
+        """Returns the current BlobPool, or None if there is none."""
+        return Blob._pool
+
+    def _allocate(self, shape, dtype):
+        """Allocates an uninitialized array, and returns the array together
+        with its pooled memory and pool (both None if no pool is set).
+        """
+        pool = Blob._pool
+        if pool is None:
+            return np.empty(shape, dtype), None, None
+        memory = pool.acquire(shape, dtype)
+        array = memory[:int(np.prod(shape))].reshape(shape)
+        return array, memory, pool
+
+    def _release_data(self):
+        """Drops the data, and returns its memory to the pool if nothing
+        else references it.
+        """
+        self._data = None
+        memory, self._data_memory = self._data_memory, None
+        if memory is not None:
+            # the only references should be the local variable and the
+            # argument of getrefcount.
+            unreferenced = (sys.getrefcount(memory) == 2)
+            self._data_pool.release(memory, unreferenced)
+            self._data_pool = None
+
+    def _release_diff(self):
+        """Drops the diff, and returns its memory to the pool if nothing
+        else references it.
+        """
+        self._diff = None
+        memory, self._diff_memory = self._diff_memory, None
+        if memory is not None:
+            unreferenced = (sys.getrefcount(memory) == 2)
+            self._diff_pool.release(memory, unreferenced)
+            self._diff_pool = None
+
     @staticmethod
     def blob_like(source_blob):
         """Create a blob that is similar to the source blob (same shape, same
@@ -37,8 +103,8 @@ class Blob(object):
 
     def clear(self):
         """Clears a blob data."""
-        self._data = None
-        self._diff = None
+        self._release_data()
+        self._release_diff()
 
     def mirror(self, input_array, shape=None):
         """Create the data as a view of the input array. This is useful to
@@ -52,7 +118,8 @@ class Blob(object):
         # reset the diff
         if (self.has_data() and (self._data.shape != income_data.shape
                                  or self._data.dtype != income_data.dtype)):
-            self._diff = None
+            self._release_diff()
+        self._release_data()
         self._data = income_data
         if shape is not None:
             self._data.shape = shape
@@ -62,6 +129,7 @@ class Blob(object):
         """Create the diff as a view of the input array's diff. This is useful
         to save space and avoid duplication for data layers.
         """
+        self._release_diff()
         if isinstance(input_array, Blob):
             self._diff = input_array.diff()
         else:
@@ -70,6 +138,16 @@ class Blob(object):
             self._diff.shape = shape
         return self.diff()
 
+    def set_buffer(self, buffer):
+        """Sets a SharedBuffer that backs the data of the blob. Once set,
+        init_data() will return views of the buffer instead of allocating its
+        own memory. Pass None to let the blob allocate its own data again.
+        """
+        self._buffer = buffer
+        if buffer is None:
+            self._release_data()
+            self._release_diff()
+
     def has_data(self):
         """Checks if the blob has data."""
         return self._data is not None
@@ -103,9 +181,17 @@ class Blob(object):
         """
         if not(self.has_data() and self._data.shape == shape and \
            self._data.dtype == dtype):
-            self._data = np.empty(shape, dtype)
             # Since we changed the data, the old diff has to be discarded.
-            self._diff = None
+            self._release_data()
+            self._release_diff()
+            if self._buffer is None:
+                self._data, self._data_memory, self._data_pool = \
+                        self._allocate(shape, dtype)
+        if self._buffer is not None:
+            # The buffer may have been grown by another blob sharing it, so we
+            # always obtain a fresh view.
+            self._release_data()
+            self._data = self._buffer.view(shape, dtype)
         if setdata:
             if self._filler is not None:
                 self._filler.fill(self._data)
@@ -124,7 +210,9 @@ class Blob(object):
             if setzero:
                 self._diff[:] = 0
         else:
-            self._diff = np.zeros_like(self._data)
+            self._diff, self._diff_memory, self._diff_pool = self._allocate(
+                self._data.shape, self._data.dtype)
+            self._diff[:] = 0
         return self.diff()
 
     def swap_data(self, other_blob):
@@ -134,6 +222,10 @@ class Blob(object):
                self._data.shape == other_blob._data.shape):
             raise ValueError('Attempting to swap incompatible blobs.')
         self._data, other_blob._data = other_blob._data, self._data
+        self._data_memory, other_blob._data_memory = \
+                other_blob._data_memory, self._data_memory
+        self._data_pool, other_blob._data_pool = \
+                other_blob._data_pool, self._data_pool
     
     def __getstate__(self):
         """When pickling, we will simply store the data field and the
@@ -145,8 +237,234 @@ class Blob(object):
     def __setstate__(self, state):
         """Recovers the state."""
         if state[0] is None:
-            Blob.__init__(self, state[1])
+            Blob.__init__(self, filler=state[1])
         else:
             Blob.__init__(self, state[0].shape, state[0].dtype, state[1])
             self._data[:] = state[0]
 
+
+
+class SharedBuffer(object):
+    """SharedBuffer is a piece of raw memory that can back the data of
+    multiple blobs, as long as the lifetimes of the blobs do not overlap. The
+    buffer grows to the largest size that has ever been requested.
+    """
+    def __init__(self):
+        self._memory = None
+
+    def nbytes(self):
+        """Returns the number of bytes currently held by the buffer."""
+        if self._memory is None:
+            return 0
+        return self._memory.size
+
+    def view(self, shape, dtype):
+        """Returns a c-contiguous array of the given shape and dtype that
+        lives in the buffer.
+        """
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        nbytes = count * dtype.itemsize
+        if self._memory is None or self._memory.size < nbytes:
+            self._memory = np.empty(nbytes, np.uint8)
+        return self._memory[:nbytes].view(dtype).reshape(shape)
+
+
+class Workspace(object):
+    """Workspace is a piece of scratch memory shared by the layers of a net.
+    Layers request temporary arrays from it, such as the im2col buffers of
+    the convolutions, that only live for the duration of a forward() or
+    backward() call. Since the layers run one at a time, the workspace only
+    grows to the largest scratch memory needed by a single call, instead of
+    the sum over the layers that own private buffers.
+
+    Arrays are handed out by bumping an offset within a frame, and are all
+    released when the frame exits:
+        with workspace.frame():
+            col = workspace.array(shape, dtype)
+    Frames can be nested, e.g. when a layer runs its sub-layers. A request
+    that does not fit gets an array of its own, and the workspace grows to
+    the peak usage once the outermost frame exits.
+
+    Every thread gets its own memory, so layers that the net runs in
+    parallel (see Net.set_num_threads()) do not overwrite each other.
+    """
+    # the alignment of the arrays, in bytes.
+    ALIGNMENT = 64
+
+    def __init__(self):
+        self._local = threading.local()
+        # the memory of all the threads, as [memory, offset, depth, peak].
+        self._states = []
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        """Workspaces are pickled and copied empty."""
+        return (Workspace, ())
+
+    def _state(self):
+        """Returns the state of the current thread."""
+        try:
+            return self._local.state
+        except AttributeError:
+            state = self._local.state = [None, 0, 0, 0]
+            with self._lock:
+                self._states.append(state)
+            return state
+
+    @contextlib.contextmanager
+    def frame(self):
+        """Returns a context in which arrays can be requested, and which
+        releases them on exit."""
+        state = self._state()
+        offset = state[1]
+        state[2] += 1
+        try:
+            yield self
+        finally:
+            state[1] = offset
+            state[2] -= 1
+            if state[2] == 0 and (state[0] is None or
+                                  state[0].size < state[3]):
+                state[0] = np.empty(state[3] + Workspace.ALIGNMENT, np.uint8)
+
+    def array(self, shape, dtype):
+        """Returns an uninitialized c-contiguous array of the given shape and
+        dtype, which is valid until the current frame exits.
+        """
+        state = self._state()
+        if not state[2]:
+            raise RuntimeError('Workspace arrays should be requested within '
+                               'a frame.')
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        start = -(-state[1] // Workspace.ALIGNMENT) * Workspace.ALIGNMENT
+        state[1] = start + nbytes
+        state[3] = max(state[3], state[1])
+        memory = state[0]
+        if memory is None or memory.size < state[1] + Workspace.ALIGNMENT:
+            return np.empty(shape, dtype)
+        start += -memory.ctypes.data % Workspace.ALIGNMENT
+        return memory[start:start + nbytes].view(dtype).reshape(shape)
+
+    def nbytes(self):
+        """Returns the number of bytes held by the workspace over all the
+        threads."""
+        with self._lock:
+            return sum(state[0].size for state in self._states
+                       if state[0] is not None)
+
+    def clear(self):
+        """Releases the memory of the workspace. It should not be called while
+        a frame is open."""
+        with self._lock:
+            for state in self._states:
+                state[0] = None
+                state[3] = 0
+
+
+class BlobPool(object):
+    """BlobPool caches the memory released by blobs so that it can be handed
+    out again, which avoids the page faults of fresh allocations when the
+    shapes of the blobs keep changing, e.g. when a net serves requests with
+    varying batch sizes.
+
+    Requests are rounded up to power-of-two size classes, and buffers are
+    cached per size class and dtype. A request is served from a cached buffer
+    of its size class, or of the next larger one, so a blob may hold up to
+    four times the memory it needs. The idle buffers are kept up to the given
+    capacity, and the least recently released ones are evicted first.
+    """
+    # the smallest size class, in bytes.
+    MIN_SIZE = 64
+
+    def __init__(self, capacity=None):
+        """Initializes a pool.
+
+        Input:
+            capacity: the maximum number of bytes of idle memory the pool
+                keeps. If None, the pool keeps all the memory released to it
+                until trim() is called.
+        """
+        self._capacity = capacity
+        self._free = collections.defaultdict(list)
+        # the idle buffers in the order they were released, mapping
+        # id(buffer) to its key.
+        self._lru = collections.OrderedDict()
+        self._bytes_held = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size_class(nbytes):
+        """Returns the size class of the given number of bytes."""
+        return max(1 << (int(nbytes) - 1).bit_length(), BlobPool.MIN_SIZE)
+
+    def acquire(self, shape, dtype):
+        """Returns a 1-dim buffer of the given dtype that can hold an array of
+        the given shape. The content of the buffer is undefined.
+        """
+        dtype = np.dtype(dtype)
+        size_class = BlobPool._size_class(
+            int(np.prod(shape)) * dtype.itemsize)
+        with self._lock:
+            for key in [(size_class, dtype), (size_class * 2, dtype)]:
+                if self._free[key]:
+                    memory = self._free[key].pop()
+                    del self._lru[id(memory)]
+                    self._bytes_held -= memory.nbytes
+                    self._hits += 1
+                    return memory
+            self._misses += 1
+        return np.empty(size_class / dtype.itemsize, dtype)
+
+    def release(self, memory, recycle=True):
+        """Releases a buffer obtained from acquire(). If recycle is False,
+        for example because the buffer is still referenced elsewhere, the
+        buffer is left to the garbage collector.
+        """
+        if not recycle:
+            return
+        key = (BlobPool._size_class(memory.nbytes), memory.dtype)
+        with self._lock:
+            self._free[key].append(memory)
+            self._lru[id(memory)] = key
+            self._bytes_held += memory.nbytes
+            if self._capacity is not None:
+                self._evict(self._capacity)
+
+    def _evict(self, max_bytes):
+        """Evicts the least recently released buffers until at most max_bytes
+        are held. Should be called with the lock held.
+        """
+        while self._bytes_held > max_bytes:
+            buffer_id, key = self._lru.popitem(last=False)
+            free = self._free[key]
+            for i, memory in enumerate(free):
+                if id(memory) == buffer_id:
+                    del free[i]
+                    break
+            self._bytes_held -= memory.nbytes
+            self._evictions += 1
+
+    def trim(self, max_bytes=0):
+        """Evicts idle buffers until at most max_bytes are held, and returns
+        the number of bytes freed.
+        """
+        with self._lock:
+            bytes_held = self._bytes_held
+            self._evict(max_bytes)
+            return bytes_held - self._bytes_held
+
+    def stats(self):
+        """Returns a dict with the number of hits and misses of acquire(), the
+        number of evicted buffers, and the number of bytes held by the idle
+        buffers.
+        """
+        with self._lock:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions,
+                    'bytes_held': self._bytes_held}
@@ -1,14 +1,19 @@
 """base.py implements the basic data types.
 """
 
+import copy
 import cPickle as pickle
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import cStringIO as StringIO
+import hashlib
 import logging
 import networkx as nx
 import numpy as np
+import struct
 
-from decaf._blob import Blob
-from decaf.puff import Puff
+from decaf._blob import Blob, BlobPool, SharedBuffer, Workspace
+from decaf.puff import IndexedPuff, Puff
+from decaf.util.scheduler import DAGScheduler
 
 class DecafError(Exception):
     """NOOOOOOO! I need caffeine!
@@ -61,6 +66,7 @@ class Layer(object):
         self.name = self.spec['name']
         self.freeze = self.spec.get('freeze', False)
         self._param = []
+        self._workspace = None
 
     def forward(self, bottom, top):
         """Computes the forward pass.
@@ -80,6 +86,86 @@ class Layer(object):
         """
         return self.forward(bottom, top)
 
+    def recompute(self, bottom, top):
+        """Recomputes the forward pass. This is called when the net
+        recomputes the blobs it discarded to save memory (see
+        Net.set_checkpoints()), and should reproduce the output of the last
+        forward() call. Layers with randomness, such as dropout, should
+        override it to reuse their random state.
+
+        In default, the recompute() function will simply call forward.
+        """
+        return self.forward(bottom, top)
+
+    def quantize(self, input_scale):
+        """Converts the weights of the layer to int8 for inference, see
+        decaf.util.quantize. After quantization the layer only supports the
+        forward pass. Returns True if the layer supports quantization, in
+        which case its param() list holds the quantized weights afterwards.
+
+        Input:
+            input_scale: the scale used to quantize the input of the layer,
+                i.e. the input is quantized as round(input / input_scale). If
+                None, the scale is computed from every input on the fly.
+        In default, the layer does not support quantization and the function
+        returns False.
+        """
+        return False
+
+    def release_buffers(self):
+        """Releases the intermediate buffers that the layer keeps from the
+        forward pass for the backward pass. This is called by the net when it
+        is going to call recompute() before backward() anyway.
+
+        In default, the function does nothing.
+        """
+        pass
+
+    def set_workspace(self, workspace):
+        """Sets the Workspace that the layer requests its temporary arrays
+        from. This is called by the net, which shares a single workspace among
+        all its layers. Layers that contain other layers should pass the
+        workspace on to them.
+        """
+        self._workspace = workspace
+
+    def workspace(self):
+        """Returns the workspace of the layer. A layer that does not belong
+        to a net gets a workspace of its own.
+        """
+        if getattr(self, '_workspace', None) is None:
+            self.set_workspace(Workspace())
+        return self._workspace
+
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """Computes the shapes of the top blobs from the shapes of the bottom
+        blobs without running the layer. This is used by Net.finish() to
+        preallocate the blobs before the first pass (see its input_shapes
+        argument). The top blobs are assumed to have the dtype of the first
+        bottom blob.
+
+        Input:
+            bottom_shapes: a list of the shapes of the bottom blobs.
+            num_tops: the number of top blobs.
+        Output:
+            top_shapes: a list of the shapes of the top blobs, or None if the
+                layer cannot infer them, in which case the net runs the layer
+                once on zeros to find out.
+        In default, the function returns None.
+        """
+        return None
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Returns the number of floating point operations of a forward pass
+        with the given bottom and top shapes, as reported by
+        Net.cost_table().
+
+        In default, the function counts one operation per output value, or
+        none if the layer only mirrors its input.
+        """
+        if self.is_mirror():
+            return 0
+        return sum(int(np.prod(shape)) for shape in top_shapes)
 
     def backward(self, bottom, top, propagate_down):
         """Computes the backward pass.
@@ -109,6 +195,83 @@ class Layer(object):
         """
         return self._param
 
+    def is_mirror(self):
+        """Returns True if the outputs of the layer's predict() are simply
+        views of its bottom blobs (as done by e.g. the split layer), in which
+        case the outputs share memory with the bottom blobs. If the layer has
+        a single bottom, all the top blobs are views of it; otherwise, each
+        top blob is a view of the bottom blob at the same index.
+
+        In default, the function returns False.
+        """
+        return False
+
+    def supports_inplace(self):
+        """Returns True if the layer is an elementwise layer with a single
+        bottom and a single top that can compute its forward and backward
+        passes in place. When the net runs the layer in place, the bottom and
+        top lists share the same blob (i.e. bottom[0] is top[0]), and the
+        layer should read and write the same data and diff.
+
+        In default, the function returns False.
+        """
+        return False
+
+    def backward_needs_top_data(self):
+        """Returns True if the backward pass of the layer reads the data of
+        its top blobs. If not, a following layer may overwrite the top blobs
+        in place.
+
+        In default, the function conservatively returns True.
+        """
+        return True
+
+    def fuse_relu(self, fuse=True):
+        """Asks the layer to apply a ReLU operation to its (single) output
+        as part of its own forward pass, and to account for it in its backward
+        pass. This is used by the net optimizer to remove separate ReLU
+        layers. Calling it with fuse=False should undo the fusion.
+
+        Output:
+            supported: True if the layer supports the fusion.
+        In default, the function returns False.
+        """
+        return False
+
+    def fuse_padding(self, pad):
+        """Asks the layer to pad its (single) input with pad zeros on each
+        side of the two spatial axes before using it, so that a preceding
+        zero padding layer can be removed. Calling it with pad=0 should undo
+        the fusion.
+
+        Output:
+            supported: True if the layer supports the fusion.
+        In default, the function returns False.
+        """
+        return False
+
+    def is_reshape(self):
+        """Returns True if the outputs of the layer are views of its bottom
+        blobs with a different shape, as done by the flatten layer. Unlike
+        other mirroring layers, such layers are only removed by
+        Net.simplify() if the layers using their output can flatten their
+        input themselves (see fuse_flatten()).
+
+        In default, the function returns False.
+        """
+        return False
+
+    def fuse_flatten(self, fuse=True):
+        """Asks the layer to flatten its (single) input to a matrix with one
+        row per data point before using it, so that a preceding flatten layer
+        can be removed. Calling it with fuse=False should undo the fusion.
+
+        Output:
+            supported: True if the layer supports the fusion.
+        In default, the function returns False.
+        """
+        return False
+
 
 # pylint: disable=R0921
 class DataLayer(Layer):
@@ -135,6 +298,67 @@ class DataLayer(Layer):
         """
         pass
 
+    def output_dtype(self, dtype):
+        """Returns the dtype the layer should emit for data of the given dtype.
+        If the layer has a 'dtype' spec, floating point data is converted to
+        it; other data, such as integer labels, is never converted.
+        """
+        target = self.spec.get('dtype', None)
+        if target is not None and np.issubdtype(dtype, np.floating):
+            return np.dtype(target)
+        return dtype
+
+    def forward_tops(self, bottom, top, needed):
+        """Advances to the next data like forward(), but only needs to fill
+        the top blobs at the positions in needed; the other top blobs may be
+        left untouched. data_indices() then reports the data points as after
+        forward(). This lets the prefix cache (see Net.enable_prefix_cache())
+        skip loading the data whose activations are cached.
+
+        In default, the function runs forward(), filling all the top blobs.
+        """
+        self.forward(bottom, top)
+
+    def fill_tops(self, bottom, top, needed):
+        """Fills the top blobs at the positions in needed with the data
+        points of the last forward_tops() call, which skipped them.
+
+        In default, the function does nothing, since the default
+        forward_tops() fills all the top blobs.
+        """
+        pass
+
+    def infer_data_shapes(self, bottom, num_tops):
+        """Computes the shapes and dtypes of the top blobs without generating
+        any data, so that Net.finish() can infer the shapes of the net (see
+        its input_shapes argument) without consuming a minibatch.
+
+        Input:
+            bottom: a list of the (shape, dtype) pairs of the bottom blobs.
+            num_tops: the number of top blobs.
+        Output:
+            top: a list of the (shape, dtype) pairs of the top blobs, or None
+                if the layer cannot infer them, in which case their shapes
+                should be given to finish().
+        In default, the function returns None.
+        """
+        return None
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Data layers do not compute anything."""
+        return 0
+
+    def data_indices(self):
+        """Returns the indices, within the data set, of the data points
+        emitted by the last forward() call, as an integer array. This lets the
+        net cache the activations computed from them (see
+        Net.enable_prefix_cache()).
+
+        In default, the function returns None, meaning that the data points
+        can not be identified (for example when they are randomly augmented).
+        """
+        return None
+
 
 # pylint: disable=R0921
 class LossLayer(Layer):
@@ -164,6 +388,14 @@ class LossLayer(Layer):
     def update(self):
         pass
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The loss layer has no top blobs."""
+        return []
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts a few operations per input value."""
+        return 2 * int(np.prod(bottom_shapes[0]))
+
 
 class SplitLayer(Layer):
     """A layer that splits a blob to multiple blobs."""
@@ -196,6 +428,14 @@ class SplitLayer(Layer):
         """Split has nothing to update."""
         pass
 
+    def is_mirror(self):
+        """The split layer simply mirrors its input."""
+        return True
+
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """All the top blobs have the shape of the bottom blob."""
+        return [bottom_shapes[0]] * num_tops
+
 
 class Solver(object):
     """This is the very basic form of the solver."""
@@ -241,6 +481,115 @@ class Regularizer(object):
 
 DECAF_PREFIX = '_decaf'
 
+# The magic string at the beginning of a model file written by Net.save(),
+# and the alignment of the parameter arrays in the file.
+_MODEL_MAGIC = 'DECAFNET'
+_MODEL_VERSION = 1
+_MODEL_ALIGNMENT = 64
+
+
+def _align(offset):
+    """Rounds the offset up to a multiple of _MODEL_ALIGNMENT."""
+    return (offset + _MODEL_ALIGNMENT - 1) / _MODEL_ALIGNMENT \
+            * _MODEL_ALIGNMENT
+
+
+def _write_model(filename, name, layers):
+    """Writes the model file. See Net.save() for the format.
+
+    Input:
+        filename: the output file name.
+        name: the name of the net.
+        layers: a dict mapping layer names to (layer, needs, provides).
+    """
+    # collect the parameters and compute their offsets.
+    params = []
+    index = {}
+    offset = 0
+    for layername in sorted(layers):
+        for blob in layers[layername][0].param():
+            if id(blob) in index or not blob.has_data():
+                continue
+            data = blob.data()
+            index[id(blob)] = len(params)
+            params.append((offset, data.shape, data.dtype.str, blob._filler))
+            offset = _align(offset + data.nbytes)
+    header = StringIO.StringIO()
+    pickle.dump((_MODEL_VERSION, name, params), header,
+                protocol=pickle.HIGHEST_PROTOCOL)
+    # the layers are pickled with their parameter blobs replaced by
+    # references to the parameter table.
+    pickler = pickle.Pickler(header, protocol=pickle.HIGHEST_PROTOCOL)
+    def persistent_id(obj):
+        if isinstance(obj, Blob) and id(obj) in index:
+            return index[id(obj)]
+        return None
+    pickler.persistent_id = persistent_id
+    pickler.dump(layers)
+    header = header.getvalue()
+    data_start = _align(len(_MODEL_MAGIC) + 8 + len(header))
+    with open(filename, 'wb') as fid:
+        fid.write(_MODEL_MAGIC)
+        fid.write(struct.pack('<Q', len(header)))
+        fid.write(header)
+        written = set()
+        for layername in sorted(layers):
+            for blob in layers[layername][0].param():
+                if id(blob) not in index or id(blob) in written:
+                    continue
+                param_offset = params[index[id(blob)]][0]
+                fid.write('\0' * (data_start + param_offset - fid.tell()))
+                fid.write(np.ascontiguousarray(blob.data()).data)
+                written.add(id(blob))
+        fid.write('\0' * (data_start + offset - fid.tell()))
+
+
+def _read_model(filename, mmap=False):
+    """Reads a model file written by _write_model(), or a legacy pickled net.
+
+    Input:
+        filename: the input file name.
+        mmap: if True, the parameters are memory-mapped read-only.
+    Output:
+        name: the name of the net.
+        layers: a dict mapping layer names to (layer, needs, provides).
+    """
+    with open(filename, 'rb') as fid:
+        if fid.read(len(_MODEL_MAGIC)) != _MODEL_MAGIC:
+            # legacy format: the whole net is pickled.
+            fid.seek(0)
+            contents = pickle.load(fid)
+            return contents[0], contents[1]
+        header_size = struct.unpack('<Q', fid.read(8))[0]
+        header = fid.read(header_size)
+        data_start = _align(len(_MODEL_MAGIC) + 8 + header_size)
+        unpickler = pickle.Unpickler(StringIO.StringIO(header))
+        version, name, params = unpickler.load()
+        if version > _MODEL_VERSION:
+            raise DecafError('Unsupported model version: %d' % version)
+        if len(params) == 0:
+            memory = None
+        elif mmap:
+            memory = np.memmap(filename, dtype=np.uint8, mode='r',
+                               offset=data_start)
+        else:
+            fid.seek(data_start)
+            memory = np.fromfile(fid, dtype=np.uint8)
+    blobs = {}
+    def persistent_load(pid):
+        if pid not in blobs:
+            offset, shape, dtype, filler = params[pid]
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            blob = Blob(filler=filler)
+            blob.mirror(memory[offset:offset + nbytes].view(dtype)
+                        .reshape(shape))
+            blobs[pid] = blob
+        return blobs[pid]
+    unpickler.persistent_load = persistent_load
+    layers = unpickler.load()
+    return name, layers
+
 
 class Net(object):
     """A Net is a directed graph with layer names and layer instances."""
@@ -263,6 +612,13 @@ class Net(object):
         # provides is a dictionary that maps layer names to a list of blob
         # names that it provides.
         self.provides = {}
+        # producer maps blob names to the name of the layer providing it, and
+        # consumers maps blob names to the names of the layers needing it.
+        # They are updated incrementally, together with the graph.
+        self._producer = {}
+        self._consumers = defaultdict(list)
+        # The split layers inserted by _generate_graph().
+        self._split_layers = []
         # The parameters below will be automaticall inferred 
         # The counts for blobs
         self._need_count = defaultdict(int)
@@ -276,6 +632,72 @@ class Net(object):
         # by the predict() function. We only store the blob names.
         self._output_blobs = None
         self._params = None
+        # The blobs that the memory planner should preserve. If None, memory
+        # planning is disabled.
+        self._memory_keep = None
+        # The names of the blobs whose data may be overwritten by other blobs
+        # under the current memory plan.
+        self._shared_blobs = set()
+        # Whether elementwise layers should run in place, and the names of the
+        # layers that currently do so.
+        self._inplace = False
+        self._inplace_layers = set()
+        # Whether the optimizer should fuse layers, and the names of the
+        # layers that are currently fused into other layers.
+        self._optimize = False
+        self._fused_layers = set()
+        # Whether the net should be simplified for prediction, and the names
+        # of the layers that are currently removed by the simplification.
+        self._simplify = False
+        self._simplified_layers = set()
+        # Maps the blobs that share the blob object of another blob, due to
+        # in-place computation or fusion, to the name of the other blob.
+        self._blob_alias = {}
+        # The scheduler to run independent layers in parallel, and for each
+        # entry in the forward and backward orders, the indices of the entries
+        # that should finish before it starts. The memory plan adds more
+        # dependencies to the forward pass, since blobs sharing a buffer
+        # should not be alive at the same time.
+        self._scheduler = None
+        self._forward_deps = None
+        self._backward_deps = None
+        self._memory_deps = []
+        # The pruned forward orders used by predict(), cached for each set of
+        # requested output blobs.
+        self._predict_plans = {}
+        # The blobs kept by activation checkpointing. If None, checkpointing
+        # is disabled.
+        self._checkpoints = None
+        self._checkpoint_plan = None
+        # If True, the net shares its parameters with another net, and can
+        # only be used for prediction. See clone_for_inference().
+        self._inference_only = False
+        # the clones and the scheduler used by predict() with workers (see
+        # _get_workers()), and the per-data shapes and dtypes of the outputs
+        # it has computed.
+        self._workers = None
+        self._worker_layouts = {}
+        # The shapes of the blobs given to finish(), and the shapes and dtypes
+        # of all the blobs and the per-layer costs inferred from them.
+        self._input_shapes = None
+        self._blob_shapes = {}
+        self._cost_table = None
+        # The batch sizes that predict() pads its inputs to, the memory budget
+        # of the plans, and the plans kept for each batch size and input
+        # signature in least recently used order. See set_batch_buckets().
+        self._buckets = None
+        self._bucket_max_bytes = None
+        self._bucket_plans = OrderedDict()
+        # The file name prefix of the activation cache of the frozen prefix of
+        # the net, the cache of each boundary blob, the plan splitting the
+        # forward order, and the hash of the cached computation (see
+        # _prefix_key()). See enable_prefix_cache().
+        self._prefix_cache = None
+        self._prefix_puffs = {}
+        self._prefix_plan = None
+        self._prefix_key_value = None
+        # The scratch memory shared by the layers, see Layer.workspace().
+        self._workspace = Workspace()
         self._finished = False
 
     def save(self, filename, store_full=False):
@@ -287,8 +709,16 @@ class Net(object):
         data layers and loss layers. If store_full is False, the data and loss
         layers are stripped and not stored - this will enable one to just keep
         necessary layers for future use.
+
+        The file starts with the magic string 'DECAFNET' and the size of the
+        header as a little-endian uint64. The header contains the pickled
+        parameter table (the offset, shape, dtype and filler of each
+        parameter) and the pickled layers, whose parameter blobs are stored
+        as references to the table. The raw parameter data follows the
+        header, with each parameter aligned to 64 bytes, so that it can be
+        memory-mapped by load().
         """
-        output = [self.name, {}]
+        layers = {}
         for name, layer in self.layers.iteritems():
             if (not store_full and
                 (isinstance(layer, DataLayer) or 
@@ -297,24 +727,30 @@ class Net(object):
                 # We do not need to store these layers.
                 continue
             else:
-                output[1][name] = (layer, self.needs[name], self.provides[name])
-        # finally, pickle the content.
-        file = open(filename, 'wb')
-        pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+                layers[name] = (layer, self.needs[name], self.provides[name])
+        _write_model(filename, self.name, layers)
 
     @staticmethod
-    def load(filename):
-        """Loads a network from file."""
+    def load(filename, mmap=False):
+        """Loads a network from file.
+
+        Input:
+            filename: the file written by save(). Files written by older
+                versions of decaf (pickled nets) are also supported.
+            mmap: if True, the parameters are memory-mapped read-only from
+                the file instead of being read into memory, so multiple
+                processes loading the same file share one copy. The net can
+                then only be used for prediction, since the parameters cannot
+                be updated.
+        """
         self = Net()
-        file = open(filename, 'rb')
-        contents = pickle.load(file)
-        self.name = contents[0]
-        for layer, needs, provides in contents[1].values():
+        self.name, layers = _read_model(filename, mmap)
+        for layer, needs, provides in layers.values():
             self.add_layer(layer, needs=needs, provides=provides)
         self.finish()
         return self
 
-    def load_from(self, filename):
+    def load_from(self, filename, mmap=False):
         """Load the parameters from an existing network.
 
         Unlike load, this function should be called on an already constructed
@@ -322,12 +758,16 @@ class Net(object):
         layer in the file that has the same name as a layer name defined in
         the current network, replace the current network's corresponding layer
         with the layer in the file.
+
+        Input:
+            filename: the file written by save().
+            mmap: if True, the parameters are memory-mapped read-only. See
+                load() for details.
         """
-        file = open(filename, 'rb')
-        contents = pickle.load(file)
-        for name in contents[1]:
+        _, layers = _read_model(filename, mmap)
+        for name in layers:
             if name in self.layers:
-                self.layers[name] = contents[1][name][0]
+                self.layers[name] = layers[name][0]
         # after loading, we need to re-parse the layer to fix all reference
         # issues.
         self.finish()
@@ -351,26 +791,28 @@ class Net(object):
             needs = [needs]
         if type(provides) is str:
             provides = [provides]
-        self._finished = False
-        # Add the layer
         if layer.name in self.layers or layer.name in self.blobs:
             raise InvalidNetError('A name already exists: %s' % layer.name)
-        self.layers[layer.name] = layer
-        # Add the blobs
-        # TODO: the current check may be slow, consider rewriting.
-        already_provided = sum(self.provides.values(), [])
         for blobname in provides:
-            if blobname in already_provided:
+            if blobname in self._producer:
                 raise InvalidNetError(
                     'Blob %s already provided by another layer.' % blobname)
         for blobname in needs + provides:
-            if blobname in self.layers:
+            if blobname in self.layers or blobname == layer.name:
                 raise InvalidNetError(
                     'Blob name found as a layer name: %s' % blobname)
-            elif blobname not in self.blobs:
+        # Add the layer and the blobs
+        self.layers[layer.name] = layer
+        for blobname in needs + provides:
+            if blobname not in self.blobs:
                 self.blobs[blobname] = Blob()
-        for name in needs: 
-            self._need_count[name] += 1
+        for blobname in needs:
+            self._need_count[blobname] += 1
+            self._consumers[blobname].append(layer.name)
+            self.graph.add_edge(blobname, layer.name)
+        for blobname in provides:
+            self._producer[blobname] = layer.name
+            self.graph.add_edge(layer.name, blobname)
         self.needs[layer.name] = list(needs)
         self.provides[layer.name] = list(provides)
         self._actual_needs = None
@@ -405,8 +847,48 @@ class Net(object):
             self.add_layer(layers[-1], needs=Net._make_output_name(layers[-2]),
                            provides=provides)
 
-    def finish(self):
-        """Call this function when you finish the network construction."""
+    def finish(self, inplace=None, optimize=None, input_shapes=None,
+               simplify=None):
+        """Call this function when you finish the network construction.
+
+        Input:
+            inplace: if True, elementwise layers (such as ReLU, sigmoid and
+                dropout) whose bottom blob is not used by any other layer
+                compute their output in place, sharing the data and diff of
+                the bottom blob. Their bottom blobs will then hold the output
+                after a forward pass. If None, the previous setting is kept
+                (in default, in-place computation is disabled).
+            optimize: if True, ReLU layers are fused into the layer producing
+                their input (convolution and inner product layers), or into
+                the max pooling layer using their output. The ReLU output blob
+                then shares the blob of its input; see optimize() for details.
+                If None, the previous setting is kept (in default, fusion is
+                disabled).
+            input_shapes: a dict mapping the input blobs of the net to their
+                shapes (including the batch size), or to (shape, dtype) pairs
+                if their dtype is not float32. The outputs of data layers may
+                be given as well; otherwise the data layers infer them (see
+                DataLayer.infer_data_shapes()). Data layers are never run to
+                find out their shapes. If given, the shapes and dtypes of all
+                the blobs are inferred (see Layer.infer_shapes()), the blobs
+                and the buffers of the layers are allocated by running the
+                predict pass once on zeros, and the costs of the layers are
+                computed (see cost_table()). An empty dict disables the
+                inference. If None, the previous setting is kept.
+            simplify: if True, the net is simplified for prediction: no split
+                layers are inserted, and the layers that only mirror their
+                input are removed; see simplify() for details. If None, the
+                previous setting is kept (in default, simplification is
+                disabled).
+        """
+        if inplace is not None:
+            self._inplace = inplace
+        if optimize is not None:
+            self._optimize = optimize
+        if simplify is not None:
+            self._simplify = simplify
+        if input_shapes is not None:
+            self._input_shapes = dict(input_shapes)
         # validate and generate the graph
         self._generate_graph()
         try:
@@ -448,6 +930,24 @@ class Net(object):
         layerorder = [name for name in topological_order
                       if name in self.layers]
         logging.debug('Layer order: %s', str(layerorder))
+        # undo the blob aliasing of the previous fusion and in-place plans.
+        for blobname in self._blob_alias:
+            self.blobs[blobname] = Blob()
+        self._blob_alias = {}
+        self._inplace_layers = set()
+        self._fused_layers = set()
+        self._simplified_layers = set()
+        for layer in self.layers.itervalues():
+            layer.fuse_relu(False)
+            layer.fuse_flatten(False)
+            layer.fuse_padding(0)
+            layer.set_workspace(self._workspace)
+        if self._simplify:
+            layerorder = self._simplify_layers(layerorder)
+        if self._optimize:
+            layerorder = self._fuse_layers(layerorder)
+        if self._inplace:
+            self._plan_inplace(layerorder)
         self._forward_order = []
         for n in layerorder:
             self._forward_order.append(
@@ -469,20 +969,1052 @@ class Net(object):
         for name in layerorder:
             self._params.extend(self.layers[name].param())
         # Note: Any further finishing code should be inserted here.
+        self._memory_deps = []
+        if self._memory_keep is not None:
+            self._plan_memory()
+        self._compute_dependencies()
+        if self._checkpoints is not None:
+            self._plan_checkpoints()
+        if self._prefix_cache is not None:
+            self._plan_prefix_cache()
+        self._blob_shapes = {}
+        self._cost_table = None
+        if self._input_shapes:
+            self._infer_shapes()
+            self._warm_up()
+            self._compute_cost_table()
         self._finished = True
     
     def params(self):
         """Return a list of parameters used in the network."""
         return self._params
 
+    def _infer_shapes(self):
+        """Infers the shapes and dtypes of all the blobs from the shapes given
+        to finish(). See finish() for details.
+        """
+        shapes = {}
+        for name, spec in self._input_shapes.iteritems():
+            if name not in self.blobs:
+                raise InvalidNetError(
+                    'Unknown blob in input_shapes: %s' % name)
+            if (len(spec) == 2 and isinstance(spec[0], (tuple, list))):
+                shape, dtype = spec
+            else:
+                shape, dtype = spec, np.float32
+            shapes[name] = (tuple(int(dim) for dim in shape), np.dtype(dtype))
+        for name in self._input_blobs:
+            if name not in shapes:
+                raise InvalidNetError(
+                    'The shape of input blob %s is not given.' % name)
+        # the blobs of fused layers share the blob of another blob.
+        def owner(blobname):
+            while blobname in self._blob_alias:
+                blobname = self._blob_alias[blobname]
+            return blobname
+        for name, layer, _, _ in self._forward_order:
+            provides = self.provides[name]
+            if provides and all(blobname in shapes for blobname in provides):
+                continue
+            bottom = [shapes[owner(blobname)]
+                      for blobname in self._actual_needs[name]]
+            if isinstance(layer, DataLayer):
+                # running a data layer would consume its data.
+                top = layer.infer_data_shapes(bottom, len(provides))
+                if top is None:
+                    raise InvalidNetError(
+                        'Data layer %s cannot infer the shapes of its'
+                        ' outputs. Give the shapes of %s in input_shapes.'
+                        % (name, ', '.join(provides)))
+                shapes.update(zip(provides, [
+                    (tuple(int(dim) for dim in shape), np.dtype(dtype))
+                    for shape, dtype in top]))
+                continue
+            top_shapes = None
+            if bottom:
+                top_shapes = layer.infer_shapes(
+                    [shape for shape, _ in bottom], len(provides))
+            if top_shapes is None:
+                top = Net._dry_run(layer, bottom, len(provides))
+            else:
+                top = [(tuple(int(dim) for dim in shape), bottom[0][1])
+                       for shape in top_shapes]
+            shapes.update(zip(provides, top))
+        for blobname in self._blob_alias:
+            shapes[blobname] = shapes[owner(blobname)]
+        self._blob_shapes = shapes
+
+    @staticmethod
+    def _dry_run(layer, bottom, num_tops):
+        """Runs the predict pass of a layer on zeros with the given bottom
+        shapes and dtypes, and returns the shapes and dtypes of its top blobs.
+        """
+        bottom = [Blob(shape, dtype) for shape, dtype in bottom]
+        top = [Blob() for _ in range(num_tops)]
+        layer.predict(bottom, top)
+        return [(blob.data().shape, blob.data().dtype) for blob in top]
+
+    def _generated_blobs(self):
+        """Returns the names of the input blobs and the blobs produced by data
+        layers."""
+        generated = set(self._input_blobs)
+        for name, layer, _, _ in self._forward_order:
+            if isinstance(layer, DataLayer):
+                generated.update(self.provides[name])
+        return generated
+
+    def _warm_up(self):
+        """Allocates the blobs and the buffers of the layers by running the
+        predict pass once on zeros of the inferred shapes. The data layers are
+        not run.
+        """
+        for blobname in self._generated_blobs():
+            shape, dtype = self._blob_shapes[blobname]
+            self.blobs[blobname].mirror(np.zeros(shape, dtype))
+        forward_order, forward_deps = self._select_forward(
+            [idx for idx, entry in enumerate(self._forward_order)
+             if not isinstance(entry[1], DataLayer)])
+        self._run_forward(True, forward_order, forward_deps)
+        for blobname, (shape, _) in self._blob_shapes.iteritems():
+            blob = self.blobs[blobname]
+            if blob.has_data() and blob.data().shape != shape:
+                raise DecafError(
+                    'Blob %s has shape %s, but its shape was inferred as %s.'
+                    % (blobname, str(blob.data().shape), str(shape)))
+
+    def _compute_cost_table(self):
+        """Computes the cost table. See cost_table() for details."""
+        self._cost_table = []
+        for name, layer, _, _ in self._forward_order:
+            bottom_shapes = [self._blob_shapes[blobname][0]
+                             for blobname in self._actual_needs[name]]
+            top = [self._blob_shapes[blobname]
+                   for blobname in self.provides[name]]
+            if layer.is_mirror() or name in self._inplace_layers:
+                activation_bytes = 0
+            else:
+                activation_bytes = sum(int(np.prod(shape)) * dtype.itemsize
+                                       for shape, dtype in top)
+            self._cost_table.append({
+                'name': name,
+                'type': layer.__class__.__name__,
+                'output_shapes': [shape for shape, _ in top],
+                'flops': int(layer.flops(bottom_shapes,
+                                         [shape for shape, _ in top])),
+                'param_bytes': sum(param.data().nbytes
+                                   for param in layer.param()
+                                   if param.has_data()),
+                'activation_bytes': activation_bytes})
+        logging.info('Net %s: %.3f GFLOPs, %d parameter bytes and %d'
+                     ' activation bytes per forward pass.', self.name,
+                     sum(row['flops'] for row in self._cost_table) / 1e9,
+                     sum(row['param_bytes'] for row in self._cost_table),
+                     sum(row['activation_bytes'] for row in self._cost_table))
+
+    def cost_table(self):
+        """Returns the costs of the layers for the shapes given to finish(),
+        which can be used to choose the batch size or the number of nodes
+        before running a job.
+
+        Output:
+            table: a list with one dict per layer, in the forward order, with
+                the keys 'name', 'type', 'output_shapes', 'flops' (of the
+                forward pass), 'param_bytes', and 'activation_bytes' (of the
+                top blobs, which is 0 if the layer runs in place or mirrors
+                its input). Layers fused into other layers are not listed.
+        """
+        if self._cost_table is None:
+            raise DecafError(
+                'Call finish() with input_shapes to compute the costs.')
+        return self._cost_table
+
+    def blob_shapes(self):
+        """Returns a dict mapping the blob names to their (shape, dtype) pairs
+        inferred by finish() from its input_shapes.
+        """
+        return dict(self._blob_shapes)
+
+    def set_num_threads(self, num_threads):
+        """Sets the number of threads used to run the net. With more than one
+        thread, forward_backward() and predict() schedule every layer whose
+        inputs are ready onto a thread pool, so that independent branches of
+        the net (such as the towers of a translated cuda-convnet model, or
+        multiple loss heads) run in parallel. The backward pass is scheduled
+        the same way.
+
+        This pays off when the layers spend their time in numpy, BLAS or our
+        C++ kernels, which release the interpreter lock. Note that layers
+        sharing the same parameter blobs should not be run in parallel.
+
+        Input:
+            num_threads: the number of threads. 1 (the default) runs the
+                layers one by one in the topological order.
+        """
+        if num_threads < 1:
+            raise DecafError('The number of threads should be positive.')
+        if self._scheduler is not None:
+            self._scheduler.close()
+        if num_threads == 1:
+            self._scheduler = None
+        else:
+            self._scheduler = DAGScheduler(num_threads)
+
+    def close(self):
+        """Stops the threads that the net keeps for running its layers in
+        parallel (see set_num_threads()), as well as those of the clones of
+        the batch size buckets, and drops the workers of predict(). They are
+        created again when needed, so the net can still be used.
+        """
+        if self._scheduler is not None:
+            self._scheduler.close()
+        self._close_workers()
+        for plan in self._bucket_plans.itervalues():
+            plan[0].close()
+
+    def set_checkpoints(self, blob_names):
+        """Enables activation checkpointing for training. During
+        forward_backward(), only the given blobs (together with the input
+        blobs, the outputs of the data layers, the inputs of the loss layers
+        and the blobs shared by in-place or fused layers) are kept after the
+        forward pass. Every other blob is discarded as soon as the last layer
+        reading it has run, and layers producing discarded blobs release
+        their intermediate buffers. During the backward pass, the discarded
+        blobs are recomputed from the nearest kept blobs when needed, using
+        the layers' recompute() function, which lets layers with randomness
+        such as dropout reuse their state. This trades extra computation for
+        lower memory; the outputs of pooling layers are good checkpoints.
+
+        The checkpointed passes run sequentially, regardless of the number of
+        threads set by set_num_threads().
+
+        Input:
+            blob_names: a list of blob names to keep. If None, checkpointing
+                is disabled.
+        """
+        if type(blob_names) is str:
+            blob_names = [blob_names]
+        if blob_names is not None:
+            for name in blob_names:
+                if name not in self.blobs:
+                    raise InvalidNetError('Unknown blob: %s' % name)
+            blob_names = list(blob_names)
+        self._checkpoints = blob_names
+        self._checkpoint_plan = None
+        if self._finished and blob_names is not None:
+            self._plan_checkpoints()
+
+    def _plan_checkpoints(self):
+        """Computes which blobs are discarded under checkpointing, and when.
+        """
+        keep = set(self._checkpoints + self._input_blobs + self._output_blobs)
+        for name, layer, _, _ in self._forward_order:
+            if isinstance(layer, DataLayer):
+                keep.update(self.provides[name])
+            elif isinstance(layer, LossLayer):
+                keep.update(self._actual_needs[name])
+        for blobname, source in self._blob_alias.iteritems():
+            keep.add(blobname)
+            keep.add(source)
+        producer = {}
+        last_reader = {}
+        for idx, (name, _, _, _) in enumerate(self._forward_order):
+            for blobname in self.provides[name]:
+                producer[blobname] = idx
+            for blobname in self._actual_needs[name]:
+                last_reader[blobname] = name
+        discard = set(blobname for blobname in producer
+                      if blobname not in keep and blobname in last_reader)
+        discard_after = defaultdict(list)
+        for blobname in discard:
+            discard_after[last_reader[blobname]].append(blobname)
+        recompute = set(name for name, _, _, _ in self._forward_order
+                        if any(blobname in discard
+                               for blobname in self.provides[name]))
+        self._checkpoint_plan = (discard, discard_after, recompute, producer)
+        logging.info('Checkpointing: %d blobs are recomputed by %d layers.',
+                     len(discard), len(recompute))
+
+    def _restore_blobs(self, blob_names):
+        """Recomputes the given blobs if they were discarded by
+        checkpointing, together with the discarded blobs they depend on.
+        """
+        producer = self._checkpoint_plan[3]
+        to_run = set()
+        stack = [name for name in blob_names
+                 if not self.blobs[name].has_data()]
+        while stack:
+            idx = producer[stack.pop()]
+            if idx in to_run:
+                continue
+            to_run.add(idx)
+            stack.extend(name for name
+                         in self._actual_needs[self._forward_order[idx][0]]
+                         if not self.blobs[name].has_data())
+        for idx in sorted(to_run):
+            _, layer, bottom, top = self._forward_order[idx]
+            layer.recompute(bottom, top)
+
+    def _run_forward_checkpointed(self, forward_order):
+        """Runs the forward pass, discarding the blobs that are not kept by
+        checkpointing.
+        """
+        _, discard_after, recompute, _ = self._checkpoint_plan
+        for name, layer, bottom, top in forward_order:
+            layer.forward(bottom, top)
+            if name in recompute:
+                layer.release_buffers()
+            for blobname in discard_after.get(name, []):
+                self.blobs[blobname].clear()
+
+    def _run_backward_checkpointed(self):
+        """Runs the backward pass, recomputing the discarded blobs when
+        needed. Returns the list of losses.
+        """
+        discard, _, recompute, _ = self._checkpoint_plan
+        losses = []
+        for name, layer, bottom, top, propagate_down in self._backward_order:
+            self._restore_blobs(self._actual_needs[name] + self.provides[name])
+            losses.append(layer.backward(bottom, top, propagate_down))
+            # the outputs of the layer are no longer needed.
+            if name in recompute:
+                layer.release_buffers()
+            for blobname in self.provides[name]:
+                if blobname in discard:
+                    self.blobs[blobname].clear()
+        # discard the blobs recomputed by layers that need no backward pass.
+        for blobname in discard:
+            self.blobs[blobname].clear()
+        for name, layer, _, _ in self._forward_order:
+            if name in recompute:
+                layer.release_buffers()
+        return losses
+
+    def enable_prefix_cache(self, filename):
+        """Enables the activation cache of the frozen prefix of the net, for
+        fine-tuning the top layers of a net whose other layers are frozen.
+        The frozen prefix consists of the layers that need no backward pass
+        and that only depend on the data layers, the input blobs and each
+        other. The first time forward_backward() sees a data point, the
+        prefix is run, and its outputs used by the rest of the net (the
+        boundary blobs) are written to puff files keyed by the index of the
+        data point; afterwards, the boundary blobs are read from the cache,
+        and only the data layers and the trainable suffix are run. The data
+        layers then only produce the blobs used by the suffix (see
+        DataLayer.forward_tops()), so the data of the prefix is not loaded.
+
+        The cache records a hash of the structure, the specs and the
+        parameters of the prefix (and of the previous net). It is computed
+        the first time the cache is used after enable_prefix_cache() or
+        finish(), and a cache written for another hash is discarded.
+
+        If forward_backward() is given a previous net, its outputs are cached
+        too, and the previous net only runs its data layers once all the data
+        points are cached.
+
+        The data layers feeding the prefix (or the previous net) should
+        report the indices of the data they emit, see
+        DataLayer.data_indices(). The prefix is run with predict(), so layers
+        such as dropout behave as in testing.
+
+        Input:
+            filename: the prefix of the puff files, one per boundary blob.
+                If the files exist, the cache is reused.
+        """
+        self.disable_prefix_cache()
+        self._prefix_cache = filename
+        if self._finished:
+            self._plan_prefix_cache()
+
+    def disable_prefix_cache(self):
+        """Disables the prefix cache, writing its content to disk."""
+        self._close_prefix_puffs()
+        self._prefix_cache = None
+        self._prefix_plan = None
+
+    def _close_prefix_puffs(self):
+        """Writes the caches of the boundary blobs to disk and closes them.
+        """
+        for puff in self._prefix_puffs.itervalues():
+            puff.close()
+        self._prefix_puffs = {}
+        self._prefix_key_value = None
+
+    def _plan_prefix_cache(self):
+        """Splits the forward order into the data layers, the frozen prefix
+        and the suffix, and finds the boundary blobs of the prefix. See
+        enable_prefix_cache() for details.
+        """
+        # the prefix may have changed, so the caches are checked again.
+        self._close_prefix_puffs()
+        sources = set(self._input_blobs)
+        data, prefix, suffix = [], [], []
+        for idx, (name, layer, _, _) in enumerate(self._forward_order):
+            if isinstance(layer, DataLayer):
+                data.append(idx)
+                sources.update(self.provides[name])
+            elif (not self.graph.node[name]['need_backward'] and
+                  all(blobname in sources
+                      for blobname in self._actual_needs[name])):
+                prefix.append(idx)
+                sources.update(self.provides[name])
+            else:
+                suffix.append(idx)
+        produced = set()
+        for idx in prefix:
+            produced.update(self.provides[self._forward_order[idx][0]])
+        needs = set()
+        for idx in suffix:
+            needs.update(self._actual_needs[self._forward_order[idx][0]])
+        # mirroring layers at the end of the prefix, such as split layers,
+        # run in the suffix, so that we cache the blob they mirror once.
+        for idx in reversed(prefix[:]):
+            name, layer, _, _ = self._forward_order[idx]
+            if layer.is_mirror() and all(
+                    blobname in needs for blobname in self.provides[name]):
+                prefix.remove(idx)
+                suffix.append(idx)
+                produced.difference_update(self.provides[name])
+                needs.update(self._actual_needs[name])
+        suffix.sort()
+        boundary = sorted(produced & needs)
+        inputs = sorted(set(self._input_blobs) & needs)
+        logging.info('Prefix cache: %d layers are cached through blobs %s.',
+                     len(prefix), ', '.join(boundary))
+        self._prefix_plan = (data, prefix, suffix, boundary, inputs)
+
+    def _data_indices(self, consumers):
+        """Returns the indices of the data points emitted by the data layers
+        feeding the given entries of the forward order. See
+        DataLayer.data_indices().
+        """
+        needs = set()
+        for idx in consumers:
+            needs.update(self._actual_needs[self._forward_order[idx][0]])
+        indices = None
+        for name, layer, _, _ in self._forward_order:
+            if (not isinstance(layer, DataLayer) or
+                not needs.intersection(self.provides[name])):
+                continue
+            layer_indices = layer.data_indices()
+            if layer_indices is None:
+                raise DecafError('Data layer %s does not report the indices'
+                                 ' of its data, so the prefix cache can not'
+                                 ' be used.' % name)
+            if indices is not None and not np.array_equal(indices,
+                                                           layer_indices):
+                raise DecafError('The data layers feeding the prefix emit'
+                                 ' different data points.')
+            indices = layer_indices
+        if indices is None:
+            raise DecafError('The prefix cache needs data layers that report'
+                             ' the indices of their data.')
+        return indices
+
+    def _prefix_puff(self, blob_name):
+        """Returns the cache of a boundary blob, opening it if necessary."""
+        if blob_name not in self._prefix_puffs:
+            self._prefix_puffs[blob_name] = IndexedPuff(
+                '%s_%s' % (self._prefix_cache, blob_name))
+        return self._prefix_puffs[blob_name]
+
+    def _prefix_key(self, previous_net):
+        """Returns a hash of the computation cached by the prefix cache: the
+        structure, the specs and the parameters of the prefix layers, and of
+        the layers of the previous net if it is a Net. Spec values other than
+        strings, numbers and their sequences, such as fillers, are left out.
+        Returns None if some parameters have not been initialized yet.
+        """
+        plain = (basestring, bool, int, long, float, type(None))
+        def is_plain(value):
+            if isinstance(value, (tuple, list)):
+                return all(isinstance(item, plain) for item in value)
+            return isinstance(value, plain)
+        layers = [(self, self._forward_order[idx][0])
+                  for idx in self._prefix_plan[1]]
+        if isinstance(previous_net, Net):
+            layers.extend((previous_net, name) for name, layer, _, _
+                          in previous_net._forward_order
+                          if not isinstance(layer, DataLayer))
+        digest = hashlib.sha1()
+        for decaf_net, name in layers:
+            layer = decaf_net.layers[name]
+            spec = sorted((key, value) for key, value in layer.spec.iteritems()
+                          if is_plain(value))
+            digest.update(repr((layer.__class__.__name__, name,
+                                decaf_net._actual_needs[name],
+                                decaf_net.provides[name], spec)))
+            for param in layer.param():
+                if not param.has_data():
+                    return None
+                data = np.ascontiguousarray(param.data())
+                digest.update(repr((data.shape, data.dtype.str)))
+                digest.update(data.data)
+        return digest.hexdigest()
+
+    def _check_prefix_key(self, puffs, previous_net):
+        """Checks the caches against the hash of the cached computation,
+        computing it if necessary. Returns False if the hash is unknown since
+        some parameters have not been initialized.
+        """
+        if self._prefix_key_value is None:
+            self._prefix_key_value = self._prefix_key(previous_net)
+            if self._prefix_key_value is None:
+                return False
+        for puff in puffs:
+            puff.check_key(self._prefix_key_value)
+        return True
+
+    def _run_data_layers(self, data, needed):
+        """Runs the data layers at the given indices of the forward order,
+        only producing their top blobs in needed and the blobs used by other
+        data layers (see DataLayer.forward_tops()). Returns the skipped top
+        blobs as (entry, positions) pairs, see _fill_data_layers().
+        """
+        used = set(needed)
+        for idx in data:
+            used.update(self._actual_needs[self._forward_order[idx][0]])
+        skipped = []
+        for idx in data:
+            entry = self._forward_order[idx]
+            name, layer, bottom, top = entry
+            positions = [i for i, blobname in enumerate(self.provides[name])
+                         if blobname in used]
+            if len(positions) == len(top):
+                layer.forward(bottom, top)
+            else:
+                layer.forward_tops(bottom, top, positions)
+                skipped.append((entry, [i for i in range(len(top))
+                                        if i not in positions]))
+        return skipped
+
+    @staticmethod
+    def _fill_data_layers(skipped):
+        """Produces the top blobs skipped by _run_data_layers()."""
+        for (_, layer, bottom, top), positions in skipped:
+            layer.fill_tops(bottom, top, positions)
+
+    def _forward_backward_cached(self, previous_net):
+        """Runs forward_backward() with the prefix cache, and returns the
+        loss."""
+        data, prefix, suffix, boundary, inputs = self._prefix_plan
+        needed = set()
+        for idx in suffix:
+            needed.update(self._actual_needs[self._forward_order[idx][0]])
+        skipped = self._run_data_layers(data, needed)
+        if isinstance(previous_net, Net):
+            previous_data = [
+                idx for idx, entry in enumerate(previous_net._forward_order)
+                if isinstance(entry[1], DataLayer)]
+            previous_rest = [
+                idx for idx in range(len(previous_net._forward_order))
+                if idx not in previous_data]
+            previous_skipped = previous_net._run_data_layers(previous_data,
+                                                             set())
+            indices = previous_net._data_indices(previous_rest)
+            cached = boundary + inputs
+        else:
+            if isinstance(previous_net, dict):
+                for key, arr in previous_net.iteritems():
+                    self.blobs[key].mirror(arr)
+            cached = boundary
+            if cached:
+                indices = self._data_indices(prefix)
+        puffs = [self._prefix_puff(name) for name in cached]
+        checked = not puffs or self._check_prefix_key(puffs, previous_net)
+        if checked and all(puff.contains(indices) for puff in puffs):
+            for name, puff in zip(cached, puffs):
+                self.blobs[name].mirror(puff.read(indices))
+                # the first hit usually means that a pass over the data is
+                # complete, so we write the cache to disk.
+                puff.flush()
+        else:
+            Net._fill_data_layers(skipped)
+            if isinstance(previous_net, Net):
+                Net._fill_data_layers(previous_skipped)
+                previous_net._run_forward(
+                    True, *previous_net._select_forward(previous_rest))
+                for name in self._input_blobs:
+                    self.blobs[name].mirror(previous_net.blobs[name].data())
+            self._run_forward(True, *self._select_forward(prefix))
+            if not checked:
+                # the prefix has initialized its parameters.
+                self._check_prefix_key(puffs, previous_net)
+            for name, puff in zip(cached, puffs):
+                puff.write(indices, self.blobs[name].data())
+        self._run_forward(False, *self._select_forward(suffix))
+        return self._run_backward()
+
+    def _compute_dependencies(self):
+        """Computes the dependencies between the layers in the forward and
+        backward orders, used by the parallel scheduler.
+        """
+        producer = {}
+        for idx, (name, _, _, _) in enumerate(self._forward_order):
+            for blobname in self.provides[name]:
+                producer[blobname] = idx
+        def find_producer(blobname):
+            # a blob whose layer is fused is produced by the layer that
+            # produces the blob it aliases.
+            while blobname not in producer and blobname in self._blob_alias:
+                blobname = self._blob_alias[blobname]
+            return producer.get(blobname, None)
+        self._forward_deps = []
+        for name, _, _, _ in self._forward_order:
+            self._forward_deps.append(set(
+                find_producer(blobname)
+                for blobname in self._actual_needs[name]) - set([None]))
+        # In the backward pass, a layer needs the diffs computed by all the
+        # layers that use its outputs.
+        backward_idx = dict((entry[0], idx) for idx, entry
+                            in enumerate(self._backward_order))
+        self._backward_deps = [set() for _ in self._backward_order]
+        for idx, (name, _, _, _) in enumerate(self._forward_order):
+            if name not in backward_idx:
+                continue
+            for parent in self._forward_deps[idx]:
+                parent_name = self._forward_order[parent][0]
+                if parent_name in backward_idx:
+                    self._backward_deps[backward_idx[parent_name]].add(
+                        backward_idx[name])
+        for before, after in self._memory_deps:
+            self._forward_deps[after].add(before)
+        self._forward_deps = [list(deps) for deps in self._forward_deps]
+        self._backward_deps = [list(deps) for deps in self._backward_deps]
+        self._predict_plans = {}
+        # the clones used by predict() with workers or buckets are outdated.
+        self._close_workers()
+        self._worker_layouts = {}
+        self._close_bucket_plans()
+
+    def _predict_plan(self, output_blobs):
+        """Returns the part of the forward order (and its dependencies) that
+        is needed to compute the given output blobs, as well as the input
+        blobs it needs. The result is cached for each set of output blobs.
+        """
+        key = frozenset(output_blobs)
+        if key not in self._predict_plans:
+            ancestors = set(output_blobs)
+            for name in output_blobs:
+                if name not in self.blobs:
+                    raise DecafError('Unknown blob: %s' % name)
+                ancestors.update(nx.ancestors(self.graph, name))
+            forward_order, forward_deps = self._select_forward(
+                [idx for idx, entry in enumerate(self._forward_order)
+                 if entry[0] in ancestors])
+            input_blobs = [name for name in self._input_blobs
+                           if name in ancestors]
+            logging.debug('Prediction of %s runs %d out of %d layers.',
+                          str(output_blobs), len(forward_order),
+                          len(self._forward_order))
+            self._predict_plans[key] = (forward_order, forward_deps,
+                                        input_blobs)
+        return self._predict_plans[key]
+
+    def _select_forward(self, indices):
+        """Returns the entries of the forward order with the given indices,
+        and their dependencies among each other.
+        """
+        new_index = dict((idx, i) for i, idx in enumerate(indices))
+        forward_order = [self._forward_order[idx] for idx in indices]
+        forward_deps = [[new_index[dep] for dep in self._forward_deps[idx]
+                         if dep in new_index] for idx in indices]
+        return forward_order, forward_deps
+
+    def _run_forward(self, predict, forward_order=None, forward_deps=None):
+        """Runs the forward pass, or the predict pass if predict is True. If
+        forward_order and forward_deps are given, only runs the given layers.
+        """
+        if forward_order is None:
+            forward_order = self._forward_order
+            forward_deps = self._forward_deps
+        if self._checkpoints is not None and not predict:
+            self._run_forward_checkpointed(forward_order)
+        elif self._scheduler is None:
+            if predict:
+                for _, layer, bottom, top in forward_order:
+                    layer.predict(bottom, top)
+            else:
+                for _, layer, bottom, top in forward_order:
+                    layer.forward(bottom, top)
+        else:
+            if predict:
+                tasks = [(layer.predict, (bottom, top))
+                         for _, layer, bottom, top in forward_order]
+            else:
+                tasks = [(layer.forward, (bottom, top))
+                         for _, layer, bottom, top in forward_order]
+            self._scheduler.run(tasks, forward_deps)
+
+    def _run_backward(self):
+        """Runs the backward pass, and returns the loss."""
+        if self._checkpoints is not None:
+            losses = self._run_backward_checkpointed()
+        elif self._scheduler is None:
+            losses = [layer.backward(bottom, top, propagate_down)
+                      for _, layer, bottom, top, propagate_down
+                      in self._backward_order]
+        else:
+            tasks = [(layer.backward, (bottom, top, propagate_down))
+                     for _, layer, bottom, top, propagate_down
+                     in self._backward_order]
+            losses = self._scheduler.run(tasks, self._backward_deps)
+        # sum the losses in a fixed order, so the result is deterministic.
+        return sum(losses, 0.)
+
+    def optimize(self):
+        """Runs the graph optimization pass, which fuses common layer chains
+        so that the forward pass makes fewer passes over the blobs:
+
+            convolution / inner product (+ bias) + ReLU: the bias and the ReLU
+                are applied while the output is still in cache.
+            ReLU + max pooling: since max pooling commutes with ReLU, the ReLU
+                is applied to the smaller pooled output.
+            zero padding + convolution: the convolution pads its input
+                implicitly (see Layer.fuse_padding()), so the padded copy of
+                the data and of its gradient is never made.
+
+        A ReLU layer is only fused into the layer producing its input if that
+        blob is used by no other layer, since the fusion rectifies it. It is
+        fused into max pooling if the pooling layer is the only user of its
+        output, whatever else uses its input, which stays unrectified. The
+        fused ReLU layer is skipped when running the net, and its output blob
+        shares the blob of its input, so the outputs of the net do not change.
+        Note however that the input blob of a ReLU fused into the previous
+        layer holds the rectified data, the output blob of a ReLU fused into
+        max pooling holds the unrectified data, and the output blob of a fused
+        padding layer holds the unpadded data. Padding layers are fused
+        likewise if their output is used by a single layer. Use the keep
+        argument of plan_memory() to protect the blobs you want to look at.
+
+        The setting is remembered, so calling finish() again will redo the
+        fusion.
+        """
+        self.finish(optimize=True)
+
+    def simplify(self):
+        """Simplifies the net for prediction, so that fewer layers are
+        dispatched and fewer blobs are created in a forward pass:
+
+            no split layers are inserted for blobs used by several layers,
+                since no gradients have to be accumulated.
+            layers that only mirror their input when predicting (such as
+                identity, dropout and zero padding layers) are removed.
+            flatten layers are removed if all the layers using their output
+                can flatten their input themselves (such as inner product
+                layers, see Layer.fuse_flatten()).
+
+        The layers using the output of a removed layer read its input
+        instead, and the output blob of a removed layer shares the blob of its
+        input, so the outputs of the net do not change; note however that the
+        output blob of a removed flatten layer keeps the shape of its input.
+        A simplified net can only be used to run predict().
+
+        The setting is remembered, so calling finish() again will redo the
+        simplification.
+        """
+        self.finish(simplify=True)
+
+    def _simplify_layers(self, layerorder):
+        """Removes the mirroring layers. See simplify() for details. Returns
+        the layer order with the removed layers removed.
+        """
+        # the outputs of the net and the kept blobs are not aliased, so that
+        # in-place computation and fusion can not change them.
+        keep = set(self._memory_keep or []).union(self._output_blobs)
+        # maps the outputs of the removed layers to the blobs they mirror.
+        source = {}
+        def remove(name, bottoms):
+            """Removes a layer whose top blobs mirror the given bottoms."""
+            for i, top in enumerate(self.provides[name]):
+                bottom = bottoms[0] if len(bottoms) == 1 else bottoms[i]
+                source[top] = bottom
+                self.blobs[top] = self.blobs[bottom]
+                self._blob_alias[top] = bottom
+            self._simplified_layers.add(name)
+            logging.debug('Layer %s is removed by simplification.', name)
+        for name in layerorder:
+            needs = [source.get(blobname, blobname)
+                     for blobname in self._actual_needs[name]]
+            self._actual_needs[name] = needs
+            layer = self.layers[name]
+            if (layer.is_mirror() and not layer.is_reshape() and
+                not isinstance(layer, DataLayer) and needs and
+                not keep.intersection(self.provides[name])):
+                remove(name, needs)
+        layerorder = [name for name in layerorder
+                      if name not in self._simplified_layers]
+        consumers = self._consumers_in(layerorder)
+        for name in layerorder:
+            layer = self.layers[name]
+            needs = self._actual_needs[name]
+            provides = self.provides[name]
+            if (not layer.is_reshape() or len(needs) != 1 or
+                len(provides) != 1 or provides[0] in keep):
+                continue
+            users = consumers[provides[0]]
+            fused = [user for user in users
+                     if len(self._actual_needs[user]) == 1 and
+                     self.layers[user].fuse_flatten()]
+            if len(fused) != len(users):
+                for user in fused:
+                    self.layers[user].fuse_flatten(False)
+                continue
+            for user in users:
+                self._actual_needs[user] = needs[:]
+            remove(name, needs)
+        return [name for name in layerorder
+                if name not in self._simplified_layers]
+
+    def _consumers_in(self, layerorder):
+        """Returns a dict mapping the blob names to the names of the layers in
+        the layer order that read them."""
+        consumers = defaultdict(list)
+        for name in layerorder:
+            for blobname in self._actual_needs[name]:
+                consumers[blobname].append(name)
+        return consumers
+
+    def _fuse_layers(self, layerorder):
+        """Fuses the padding and ReLU layers into their neighbors. See
+        optimize() for details. Returns the layer order with the fused layers
+        removed.
+        """
+        # We import locally since the layers depend on the base module.
+        from decaf.layers.relu import ReLULayer
+        layerorder = self._fuse_padding(layerorder)
+        producer = {}
+        for name in layerorder:
+            for blobname in self.provides[name]:
+                producer[blobname] = name
+        consumers = self._consumers_in(layerorder)
+        keep = self._memory_keep or []
+        for name in layerorder:
+            if (not isinstance(self.layers[name], ReLULayer) or
+                len(self._actual_needs[name]) != 1 or
+                len(self.provides[name]) != 1):
+                continue
+            bottom = self._actual_needs[name][0]
+            top = self.provides[name][0]
+            if top in keep:
+                continue
+            # fuse into the layer that produces the input.
+            if (bottom in producer and bottom not in keep and
+                len(consumers[bottom]) == 1 and
+                len(self.provides[producer[bottom]]) == 1 and
+                self.layers[producer[bottom]].fuse_relu()):
+                fused_into = producer[bottom]
+            else:
+                # fuse into the (only) layer that uses the output.
+                users = consumers[top]
+                if (len(users) == 1 and
+                    len(self._actual_needs[users[0]]) == 1 and
+                    self.layers[users[0]].fuse_relu()):
+                    fused_into = users[0]
+                else:
+                    continue
+            self.blobs[top] = self.blobs[bottom]
+            self._blob_alias[top] = bottom
+            self._fused_layers.add(name)
+            logging.debug('Layer %s is fused into %s', name, fused_into)
+        return [name for name in layerorder
+                if name not in self._fused_layers]
+
+    def _fuse_padding(self, layerorder):
+        """Fuses the zero padding layers into the layers that use their
+        output. Returns the layer order with the fused layers removed.
+        """
+        from decaf.layers.padding import PaddingLayer
+        consumers = self._consumers_in(layerorder)
+        keep = self._memory_keep or []
+        for name in layerorder:
+            layer = self.layers[name]
+            if (not isinstance(layer, PaddingLayer) or
+                layer.spec.get('value', 0) != 0 or
+                len(self._actual_needs[name]) != 1 or
+                len(self.provides[name]) != 1):
+                continue
+            bottom = self._actual_needs[name][0]
+            top = self.provides[name][0]
+            users = consumers[top]
+            if (top in keep or len(users) != 1 or
+                len(self._actual_needs[users[0]]) != 1 or
+                not self.layers[users[0]].fuse_padding(layer.spec['pad'])):
+                continue
+            self.blobs[top] = self.blobs[bottom]
+            self._blob_alias[top] = bottom
+            self._fused_layers.add(name)
+            logging.debug('Layer %s is fused into %s', name, users[0])
+        return [name for name in layerorder
+                if name not in self._fused_layers]
+
+    def _plan_inplace(self, layerorder):
+        """Finds the layers that can run in place, and lets their top blob
+        share the blob object of their bottom. A layer runs in place if it
+        supports it, its bottom blob is only used by itself, and the layer
+        producing the bottom blob neither mirrors its own input (which would
+        then be overwritten) nor reads its top data in the backward pass.
+        """
+        producer = {}
+        for name in layerorder:
+            for blobname in self.provides[name]:
+                producer[blobname] = name
+        for blobname, source in self._blob_alias.iteritems():
+            if source in producer:
+                producer[blobname] = producer[source]
+        consumers = self._consumers_in(layerorder)
+        keep = self._memory_keep or []
+        for name in layerorder:
+            needs = self._actual_needs[name]
+            provides = self.provides[name]
+            if (not self.layers[name].supports_inplace() or
+                len(needs) != 1 or len(provides) != 1):
+                continue
+            bottom = needs[0]
+            if (bottom not in producer or bottom in keep or
+                len(consumers[bottom]) != 1):
+                continue
+            source = self.layers[producer[bottom]]
+            if (isinstance(source, DataLayer) or source.is_mirror() or
+                source.backward_needs_top_data()):
+                continue
+            self.blobs[provides[0]] = self.blobs[bottom]
+            self._blob_alias[provides[0]] = bottom
+            self._inplace_layers.add(name)
+            logging.debug('Layer %s runs in place on blob %s', name, bottom)
+
+    def plan_memory(self, keep=None):
+        """Enables the memory planner for prediction. The planner analyzes the
+        lifetime of the blobs over the forward order, and lets blobs whose
+        last consumer has already run share the same memory with blobs that
+        are produced later. The plan is recomputed every time finish() is
+        called.
+
+        Since intermediate blobs get overwritten, a net with a memory plan
+        can only be used to run predict(), and only the output blobs, the
+        input blobs and the blobs listed in keep can be obtained from
+        predict() or feature().
+
+        Input:
+            keep: a list of blob names whose content should stay intact, for
+                example the blobs that you will ask for using feature().
+        """
+        if keep is None:
+            keep = []
+        elif type(keep) is str:
+            keep = [keep]
+        self._memory_keep = list(keep)
+        if self._finished:
+            # re-finish, since the kept blobs may not run in place.
+            self.finish()
+
+    def clear_memory_plan(self):
+        """Disables the memory planner, letting every blob own its data."""
+        self._memory_keep = None
+        for name in self._shared_blobs:
+            if name in self.blobs:
+                self.blobs[name].set_buffer(None)
+        self._shared_blobs = set()
+        self._memory_deps = []
+        if self._finished:
+            self._compute_dependencies()
+
+    def _plan_memory(self):
+        """Computes the memory plan. See plan_memory() for details."""
+        # split blobs of a previous plan may be gone after simplification.
+        for name in self._shared_blobs:
+            if name in self.blobs:
+                self.blobs[name].set_buffer(None)
+        for name in self._memory_keep:
+            if name not in self.blobs:
+                raise InvalidNetError('Unknown blob to keep: %s' % name)
+        # Blobs produced by mirroring layers are views of their bottom blobs,
+        # and blobs aliased by in-place computation or fusion share the blob
+        # of another blob, so we group them by the blob that actually holds
+        # the memory.
+        alias = dict(self._blob_alias)
+        for name, layer, _, _ in self._forward_order:
+            if not layer.is_mirror():
+                continue
+            needs = self._actual_needs[name]
+            for i, blobname in enumerate(self.provides[name]):
+                alias[blobname] = needs[0] if len(needs) == 1 else needs[i]
+        def owner(blobname):
+            while blobname in alias:
+                blobname = alias[blobname]
+            return blobname
+        # The index of the last layer reading each piece of memory, and the
+        # indices of all the layers reading it.
+        last_use = {}
+        readers = defaultdict(list)
+        for idx, (name, _, _, _) in enumerate(self._forward_order):
+            for blobname in self._actual_needs[name]:
+                last_use[owner(blobname)] = idx
+                readers[owner(blobname)].append(idx)
+        release = defaultdict(list)
+        for blobname, idx in last_use.iteritems():
+            release[idx].append(blobname)
+        pinned = set(owner(blobname) for blobname in
+                     self._memory_keep + self._output_blobs +
+                     self._input_blobs)
+        free_buffers = []
+        num_buffers = 0
+        planned = {}
+        for idx, (name, layer, _, _) in enumerate(self._forward_order):
+            for blobname in self.provides[name]:
+                if (blobname in alias or blobname in pinned or
+                    blobname not in last_use):
+                    continue
+                if free_buffers:
+                    buffer, previous = free_buffers.pop()
+                    # when running in parallel, the blob should only be
+                    # written after the previous one is no longer read.
+                    self._memory_deps.extend(
+                        (reader, idx) for reader in readers[previous])
+                else:
+                    buffer = SharedBuffer()
+                    num_buffers += 1
+                planned[blobname] = buffer
+            for blobname in release[idx]:
+                if blobname in planned:
+                    free_buffers.append((planned[blobname], blobname))
+        for blobname, buffer in planned.iteritems():
+            self.blobs[blobname].set_buffer(buffer)
+        self._shared_blobs = set(
+            blobname for blobname in self.blobs
+            if owner(blobname) in planned)
+        logging.info('Memory plan: %d blobs share %d buffers.',
+                     len(planned), num_buffers)
+
+    def _check_preserved(self, blob_name):
+        """Raises an error if the memory plan does not preserve the blob."""
+        if blob_name in self._shared_blobs:
+            raise DecafError('The memory plan does not preserve blob %s. Add'
+                             ' it to plan_memory(keep=...).' % blob_name)
+
     def _generate_graph(self):
         """Validates if a network is executable, and generates the networkx 
         graph that reflects the execution order.
         """
+        # remove the split layers inserted by a previous call, so that finish()
+        # can be called multiple times.
+        for layername in self._split_layers:
+            blobname = self.needs[layername][0]
+            self._need_count[blobname] -= 1
+            self._consumers[blobname].remove(layername)
+            for split_blob in self.provides[layername]:
+                del self.blobs[split_blob]
+                del self._producer[split_blob]
+                self.graph.remove_node(split_blob)
+            self.graph.remove_node(layername)
+            del self.layers[layername]
+            del self.needs[layername]
+            del self.provides[layername]
+            for consumer in self._consumers[blobname]:
+                self.graph.add_edge(blobname, consumer)
+        self._split_layers = []
         # first, get input and output blobs.
-        provided_blobs = set(sum(self.provides.values(), []))
         self._input_blobs = [name for name in self.blobs
-                             if name not in provided_blobs]
+                             if name not in self._producer]
         if len(self._input_blobs):
             logging.info('This network needs input blobs: %s',
                          str(self._input_blobs))
@@ -492,52 +2024,67 @@ class Net(object):
             logging.info('This network produces output blobs: %s',
                          str(self._output_blobs))
         # For any blob that is needed by multiple layers, we will insert a split
-        # layer to avoid gradient overwriting.
-        for blobname, count in self._need_count.iteritems():
-            if count > 1:
+        # layer to avoid gradient overwriting. A simplified net computes no
+        # gradients, so its layers read such blobs directly.
+        for blobname, count in self._need_count.items():
+            if count > 1 and not self._simplify:
                 split_provides = ['_'.join([DECAF_PREFIX, blobname, str(i)])
                                   for i in range(count)]
-                self.add_layer(
-                    SplitLayer(name='_'.join([DECAF_PREFIX, blobname, 'split'])),
-                    needs=[blobname], provides=split_provides)
+                split_name = '_'.join([DECAF_PREFIX, blobname, 'split'])
+                self.add_layer(SplitLayer(name=split_name),
+                               needs=[blobname], provides=split_provides)
+                self._split_layers.append(split_name)
                 logging.debug('Insert SplitLayer from [%s] to %s', blobname, str(split_provides))
-        # compute actual_needed
+        # compute actual_needed, and connect the layers to the splitted blobs.
         temp_need_idx = defaultdict(int)
         self._actual_needs = {}
         for layername, blobnames in self.needs.iteritems():
             actual_needs = []
             for blobname in blobnames:
-                if (self._need_count[blobname] > 1 and 
+                if (self._need_count[blobname] > 1 and not self._simplify and
                     not layername.startswith(DECAF_PREFIX)):
                     # instead of connecting it to the original blob, we connect
                     # it to the new splitted blob.
-                    actual_needs.append(
-                        '_'.join([DECAF_PREFIX, blobname,
-                                  str(temp_need_idx[blobname])]))
+                    split_blob = '_'.join([DECAF_PREFIX, blobname,
+                                           str(temp_need_idx[blobname])])
+                    actual_needs.append(split_blob)
                     temp_need_idx[blobname] += 1
+                    if self.graph.has_edge(blobname, layername):
+                        self.graph.remove_edge(blobname, layername)
+                    self.graph.add_edge(split_blob, layername)
                 else:
                     actual_needs.append(blobname)
-            self._actual_needs[layername] = list(actual_needs)
-            logging.debug('Layer %s, needs %s, actual needs %s', layername, str(blobnames), str(actual_needs))
-        # Now, create the graph
-        self.graph = nx.DiGraph()
-        for layername, blobnames in self._actual_needs.iteritems():
-            logging.debug('Adding edges from %s to %s (needs)', str(blobnames), layername)
-            for blobname in blobnames:
-                self.graph.add_edge(blobname, layername)
-        for layername, blobnames in self.provides.iteritems():
-            logging.debug('Adding edges from %s to %s (provides)', layername, str(blobnames))
-            for blobname in blobnames:
-                self.graph.add_edge(layername, blobname)
+            self._actual_needs[layername] = actual_needs
         # Done creating graph!
         return        
                         
-    def forward_backward(self, previous_net = None):
+    def forward_backward(self, previous_net = None, micro_batches=1):
         """Runs the forward and backward passes of the net.
+
+        Input:
+            previous_net: the net (or a dict of arrays) providing the input
+                blobs of the net.
+            micro_batches: if larger than 1, the minibatch given by the input
+                blobs and produced by the data layers is split along its first
+                dimension into the given number of micro-batches, which are
+                run one after another. The loss and the parameter diffs are
+                accumulated over the micro-batches, weighted by their sizes,
+                so they equal those of the whole minibatch, while the
+                intermediate blobs only need to hold one micro-batch. Default
+                1.
         """
         # the forward pass. We will also accumulate the loss function.
         if not self._finished:
             raise DecafError('Call finish() before you use the network.')
+        if self._memory_keep is not None:
+            raise DecafError('A net with a memory plan can only be used for'
+                             ' prediction. Call clear_memory_plan() first.')
+        if self._inference_only:
+            raise DecafError('A net cloned for inference can only be used for'
+                             ' prediction.')
+        if self._simplify:
+            raise DecafError('A simplified net can only be used for'
+                             ' prediction. Call finish(simplify=False) first.')
         if len(self._output_blobs):
             # If the network has output blobs, it usually shouldn't be used
             # to run forward-backward: such blobs won't be used and cause waste
@@ -545,6 +2092,11 @@ class Net(object):
             # will print the warning but still carry on.
             logging.warning('Have multiple unused blobs in the net. Do you'
                             ' actually mean running a forward backward pass?')
+        if self._prefix_cache is not None:
+            if micro_batches > 1:
+                raise DecafError('The prefix cache does not support'
+                                 ' micro-batches.')
+            return self._forward_backward_cached(previous_net)
         loss = 0.
         # If there is a previous_net, we will run that first
         if isinstance(previous_net, Net):
@@ -559,15 +2111,65 @@ class Net(object):
             # If previous net is a dict, simply mirror all the data.
             for key, arr in previous_net.iteritems():
                 self.blobs[key].mirror(arr)
-        for _, layer, bottom, top in self._forward_order:
-            layer.forward(bottom, top)
+        if micro_batches > 1:
+            return loss + self._forward_backward_micro(micro_batches)
+        self._run_forward(predict=False)
         # the backward pass
-        for name, layer, bottom, top, propagate_down in self._backward_order:
-            layer_loss = layer.backward(bottom, top, propagate_down)
-            loss += layer_loss
+        loss += self._run_backward()
+        return loss
+
+    def _forward_backward_micro(self, micro_batches):
+        """Runs the forward and backward passes over micro-batches. See
+        forward_backward() for details.
+        """
+        # First, run the data layers to get the whole minibatch.
+        data_indices = [idx for idx, entry in enumerate(self._forward_order)
+                        if isinstance(entry[1], DataLayer)]
+        data_set = set(data_indices)
+        self._run_forward(False, *self._select_forward(data_indices))
+        sources = list(self._input_blobs)
+        for idx in data_indices:
+            sources.extend(self.provides[self._forward_order[idx][0]])
+        minibatch = dict((name, self.blobs[name].data()) for name in sources)
+        num_data = set(arr.shape[0] for arr in minibatch.values())
+        if len(num_data) != 1:
+            raise DecafError('To use micro-batches, the input blobs and the'
+                             ' outputs of the data layers should have the same'
+                             ' number of data points.')
+        num_data = num_data.pop()
+        forward_order, forward_deps = self._select_forward(
+            [idx for idx in range(len(self._forward_order))
+             if idx not in data_set])
+        loss = 0.
+        accum = None
+        start = 0
+        for i in range(micro_batches):
+            size = num_data / micro_batches + (i < num_data % micro_batches)
+            if size == 0:
+                continue
+            weight = float(size) / num_data
+            for name in sources:
+                self.blobs[name].mirror(minibatch[name][start:start + size])
+            self._run_forward(False, forward_order, forward_deps)
+            loss += self._run_backward() * weight
+            # accumulate the weighted parameter diffs.
+            if accum is None:
+                accum = [param.diff() * weight if param.has_diff() else None
+                         for param in self._params]
+            else:
+                for acc, param in zip(accum, self._params):
+                    if acc is not None:
+                        acc += param.diff() * weight
+            start += size
+        for acc, param in zip(accum, self._params):
+            if acc is not None:
+                param.diff()[:] = acc
+        # let the source blobs hold the whole minibatch again.
+        for name in sources:
+            self.blobs[name].mirror(minibatch[name])
         return loss
 
-    def predict(self, output_blobs = None, **kwargs):
+    def predict(self, output_blobs = None, workers=1, **kwargs):
         """Use the network to perform prediction. Note that your network
         should have at least one output blob. All input blobs need to be
         provided using the kwargs.
@@ -575,25 +2177,298 @@ class Net(object):
         Input:
             output_blobs: a list of output blobs to return. If None, all the 
                 blobs that do not have layers following them are considered
-                output and are returned.
+                output and are returned. If given, only the layers that the
+                requested blobs depend on are run, and only the input blobs
+                they depend on need to be provided. Note that other blobs
+                are then not updated.
+            workers: the number of workers to split the batch across. With
+                more than one worker, the inputs are split along their first
+                axis, and the shards run concurrently on clones of the net
+                that share its parameters (see clone_for_inference()), each
+                using single-threaded BLAS and OpenMP kernels. The outputs
+                are then fresh arrays, and the blobs of this net are not
+                updated. Default 1. Note that unless the BLAS library has a
+                per-thread setting (see blasdot.single_threaded_blas()), the
+                number of BLAS threads is global to the process, so BLAS
+                calls made by other threads while the workers run, such as
+                the training of another net, run single-threaded too. With a
+                batch of a single data point, the BLAS threads are left
+                untouched.
             kwargs: any input data that the network needs. All the blobs in
                 the network that do not have a layer generating them should
                 be provided.
         Output:
             result: a dictionary where the keys are the output blob names, and
                 the values are the numpy arrays storing the blob content.
+        With batch size buckets (see set_batch_buckets()), the prediction runs
+        on the plan of the bucket, and the blobs of this net are not updated
+        either.
         """
         if not self._finished:
             raise DecafError('Call finish() before you use the network.')
-        for name in self._input_blobs:
-            self.blobs[name].mirror(kwargs[name])
-        for _, layer, bottom, top in self._forward_order:
-            layer.predict(bottom, top)
+        if workers > 1:
+            return self._predict_workers(output_blobs, workers, kwargs)
+        if self._buckets is not None:
+            return self._predict_bucketed(output_blobs, kwargs)
+        return self._predict(output_blobs, kwargs)
+
+    def _predict(self, output_blobs, inputs):
+        """Runs predict() on the net itself."""
         if not output_blobs:
             output_blobs = self._output_blobs
+            forward_order = self._forward_order
+            forward_deps = self._forward_deps
+            input_blobs = self._input_blobs
+        else:
+            if type(output_blobs) is str:
+                output_blobs = [output_blobs]
+            forward_order, forward_deps, input_blobs = \
+                self._predict_plan(output_blobs)
+        for name in output_blobs:
+            self._check_preserved(name)
+        for name in input_blobs:
+            self.blobs[name].mirror(inputs[name])
+        self._run_forward(True, forward_order, forward_deps)
         return dict([(name, self.blobs[name].data())
                      for name in output_blobs])
     
+    def _get_workers(self, workers):
+        """Returns the clones and the scheduler for predict() with the given
+        number of workers. The clones and the scheduler are kept for the
+        largest number of workers used so far, so that smaller batches use
+        the first few of them instead of creating new ones.
+        """
+        if self._workers is None or len(self._workers[0]) < workers:
+            self._close_workers()
+            nets = [self.clone_for_inference() for _ in range(workers)]
+            for decaf_net in nets:
+                # each worker runs its layers one by one, on shards of any
+                # size.
+                decaf_net.set_num_threads(1)
+                decaf_net.set_batch_buckets(None)
+            self._workers = (nets, DAGScheduler(workers))
+        nets, scheduler = self._workers
+        return nets[:workers], scheduler
+
+    def _close_workers(self):
+        """Stops the threads of the workers of predict(), and drops the
+        workers."""
+        if self._workers is not None:
+            self._workers[1].close()
+        self._workers = None
+
+    @staticmethod
+    def _predict_shard(decaf_net, output_blobs, inputs, targets):
+        """Runs predict() on a worker clone with single-threaded kernels and
+        BLAS (see blasdot.single_threaded_blas()). If targets is given, the
+        outputs are computed directly into the arrays in targets whenever the
+        layers allow it, and copied otherwise.
+        """
+        # imported here since the kernels live with the layers, and blasdot
+        # depends on this module.
+        from decaf.layers.cpp import wrapper
+        from decaf.util import blasdot
+        wrapper.set_num_threads(1)
+        try:
+            with blasdot.single_threaded_blas():
+                if targets is not None:
+                    for name in output_blobs:
+                        decaf_net.blobs[name].mirror(targets[name])
+                result = decaf_net.predict(output_blobs, **inputs)
+                if targets is not None:
+                    for name in output_blobs:
+                        if (result[name].ctypes.data !=
+                            targets[name].ctypes.data):
+                            targets[name][:] = result[name]
+                return result
+        finally:
+            wrapper.set_num_threads(None)
+
+    @staticmethod
+    def _batch_size(inputs):
+        """Returns the number of data points in the inputs of predict(), which
+        should be the same for all the inputs."""
+        sizes = set(arr.shape[0] for arr in inputs.itervalues())
+        if len(sizes) != 1:
+            raise DecafError('All inputs should have the same number of data'
+                             ' points.')
+        return sizes.pop()
+
+    def _predict_workers(self, output_blobs, workers, inputs):
+        """Implements predict() with more than one worker."""
+        num = Net._batch_size(inputs)
+        if not output_blobs:
+            output_blobs = self._output_blobs
+        elif type(output_blobs) is str:
+            output_blobs = [output_blobs]
+        nets, scheduler = self._get_workers(min(workers, num))
+        if len(nets) == 1:
+            # a single shard keeps the BLAS and OpenMP threads.
+            result = nets[0].predict(output_blobs, **inputs)
+            return dict((name, result[name].copy()) for name in output_blobs)
+        bounds = [num * i / len(nets) for i in range(len(nets) + 1)]
+        shards = [dict((name, arr[bounds[i]:bounds[i + 1]])
+                       for name, arr in inputs.iteritems())
+                  for i in range(len(nets))]
+        key = (tuple(output_blobs),
+               tuple(sorted((name, arr.shape[1:], arr.dtype.str)
+                            for name, arr in inputs.iteritems())))
+        first = 0
+        if key not in self._worker_layouts:
+            # run the first shard alone to find out the output shapes.
+            result = Net._predict_shard(
+                nets[0], output_blobs, shards[0], None)
+            self._worker_layouts[key] = dict(
+                (name, (result[name].shape[1:], result[name].dtype))
+                for name in output_blobs)
+            first = 1
+        layout = self._worker_layouts[key]
+        outputs = dict((name, np.empty((num,) + layout[name][0],
+                                       layout[name][1]))
+                       for name in output_blobs)
+        if first:
+            for name in output_blobs:
+                outputs[name][:bounds[1]] = result[name]
+        tasks = [(Net._predict_shard,
+                  (nets[i], output_blobs, shards[i],
+                   dict((name, outputs[name][bounds[i]:bounds[i + 1]])
+                        for name in output_blobs)))
+                 for i in range(first, len(nets))]
+        scheduler.run(tasks, [[] for _ in tasks])
+        return outputs
+
+    def set_batch_buckets(self, buckets, max_bytes=None):
+        """Enables batch size buckets for prediction. predict() then pads its
+        inputs to the smallest bucket that holds them, and runs them on an
+        execution plan kept for that bucket: a clone of the net (see
+        clone_for_inference()) whose blobs and layer buffers were allocated
+        for the bucket's batch size, so that varying batch sizes do not cause
+        any allocation once the plans are warmed up (see warm_up()). Only the
+        valid rows of the outputs are returned. Batches larger than the
+        largest bucket are run on the net itself.
+
+        Input:
+            buckets: a list of batch sizes, such as [1, 2, 4, 8, 16, 32], or
+                None to disable the buckets.
+            max_bytes: if set, the least recently used plans are dropped when
+                the memory held by the plans (see memory_usage() and
+                workspace_usage()) exceeds max_bytes. The plan being used is
+                always kept.
+        """
+        if buckets is not None:
+            buckets = sorted(set(int(size) for size in buckets))
+            if not buckets or buckets[0] < 1:
+                raise DecafError('The batch size buckets should be positive.')
+        self._buckets = buckets
+        self._bucket_max_bytes = max_bytes
+        self._close_bucket_plans()
+
+    def warm_up(self, **kwargs):
+        """Creates the execution plans of all the batch size buckets (see
+        set_batch_buckets()) for inputs like the given ones.
+
+        Input:
+            kwargs: example input data for predict(). Only the shapes of the
+                data points and the dtypes matter, so a single data point per
+                input is enough.
+        """
+        if self._buckets is None:
+            raise DecafError('Call set_batch_buckets() before warm_up().')
+        for bucket in self._buckets:
+            self._bucket_plan(bucket, kwargs)
+
+    def _bucket_plan(self, bucket, inputs):
+        """Returns the plan of a bucket for the given inputs, creating it if
+        necessary, and evicts the least recently used plans that exceed the
+        memory budget. A plan is a tuple holding the clone, its padded input
+        arrays, and the bytes it holds.
+        """
+        key = (bucket, tuple(sorted((name, arr.shape[1:], arr.dtype.str)
+                                    for name, arr in inputs.iteritems())))
+        if key in self._bucket_plans:
+            plan = self._bucket_plans.pop(key)
+        else:
+            padded = dict((name, np.zeros((bucket,) + arr.shape[1:],
+                                          arr.dtype))
+                          for name, arr in inputs.iteritems())
+            decaf_net = self.clone_for_inference()
+            decaf_net.set_batch_buckets(None)
+            decaf_net.finish(input_shapes=dict(
+                (name, (arr.shape, arr.dtype))
+                for name, arr in padded.iteritems()))
+            plan = (decaf_net, padded, decaf_net.memory_usage() +
+                    decaf_net.workspace_usage())
+            logging.debug('Created the plan for batch size %d, holding %d'
+                          ' bytes.', bucket, plan[2])
+        self._bucket_plans[key] = plan
+        if self._bucket_max_bytes is not None:
+            total = sum(entry[2] for entry in self._bucket_plans.itervalues())
+            while (total > self._bucket_max_bytes and
+                   len(self._bucket_plans) > 1):
+                _, evicted = self._bucket_plans.popitem(last=False)
+                evicted[0].close()
+                total -= evicted[2]
+        return plan
+
+    def _close_bucket_plans(self):
+        """Stops the threads of the clones of the bucket plans, and drops the
+        plans."""
+        for plan in self._bucket_plans.itervalues():
+            plan[0].close()
+        self._bucket_plans = OrderedDict()
+
+    def _predict_bucketed(self, output_blobs, inputs):
+        """Implements predict() with batch size buckets."""
+        num = Net._batch_size(inputs)
+        larger = [size for size in self._buckets if size >= num]
+        if not larger:
+            return self._predict(output_blobs, inputs)
+        decaf_net, padded, _ = self._bucket_plan(larger[0], inputs)
+        for name, arr in inputs.iteritems():
+            padded[name][:num] = arr
+            padded[name][num:] = 0
+        result = decaf_net.predict(output_blobs, **padded)
+        return dict((name, arr[:num]) for name, arr in result.iteritems())
+
+    def memory_usage(self):
+        """Returns the number of bytes held by the blobs of the net and the
+        buffers of its layers, excluding the parameters. Memory shared among
+        several blobs is counted once. The scratch memory shared by the layers
+        is reported separately by workspace_usage().
+        """
+        params = set(id(param) for param in self.params() or [])
+        arrays = {}
+        def visit(obj):
+            if isinstance(obj, Blob):
+                if id(obj) in params:
+                    return
+                for arr in (obj._data, obj._diff):
+                    if arr is not None:
+                        while arr.base is not None and isinstance(
+                                arr.base, np.ndarray):
+                            arr = arr.base
+                        arrays[arr.ctypes.data] = arr.nbytes
+            elif isinstance(obj, Layer):
+                for value in obj.__dict__.itervalues():
+                    visit(value)
+            elif isinstance(obj, (list, tuple)):
+                for value in obj:
+                    visit(value)
+        for blob in self.blobs.itervalues():
+            visit(blob)
+        for layer in self.layers.itervalues():
+            if not isinstance(layer, DataLayer):
+                visit(layer)
+        return sum(arrays.itervalues())
+
+    def workspace_usage(self):
+        """Returns the number of bytes held by the workspace that the layers
+        request their temporary arrays from (see Layer.workspace()), which is
+        the largest scratch memory needed by a single layer, for each thread
+        that ran the net.
+        """
+        return self._workspace.nbytes()
+
     def feature(self, blob_name):
         """Returns the data in a specific blob name as the intermediate
         feature for the last run of either forward() or predict(). Note that
@@ -606,10 +2481,82 @@ class Net(object):
         Input:
             blob_name: the blob name to return.
         """
+        self._check_preserved(blob_name)
         return self.blobs[blob_name].data()
 
     def update(self):
         """Update the parameters using the diff values provided in the
         parameters blob."""
+        if self._inference_only:
+            raise DecafError('A net cloned for inference can only be used for'
+                             ' prediction.')
         for _, layer in self.layers.iteritems():
             layer.update()
+
+    def clone_for_inference(self):
+        """Returns a copy of the net for prediction that shares the parameter
+        blobs with this net, but owns its activation blobs and the scratch
+        state of its layers. Several threads can thus run predict() on their
+        own clones concurrently, with a single copy of the weights. Since our
+        c++ kernels and BLAS release the interpreter lock, this scales with
+        the number of cores.
+
+        The data layers are shared too, so the clone's inputs should be given
+        to predict(). The parameters should not be changed while clones are
+        running, and the clone can not be trained. Clone the net before
+        serving from it, since cloning resets the layers' scratch state.
+        """
+        if not self._finished:
+            raise DecafError('Call finish() before you clone the network.')
+        # the clones used by predict() with workers or buckets are not
+        # copied.
+        memo = {id(self._workers): None,
+                id(self._bucket_plans): OrderedDict()}
+        # the clone does not train, and does not need the prefix cache.
+        memo[id(self._prefix_puffs)] = {}
+        for layer in self.layers.itervalues():
+            if isinstance(layer, DataLayer):
+                memo[id(layer)] = layer
+            for param in layer.param():
+                memo[id(param)] = param
+        # the activations are recomputed by the clone, so we do not copy them.
+        for blob in self.blobs.itervalues():
+            if id(blob) not in memo:
+                memo[id(blob)] = Blob(filler=blob._filler)
+        clone = copy.deepcopy(self, memo)
+        clone._inference_only = True
+        clone._prefix_cache = None
+        for layer in clone.layers.itervalues():
+            layer.release_buffers()
+        # finishing again recreates the shared buffers of the memory plan,
+        # which are not copied.
+        clone.finish()
+        return clone
+
+    def astype(self, dtype):
+        """Converts the parameters of the net, including their diffs, to the
+        given dtype. The intermediate blobs follow the dtype of the input
+        data, so the inputs should be given in the same dtype (the data
+        layers and samplers take a dtype argument). The state kept by a
+        solver is created in the dtype of the parameters; pass the dtype to
+        the solver to convert the net before solving. Parameters that are
+        not initialized yet will be created in the dtype of the input data.
+
+        Input:
+            dtype: the dtype to convert to, such as numpy.float32.
+        Output:
+            self: the converted net.
+        """
+        dtype = np.dtype(dtype)
+        for _, layer in self.layers.iteritems():
+            for param in layer.param():
+                # quantized weights stay in their integer dtype.
+                if (not param.has_data() or param.data().dtype == dtype or
+                    not np.issubdtype(param.data().dtype, np.floating)):
+                    continue
+                data = param.data().astype(dtype)
+                diff = param.diff()
+                param.init_data(data.shape, dtype, setdata=False)[:] = data
+                if diff is not None:
+                    param.init_diff(setzero=False)[:] = diff
+        return self
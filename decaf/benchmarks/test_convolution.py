@@ -1,13 +1,12 @@
 from decaf import base
-from decaf.layers import convolution
+from decaf.layers import convolution, fillers
 import numpy as np
 import time
 
-from theano.tensor.nnet import conv
-import theano
-import theano.tensor as T
-
 def theano_convolution(input_size, dtype, num_kernels, ksize, mode, iternum):
+    from theano.tensor.nnet import conv
+    import theano
+    import theano.tensor as T
     rng = np.random.RandomState(23455)
     # instantiate 4D tensor for input
     if dtype == np.float32:
@@ -37,17 +36,19 @@ def theano_convolution(input_size, dtype, num_kernels, ksize, mode, iternum):
         filtered_img = f(img_)
     print 'theano time:', (time.time() - start) / iternum
 
-def decaf_convolution(input_size, dtype, num_kernels, ksize, stride, mode, iternum):
+def decaf_convolution(input_size, dtype, num_kernels, ksize, stride, mode, iternum,
+                      engine='im2col'):
     bottom = base.Blob((1,) + input_size, dtype=dtype)
     layer = convolution.ConvolutionLayer(
         name='conv', num_kernels=num_kernels, ksize=ksize,
-        stride=stride, mode=mode)
+        stride=stride, mode=mode, engine=engine)
     top = base.Blob()
     # run a forward pass first to initialize everything.
     layer.forward([bottom], [top])
     top.init_diff()
     top.diff().flat = 1.
     print '*****'
+    print 'engine:', engine
     print 'input shape:', bottom.data().shape[1:]
     start = time.time()
     for i in range(iternum):
@@ -60,15 +61,61 @@ def decaf_convolution(input_size, dtype, num_kernels, ksize, stride, mode, itern
     print 'backward runtime:', (time.time() - start) / iternum
     print '*****'
 
+def _time_passes(layer, bottom, top, iternum):
+    """Returns the average forward and backward runtimes of the layer."""
+    # run a pass first to initialize everything.
+    layer.forward([bottom], [top])
+    top.init_diff()
+    top.diff().flat = 1.
+    layer.backward([bottom], [top], True)
+    start = time.time()
+    for i in range(iternum):
+        layer.forward([bottom], [top])
+    forward = (time.time() - start) / iternum
+    start = time.time()
+    for i in range(iternum):
+        layer.backward([bottom], [top], True)
+    return forward, (time.time() - start) / iternum
+
+def compare_engines(input_size, num, dtype, num_kernels, ksize, engine,
+                    iternum):
+    """Compares an engine with im2col on a batch of num images in 'same'
+    mode."""
+    bottom = base.Blob((num,) + input_size, dtype=dtype,
+                       filler=fillers.RandFiller())
+    runtimes = {}
+    for name in ['im2col', engine]:
+        layer = convolution.ConvolutionLayer(
+            name='conv', num_kernels=num_kernels, ksize=ksize, stride=1,
+            mode='same', engine=name,
+            filler=fillers.GaussianRandFiller(std=0.01))
+        runtimes[name] = _time_passes(layer, bottom, base.Blob(), iternum)
+    print '%s, input shape %s, %d kernels of size %d:' % (
+        engine, bottom.data().shape, num_kernels, ksize)
+    for i, direction in enumerate(['forward', 'backward']):
+        print '    %s: im2col %.4f, %s %.4f, speedup %.2f' % (
+            direction, runtimes['im2col'][i], engine, runtimes[engine][i],
+            runtimes['im2col'][i] / runtimes[engine][i])
+
 if __name__ == '__main__':
+    print 'compare the engines with im2col'
+    compare_engines((32, 32, 64), 16, np.float32, 64, 11, 'fft', 5)
+    compare_engines((64, 64, 32), 8, np.float32, 64, 9, 'fft', 5)
+    compare_engines((27, 27, 96), 16, np.float32, 128, 7, 'fft', 5)
+    compare_engines((27, 27, 256), 16, np.float32, 256, 3, 'winograd', 5)
+    compare_engines((13, 13, 384), 16, np.float32, 384, 3, 'winograd', 5)
+    compare_engines((56, 56, 64), 8, np.float32, 64, 3, 'winograd', 5)
     print 'test float32'
     theano_convolution((256,256,3), np.float32, 16, 11,    'full', 50)
     decaf_convolution((256,256,3), np.float32, 16, 11, 1, 'full', 50)
     theano_convolution((256,256,3), np.float32, 16, 11,    'valid', 50)
     decaf_convolution((256,256,3), np.float32, 16, 11, 1, 'valid', 50)
+    decaf_convolution((256,256,3), np.float32, 16, 11, 1, 'valid', 50, 'fft')
     print 'test thick convolution'
     theano_convolution((55,55,96), np.float32, 256, 3,    'full', 50)
     decaf_convolution((55,55,96), np.float32, 256, 3, 1, 'full', 50)
     theano_convolution((55,55,96), np.float32, 256, 3,    'valid', 50)
     decaf_convolution((55,55,96), np.float32, 256, 3, 1, 'valid', 50)
+    decaf_convolution((55,55,96), np.float32, 256, 3, 1, 'valid', 50,
+                      'winograd')
 
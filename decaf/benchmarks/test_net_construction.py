@@ -0,0 +1,48 @@
+"""Checks that constructing and finishing a net takes time roughly linear in
+the number of layers.
+"""
+from decaf import base
+from decaf.layers import core_layers
+import time
+
+def build_chain(num_layers):
+    """Builds a chain of num_layers ReLU layers with add_layers."""
+    decaf_net = base.Net()
+    decaf_net.add_layers(
+        [core_layers.ReLULayer(name='relu%d' % i) for i in range(num_layers)],
+        needs='data', provides='output')
+    return decaf_net
+
+def build_branches(num_layers):
+    """Builds a net where every other layer reads the same blob, so that
+    finish() needs to insert a split layer with many outputs.
+    """
+    decaf_net = base.Net()
+    for i in range(num_layers):
+        decaf_net.add_layer(core_layers.ReLULayer(name='relu%d' % i),
+                            needs='data', provides='output%d' % i)
+    return decaf_net
+
+def benchmark(builder, num_layers):
+    """Times the construction, the first finish() and a second finish()."""
+    start = time.time()
+    decaf_net = builder(num_layers)
+    construct = time.time() - start
+    start = time.time()
+    decaf_net.finish()
+    finish = time.time() - start
+    start = time.time()
+    decaf_net.finish()
+    refinish = time.time() - start
+    print '%8d layers: construct %.3fs, finish %.3fs, finish again %.3fs,' \
+          ' %.1f us per layer' % (
+              num_layers, construct, finish, refinish,
+              (construct + finish + refinish) / num_layers * 1e6)
+
+if __name__ == '__main__':
+    print 'Chain nets built with add_layers:'
+    for num_layers in [1000, 2000, 4000, 8000, 16000]:
+        benchmark(build_chain, num_layers)
+    print 'Nets with a single blob shared by all layers:'
+    for num_layers in [1000, 2000, 4000, 8000, 16000]:
+        benchmark(build_branches, num_layers)
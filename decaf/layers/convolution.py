@@ -2,8 +2,10 @@
 
 from decaf import base
 from decaf.layers.cpp import wrapper
-from decaf.util import blasdot
+from decaf.util import autotune, blasdot, fastconv, quantize
+import logging
 import numpy as np
+import time
 
 class ConvolutionLayer(base.Layer):
     """A layer that implements the convolution function."""
@@ -31,9 +33,36 @@ class ConvolutionLayer(base.Layer):
                 regardless of the location. Default True.
             bias_filler: a filler to unitialize the bias. Should be a
                 decaf.base.Filler instance. Default None.
+            memory: the number of bytes that the im2col buffer may use. The
+                images are processed in chunks that fit into the buffer (at
+                least one image per chunk), so that each chunk is multiplied
+                with the kernels in a single GEMM. The backward pass needs
+                another buffer of the same size for the gradients. Default
+                1e7.
             large_mem: if set True, the layer will consume a lot of memory by
                 storing all the intermediate im2col results, but will increase
-                the backward operation time. Default False.
+                the backward operation time. This overrides memory. Default
+                False.
+            engine: the algorithm computing the convolution. 'im2col' lowers
+                the convolution to a GEMM; 'fft' multiplies the Fourier
+                transforms of the images and the kernels, which pays off for
+                large kernels; 'winograd' computes 2x2 output tiles with the
+                Winograd F(2x2, 3x3) algorithm, and only supports 3x3 kernels.
+                Both 'fft' and 'winograd' need stride 1 and do not support
+                large_mem; memory then bounds their transformed chunks. The
+                transformed kernels are kept until the kernels change, see
+                decaf.util.fastconv. 'auto' times the engines that apply, as
+                well as im2col with one image per chunk, on the first forward
+                pass for every input shape, and picks the fastest; the
+                decisions are cached per machine and shape, in memory unless
+                a cache file is set (see decaf.util.autotune). Default
+                'im2col'.
+        The im2col engine pads the data implicitly while lowering it, so it
+        never makes a padded copy of the data or of its gradient; the other
+        engines work on a padded copy. Unless large_mem is set, the padded
+        data and the im2col buffers are requested from the workspace of the
+        layer (see base.Layer.workspace()) and are not kept between calls.
+        Quantized layers always use the im2col engine.
         When computing convolutions, we will always start from the top left
         corner, and any rows/columns on the right and bottom sides that do not
         fit the stride will be discarded. To enforce the 'same' mode to return
@@ -45,14 +74,45 @@ class ConvolutionLayer(base.Layer):
         self._ksize = self.spec['ksize']
         self._stride = self.spec['stride']
         self._large_mem = self.spec.get('large_mem', False)
+        self._memory = self.spec.get('memory', 1e7)
         self._reg = self.spec.get('reg', None)
         self._has_bias = self.spec.get('has_bias', True)
+        self._fused_relu = False
+        # the padding of a fused padding layer, see fuse_padding().
+        self._fused_pad = 0
+        # the quantized kernels and their scales, see quantize().
+        self._quantized = False
+        self._input_scale = None
+        self._qkernels = base.Blob()
+        self._qscale = base.Blob()
         if self._ksize <= 1:
             raise ValueError('Invalid kernel size. Kernel size should > 1.')
+        self._engine = self.spec.get('engine', 'im2col')
+        if self._engine not in ('im2col', 'fft', 'winograd', 'auto'):
+            raise ValueError('Unknown engine: %s' % self._engine)
+        if self._engine == 'auto':
+            if self._large_mem:
+                raise ValueError('The auto engine does not support large_mem.')
+            # the engine and memory budget are chosen per input shape, see
+            # _select_engine().
+            self._autotune = True
+            self._engine = 'im2col'
+            self._tuned = {}
+        else:
+            self._autotune = False
+        if self._engine != 'im2col':
+            if self._stride != 1 or self._large_mem:
+                raise ValueError('The %s engine needs stride 1, and does not'
+                                 ' support large_mem.' % self._engine)
+            if self._engine == 'winograd' and self._ksize != 3:
+                raise ValueError('The winograd engine needs 3x3 kernels.')
         # since the im2col operation often creates large intermediate matrices,
-        # we will process them in batches.
-        self._padded = base.Blob()
+        # we will process them in batches. With large_mem, the im2col results
+        # of the whole batch are kept for the backward pass.
         self._col = base.Blob()
+        # the kernels transformed by the fft or winograd engine, see
+        # _engine_kernels().
+        self._transformed = None
         # set up the parameter
         self._kernels = base.Blob(filler=self.spec.get('filler', None))
         if self._has_bias:
@@ -80,7 +140,7 @@ class ConvolutionLayer(base.Layer):
         bottom_data = bottom[0].data()
         if bottom_data.ndim != 4:
             raise ValueError('Bottom data should be a 4-dim tensor.')
-        if not self._kernels.has_data():
+        if not self._quantized and not self._kernels.has_data():
             # initialize the kernels
             self._kernels.init_data(
                 (self._ksize * self._ksize * bottom_data.shape[-1],
@@ -88,57 +148,211 @@ class ConvolutionLayer(base.Layer):
                 bottom_data.dtype)
             if self._has_bias:
                 self._bias.init_data((self._num_kernels,), bottom_data.dtype)
-        # pad the data
+        if self._autotune and not self._quantized:
+            self._select_engine(bottom_data)
+        with self.workspace().frame():
+            self._forward(bottom_data, top)
+        if self._has_bias and not self._fused_relu:
+            top_data = top[0].data()
+            top_data += self._bias.data()
+        return
+
+    def _select_engine(self, bottom_data):
+        """Sets the engine and the memory budget for the shape of the input,
+        looking them up in the autotune cache or timing the candidates.
+        """
+        key = (bottom_data.shape, bottom_data.dtype.str)
+        choice = self._tuned.get(key)
+        if choice is None:
+            cache = autotune.default_cache()
+            cache_key = '%s|conv ksize=%d stride=%d pad=%d kernels=%d|%s %s' \
+                    % (autotune.machine_key(), self._ksize, self._stride,
+                       self._pad_size, self._num_kernels, bottom_data.shape,
+                       bottom_data.dtype.name)
+            choice = cache.get(cache_key)
+            if choice is None:
+                choice = self._tune(bottom_data)
+                logging.info('Autotuned layer %s for %s: %s', self.name,
+                             cache_key, choice)
+                cache.set(cache_key, choice)
+            choice = self._tuned[key] = tuple(choice)
+        self._engine, self._memory = choice
+
+    def _tune(self, bottom_data, repeat=2):
+        """Times the forward pass of the candidate engines on the input, and
+        returns the fastest [engine, memory] pair.
+        """
+        memory = self.spec.get('memory', 1e7)
+        candidates = [('im2col', 0), ('im2col', memory)]
+        if self._stride == 1:
+            candidates.append(('fft', memory))
+            if self._ksize == 3:
+                candidates.append(('winograd', memory))
+        top = base.Blob()
+        best, best_time = None, None
+        seen = set()
+        for engine, memory in candidates:
+            self._engine, self._memory = engine, memory
+            chunk = self._chunk_size(bottom_data)
+            if (engine, chunk) in seen:
+                continue
+            seen.add((engine, chunk))
+            # the first run allocates the buffers, and is not timed.
+            timings = []
+            for _ in range(repeat + 1):
+                start = time.time()
+                with self.workspace().frame():
+                    self._forward(bottom_data, [top])
+                timings.append(time.time() - start)
+            elapsed = min(timings[1:])
+            if best_time is None or elapsed < best_time:
+                best, best_time = [engine, memory], elapsed
+        return best
+
+    def _pad(self, bottom_data):
+        """Returns the padded data, which lives in the workspace."""
         if self._pad_size == 0:
-            padded_data = self._padded.mirror(bottom_data)
+            return bottom_data
+        padded_data = self.workspace().array(
+            self._padded_shape(bottom_data.shape), bottom_data.dtype)
+        padded_data[:] = 0
+        padded_data[:, self._pad_size:-self._pad_size,
+                    self._pad_size:-self._pad_size] = bottom_data
+        return padded_data
+
+    def _padded_shape(self, shape):
+        """Returns the shape of the padded data."""
+        return (shape[0], shape[1] + self._pad_size * 2,
+                shape[2] + self._pad_size * 2, shape[3])
+
+    def _col_shape(self, bottom_data, num):
+        """Returns the shape of the im2col output of num images."""
+        _, height, width, channels = self._padded_shape(bottom_data.shape)
+        return (num,
+                (height - self._ksize) / self._stride + 1,
+                (width - self._ksize) / self._stride + 1,
+                channels * self._ksize * self._ksize)
+
+    def _uses_im2col(self):
+        """Returns True if the convolution is lowered to a GEMM."""
+        return self._engine == 'im2col' or self._quantized
+
+    def _chunk_size(self, bottom_data):
+        """Returns the number of images that are processed together, which
+        is the whole batch with large_mem, and otherwise the number of images
+        whose im2col output (or transforms, for the other engines) fits into
+        the memory budget.
+        """
+        num, height, width, channels = self._padded_shape(bottom_data.shape)
+        if self._large_mem:
+            return num
+        if self._uses_im2col():
+            image_bytes = (np.prod(self._col_shape(bottom_data, 1)) *
+                           bottom_data.itemsize)
+        elif self._engine == 'fft':
+            # the transforms are complex, with the precision of the data.
+            image_bytes = (height * (width / 2 + 1) *
+                           (channels + self._num_kernels) *
+                           bottom_data.itemsize * 2)
         else:
-            padded_data = self._padded.init_data(
-                    (bottom_data.shape[0],
-                     bottom_data.shape[1] + self._pad_size * 2,
-                     bottom_data.shape[2] + self._pad_size * 2,
-                     bottom_data.shape[3]),
-                    bottom_data.dtype)
-            padded_data[:, self._pad_size:-self._pad_size,
-                        self._pad_size:-self._pad_size] = bottom_data
-        # initialize self._col
+            image_bytes = (16 * ((height - 1) / 2) * ((width - 1) / 2) *
+                           (channels + self._num_kernels) *
+                           bottom_data.itemsize)
+        return int(max(1, min(num, self._memory // image_bytes)))
+
+    def _col_buffer(self, bottom_data, chunk):
+        """Returns the im2col buffer for chunks of the given size."""
+        shape = self._col_shape(bottom_data, chunk)
         if self._large_mem:
-            col_data_num = bottom_data.shape[0]
+            return self._col.init_data(shape, bottom_data.dtype,
+                                       setdata=False)
+        else:
+            return self.workspace().array(shape, bottom_data.dtype)
+
+    def _forward(self, bottom_data, top):
+        """Computes the product with the kernels within a workspace frame.
+        """
+        chunk = self._chunk_size(bottom_data)
+        if self._uses_im2col():
+            col_buffer = self._col_buffer(bottom_data, chunk)
         else:
-            col_data_num = 1
-        col_data = self._col.init_data(
-            (col_data_num,
-             (padded_data.shape[1] - self._ksize) / self._stride + 1,
-             (padded_data.shape[2] - self._ksize) / self._stride + 1,
-             padded_data.shape[3] * self._ksize * self._ksize),
-            padded_data.dtype, setdata=False)
+            padded_data = self._pad(bottom_data)
+            kernels_t = self._engine_kernels(padded_data.shape)
         # initialize top data
         top_data = top[0].init_data(
-            (bottom_data.shape[0], col_data.shape[1], col_data.shape[2],
-             self._num_kernels), dtype=bottom_data.dtype, setdata=False)
-        # process data individually
-        if self._large_mem:
-            wrapper.im2col_forward(padded_data, col_data,
-                                   self._ksize, self._stride)
-            blasdot.dot_lastdim(col_data, self._kernels.data(), out=top_data)
+            self.infer_shapes([bottom_data.shape], 1)[0],
+            dtype=bottom_data.dtype, setdata=False)
+        # process the data by chunks, with one GEMM per chunk.
+        for start in range(0, bottom_data.shape[0], chunk):
+            end = min(start + chunk, bottom_data.shape[0])
+            if self._uses_im2col():
+                col_data = col_buffer[:end - start]
+                wrapper.im2col_forward(bottom_data[start:end], col_data,
+                                       self._ksize, self._stride,
+                                       self._pad_size)
+                self._dot_kernels(col_data, top_data[start:end])
+            elif self._engine == 'fft':
+                fastconv.fft_forward(padded_data[start:end], kernels_t,
+                                     self._ksize, top_data[start:end])
+            else:
+                fastconv.winograd_forward(padded_data[start:end], kernels_t,
+                                          top_data[start:end])
+            if self._fused_relu:
+                # finish the output while it is still in cache.
+                self._bias_relu(top_data[start:end])
+
+    def _dot_kernels(self, col_data, out):
+        """Multiplies the im2col data with the (possibly quantized) kernels.
+        """
+        if self._quantized:
+            blasdot.dot_lastdim_quantized(
+                col_data, self._qkernels.data(), self._qscale.data(),
+                out=out, A_scale=self._input_scale)
         else:
-            for i in range(bottom_data.shape[0]):
-                # call im2col individually
-                wrapper.im2col_forward(padded_data[i:i+1], col_data,
-                                       self._ksize, self._stride)
-                blasdot.dot_lastdim(col_data, self._kernels.data(),
-                                    out=top_data[i])
+            blasdot.dot_lastdim(col_data, self._kernels.data(), out=out)
+
+    def _bias_relu(self, data):
+        """Adds the bias (if any) and applies the fused ReLU in place."""
         if self._has_bias:
-            top_data += self._bias.data()
-        return
+            wrapper.bias_relu_forward(data, self._bias.data())
+        else:
+            wrapper.relu_forward(data, data)
 
     def backward(self, bottom, top, propagate_down):
         """Runs the backward pass."""
+        if self._quantized:
+            raise base.DecafError(
+                'Quantized layer %s only supports prediction.' % self.name)
         top_diff = top[0].diff()
-        padded_data = self._padded.data()
-        col_data = self._col.data()
+        if self._fused_relu:
+            wrapper.relu_backward(top[0].data(), top_diff, top_diff)
         bottom_data = bottom[0].data()
         if bottom_data.ndim != 4:
             raise ValueError('Bottom data should be a 4-dim tensor.')
+        with self.workspace().frame():
+            self._backward(bottom, top_diff, propagate_down)
+        # finally, add the regularization term
+        if self._reg is not None:
+            return self._reg.reg(self._kernels, bottom_data.shape[0])
+        else:
+            return 0.
+
+    def _backward(self, bottom, top_diff, propagate_down):
+        """Computes the gradients within a workspace frame."""
+        workspace = self.workspace()
+        bottom_data = bottom[0].data()
+        if self._large_mem:
+            # the col_data of the whole batch is pre-stored.
+            col_buffer = self._col.data()
+            chunk = bottom_data.shape[0]
+        else:
+            chunk = self._chunk_size(bottom_data)
+            if self._uses_im2col():
+                col_buffer = self._col_buffer(bottom_data, chunk)
+            else:
+                # the padded data is not kept from the forward pass.
+                padded_data = self._pad(bottom_data)
+                kernels_t = self._engine_kernels(padded_data.shape)
         kernel_diff = self._kernels.init_diff()
         if self._has_bias:
             bias_diff = self._bias.init_diff()
@@ -149,57 +363,168 @@ class ConvolutionLayer(base.Layer):
                    axis=0, out=bias_diff)
         if propagate_down:
             bottom_diff = bottom[0].init_diff(setzero=False)
-            col_diff = self._col.init_diff()
-            if self._pad_size == 0:
-                padded_diff = self._padded.mirror_diff(bottom_diff)
+            if self._uses_im2col():
+                col_diff_buffer = workspace.array(col_buffer.shape,
+                                                  col_buffer.dtype)
+            if self._uses_im2col() or self._pad_size == 0:
+                padded_diff = bottom_diff
             else:
-                padded_diff = self._padded.init_diff(setzero=False)
-        if self._large_mem:
-            # we have the col_data all pre-stored, making things more efficient.
-            blasdot.dot_firstdims(col_data, top_diff, out=kernel_diff)
-            if propagate_down:
-                blasdot.dot_lastdim(top_diff, self._kernels.data().T,
-                                    out=col_diff)
-                wrapper.im2col_backward(padded_diff, col_diff,
-                                    self._ksize, self._stride)
+                padded_diff = workspace.array(
+                    self._padded_shape(bottom_diff.shape), bottom_diff.dtype)
+        if chunk < bottom_data.shape[0]:
+            kernel_diff_buffer = workspace.array(kernel_diff.shape,
+                                                 kernel_diff.dtype)
         else:
-            kernel_diff_buffer = np.zeros_like(kernel_diff)
-            for i in range(bottom_data.shape[0]):
+            kernel_diff_buffer = kernel_diff
+        for start in range(0, bottom_data.shape[0], chunk):
+            end = min(start + chunk, bottom_data.shape[0])
+            if not self._uses_im2col():
+                self._engine_backward(
+                    padded_data[start:end], top_diff[start:end], kernels_t,
+                    kernel_diff_buffer,
+                    padded_diff[start:end] if propagate_down else None)
+                if kernel_diff_buffer is not kernel_diff:
+                    kernel_diff += kernel_diff_buffer
+                continue
+            col_data = col_buffer[:end - start]
+            if not self._large_mem:
                 # although it is a backward layer, we still need to compute
                 # the intermediate results using forward calls.
-                wrapper.im2col_forward(padded_data[i:i+1], col_data,
-                                       self._ksize, self._stride)
-                blasdot.dot_firstdims(col_data, top_diff[i],
-                                     out=kernel_diff_buffer)
+                wrapper.im2col_forward(bottom_data[start:end], col_data,
+                                       self._ksize, self._stride,
+                                       self._pad_size)
+            blasdot.dot_firstdims(col_data, top_diff[start:end],
+                                  out=kernel_diff_buffer)
+            if kernel_diff_buffer is not kernel_diff:
                 kernel_diff += kernel_diff_buffer
-                if propagate_down:
-                    blasdot.dot_lastdim(top_diff[i], self._kernels.data().T,
-                                        out=col_diff)
-                    # im2col backward
-                    wrapper.im2col_backward(padded_diff[i:i+1], col_diff,
-                                            self._ksize, self._stride)
-        # finally, copy results to the bottom diff.
+            if propagate_down:
+                col_diff = col_diff_buffer[:end - start]
+                blasdot.dot_lastdim(top_diff[start:end],
+                                    self._kernels.data().T, out=col_diff)
+                # im2col backward
+                wrapper.im2col_backward(bottom_diff[start:end], col_diff,
+                                        self._ksize, self._stride,
+                                        self._pad_size)
+        # finally, copy the results of the other engines to the bottom diff.
         if propagate_down:
-            if self._pad_size != 0:
+            if padded_diff is not bottom_diff:
                 bottom_diff[:] = padded_diff[:,
                                              self._pad_size:-self._pad_size,
                                              self._pad_size:-self._pad_size]
-        # finally, add the regularization term
-        if self._reg is not None:
-            return self._reg.reg(self._kernels, bottom_data.shape[0])
+
+    def _engine_kernels(self, padded_shape):
+        """Returns the kernels transformed by the fft or winograd engine for
+        padded data of the given shape. The transforms are computed once and
+        kept with a copy of the kernels they were computed from, so they are
+        only recomputed when the kernels (or, for the fft engine, the image
+        size) change, however the kernels are modified.
+        """
+        kernels = self._kernels.data()
+        key = (self._engine, kernels.dtype,
+               padded_shape[1:3] if self._engine == 'fft' else None)
+        if self._transformed is not None:
+            cached_key, cached_kernels, transformed = self._transformed
+            if cached_key == key and np.array_equal(cached_kernels, kernels):
+                return transformed
+        if self._engine == 'fft':
+            transformed = fastconv.fft_kernels(kernels, self._ksize,
+                                               padded_shape[1:3])
         else:
-            return 0.
+            transformed = fastconv.winograd_kernels(kernels)
+        self._transformed = (key, kernels.copy(), transformed)
+        return transformed
+
+    def _engine_backward(self, padded_data, top_diff, kernels_t, kernel_diff,
+                         padded_diff):
+        """Computes the gradients of a chunk with the fft or winograd engine.
+        """
+        if self._engine == 'fft':
+            fastconv.fft_backward(padded_data, top_diff, kernels_t,
+                                  self._ksize, kernel_diff, padded_diff)
+        else:
+            fastconv.winograd_backward(padded_data, top_diff, kernels_t,
+                                       kernel_diff, padded_diff)
 
     def __getstate__(self):
-        """When pickling, we will remove the intermediate data."""
-        self._padded = base.Blob()
+        """When pickling, we will remove the intermediate data, the
+        transformed kernels, and the autotuned engines which are specific to
+        the machine."""
         self._col = base.Blob()
+        self._transformed = None
+        if self._autotune:
+            self._tuned = {}
         return self.__dict__
 
+    def release_buffers(self):
+        """Releases the im2col buffer kept with large_mem."""
+        self._col = base.Blob()
+
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """Computes the output shape as in forward()."""
+        num, height, width, _ = bottom_shapes[0]
+        pad = self._pad_size * 2
+        return [(num,
+                 (height + pad - self._ksize) / self._stride + 1,
+                 (width + pad - self._ksize) / self._stride + 1,
+                 self._num_kernels)]
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the multiply-adds of the im2col product (or the operations
+        of the fft and winograd engines) and the bias."""
+        output_size = int(np.prod(top_shapes[0]))
+        padded_shape = self._padded_shape(bottom_shapes[0])
+        if self._uses_im2col():
+            flops = 2 * output_size * self._ksize * self._ksize * \
+                    bottom_shapes[0][-1]
+        elif self._engine == 'fft':
+            flops = padded_shape[0] * fastconv.fft_flops(
+                padded_shape, self._ksize, self._num_kernels)
+        else:
+            flops = padded_shape[0] * fastconv.winograd_flops(
+                padded_shape, self._num_kernels)
+        if self._has_bias:
+            flops += output_size
+        return flops
+
     def update(self):
         """updates the parameters."""
         # Only the inner product layer needs to be updated.
+        if self._quantized:
+            return
         self._kernels.update()
         if self._has_bias:
             self._bias.update()
 
+    def backward_needs_top_data(self):
+        """The convolution backward pass only needs the bottom data, unless
+        a ReLU is fused into the layer."""
+        return self._fused_relu
+
+    def fuse_relu(self, fuse=True):
+        """The convolution layer supports ReLU fusion."""
+        self._fused_relu = fuse
+        return True
+
+    def fuse_padding(self, pad):
+        """The convolution layer pads its input implicitly, and supports the
+        fusion of zero padding."""
+        self._pad_size += pad - getattr(self, '_fused_pad', 0)
+        self._fused_pad = pad
+        return True
+
+    def quantize(self, input_scale):
+        """Quantizes the kernels to int8 with one scale per kernel, and
+        releases the float kernels."""
+        if not self._kernels.has_data():
+            raise base.DecafError(
+                'Run layer %s before quantizing it.' % self.name)
+        kernels, scale = quantize.quantize_weights(self._kernels.data())
+        self._qkernels.mirror(kernels)
+        self._qscale.mirror(scale)
+        self._input_scale = input_scale
+        self._quantized = True
+        self._kernels.clear()
+        self._param = [self._qkernels, self._qscale]
+        if self._has_bias:
+            self._param.append(self._bias)
+        return True
@@ -3,42 +3,43 @@
 #include <cmath>
 #include <cstdlib>
 #include <cstring>
+#include <omp.h>
 
 #include "fastpool.h"
 
 using std::max;
 using std::min;
 
+// The extern functions below run the rows of all the images in parallel.
+// Every output row is written by a single thread in a fixed order, so the
+// results do not depend on the number of threads.
+
 template <typename Dtype>
 inline void _maxpooling_forward(
         const Dtype* image, Dtype* pooled, const int height, const int width,
-        const int nchannels, const int psize, const int stride) {
-    int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
+        const int nchannels, const int psize, const int stride,
+        const int ph) {
+    // Computes the pooled row ph.
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
-    for (int i = 0; i < pooled_height * pooled_width * nchannels; ++i) {
-        pooled[i] = -FLT_MAX;
-    }
-    // This code is written in a forward mode: we go through the pixels once,
-    // and write to all the pooled regions that it maps to.
-    for (int i = 0; i < height; ++i) {
-        for (int j = 0; j < width; ++j) {
-            // Processing pixel at [i,j].
-            // First, compute the pooling region
-            int h_start = (i < psize) ? 0 : (i - psize) / stride + 1;
-            int h_end = min(i / stride + 1, pooled_height);
-            int w_start = (j < psize) ? 0 : (j - psize) / stride + 1;
-            int w_end = min(j / stride + 1, pooled_width);
-            const Dtype* p_image = image + (i * width + j) * nchannels;
-            for (int ph = h_start; ph < h_end; ++ph) {
-                for (int pw = w_start; pw < w_end; ++pw) {
-                    Dtype* p_pooled = pooled + (ph * pooled_width + pw) * nchannels;
-                    for (int c = 0; c < nchannels; ++c) {
-                        p_pooled[c] = max(p_pooled[c], p_image[c]);
-                    }
+    int h_start = ph * stride;
+    int h_end = min(height, h_start + psize);
+    Dtype* p_pooled = pooled + ph * pooled_width * nchannels;
+    for (int pw = 0; pw < pooled_width; ++pw) {
+        int w_start = pw * stride;
+        int w_end = min(width, w_start + psize);
+        for (int c = 0; c < nchannels; ++c) {
+            p_pooled[c] = -FLT_MAX;
+        }
+        for (int i = h_start; i < h_end; ++i) {
+            for (int j = w_start; j < w_end; ++j) {
+                const Dtype* p_image = image + (i * width + j) * nchannels;
+                for (int c = 0; c < nchannels; ++c) {
+                    p_pooled[c] = max(p_pooled[c], p_image[c]);
                 }
             }
-        } // loop over width
-    } // loop over height
+        }
+        p_pooled += nchannels;
+    }
 }
 
 
@@ -46,65 +47,129 @@ template <typename Dtype>
 inline void _maxpooling_backward(
         const Dtype* image, const Dtype* pooled, Dtype* image_grad,
         const Dtype* pooled_grad, const int height, const int width,
-        const int nchannels, const int psize, const int stride) {
+        const int nchannels, const int psize, const int stride,
+        const int i) {
+    // Computes the gradient of the image row i: we go through the pixels of
+    // the row, and gather the gradients of all the pooled regions that they
+    // map to.
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
-    memset(image_grad, 0, sizeof(Dtype) * height * width * nchannels);
-    // This code is written in a forward mode: we go through the pixels once,
-    // and write to all the pooled regions that it maps to.
-    for (int i = 0; i < height; ++i) {
-        for (int j = 0; j < width; ++j) {
-            // Processing pixel at [i,j].
-            // First, compute the pooling region
-            int h_start = (i < psize) ? 0 : (i - psize) / stride + 1;
-            int h_end = min(i / stride + 1, pooled_height);
-            int w_start = (j < psize) ? 0 : (j - psize) / stride + 1;
-            int w_end = min(j / stride + 1, pooled_width);
-            const Dtype* p_image = image + (i * width + j) * nchannels;
-            Dtype* p_image_grad = image_grad + (i * width + j) * nchannels;
-            for (int ph = h_start; ph < h_end; ++ph) {
-                for (int pw = w_start; pw < w_end; ++pw) {
-                    const Dtype* p_pooled = pooled + (ph * pooled_width + pw) * nchannels;
-                    const Dtype* p_pooled_grad = pooled_grad + 
-                        (ph * pooled_width + pw) * nchannels;
-                    for (int c = 0; c < nchannels; ++c) {
-                        p_image_grad[c] += p_pooled_grad[c] * (p_image[c] >= p_pooled[c]);
+    memset(image_grad + i * width * nchannels, 0,
+           sizeof(Dtype) * width * nchannels);
+    for (int j = 0; j < width; ++j) {
+        // Processing pixel at [i,j].
+        // First, compute the pooling region
+        int h_start = (i < psize) ? 0 : (i - psize) / stride + 1;
+        int h_end = min(i / stride + 1, pooled_height);
+        int w_start = (j < psize) ? 0 : (j - psize) / stride + 1;
+        int w_end = min(j / stride + 1, pooled_width);
+        const Dtype* p_image = image + (i * width + j) * nchannels;
+        Dtype* p_image_grad = image_grad + (i * width + j) * nchannels;
+        for (int ph = h_start; ph < h_end; ++ph) {
+            for (int pw = w_start; pw < w_end; ++pw) {
+                const Dtype* p_pooled = pooled + (ph * pooled_width + pw) * nchannels;
+                const Dtype* p_pooled_grad = pooled_grad + 
+                    (ph * pooled_width + pw) * nchannels;
+                for (int c = 0; c < nchannels; ++c) {
+                    p_image_grad[c] += p_pooled_grad[c] * (p_image[c] >= p_pooled[c]);
+                }
+            }
+        }
+    } // loop over width
+}
+
+
+template <typename Dtype>
+inline void _maxpooling_argmax_forward(
+        const Dtype* image, Dtype* pooled, short* argmax, const int height,
+        const int width, const int nchannels, const int psize,
+        const int stride, const int ph) {
+    // Computes the pooled row ph as _maxpooling_forward does, and records in
+    // argmax the offset of the (first) maximum within the pooling region,
+    // i.e. (i - h_start) * psize + (j - w_start).
+    int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
+    int h_start = ph * stride;
+    int h_end = min(height, h_start + psize);
+    Dtype* p_pooled = pooled + ph * pooled_width * nchannels;
+    short* p_argmax = argmax + ph * pooled_width * nchannels;
+    for (int pw = 0; pw < pooled_width; ++pw) {
+        int w_start = pw * stride;
+        int w_end = min(width, w_start + psize);
+        for (int c = 0; c < nchannels; ++c) {
+            p_pooled[c] = -FLT_MAX;
+            p_argmax[c] = 0;
+        }
+        for (int i = h_start; i < h_end; ++i) {
+            for (int j = w_start; j < w_end; ++j) {
+                const Dtype* p_image = image + (i * width + j) * nchannels;
+                short offset = (i - h_start) * psize + j - w_start;
+                for (int c = 0; c < nchannels; ++c) {
+                    if (p_image[c] > p_pooled[c]) {
+                        p_pooled[c] = p_image[c];
+                        p_argmax[c] = offset;
                     }
                 }
             }
-        } // loop over width
-    } // loop over height
+        }
+        p_pooled += nchannels;
+        p_argmax += nchannels;
+    }
 }
 
 
 template <typename Dtype>
-inline void _avepooling_forward(
-        const Dtype* image, Dtype* pooled, const int height, const int width,
-        const int nchannels, const int psize, const int stride) {
+inline void _maxpooling_argmax_backward(
+        Dtype* image_grad, const Dtype* pooled_grad, const short* argmax,
+        const int height, const int width, const int nchannels,
+        const int psize, const int stride) {
+    // Routes the gradient of every pooled element to its recorded maximum,
+    // in a single pass over the pooled image.
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
-    memset(pooled, 0, sizeof(Dtype) * pooled_height * pooled_width * nchannels);
+    memset(image_grad, 0, sizeof(Dtype) * height * width * nchannels);
     for (int ph = 0; ph < pooled_height; ++ph) {
         for (int pw = 0; pw < pooled_width; ++pw) {
-            int h_start = ph * stride;
-            int h_end = min(height, h_start + psize);
-            int w_start = pw * stride;
-            int w_end = min(width, w_start + psize);
-            Dtype* p_pooled = pooled + (ph * pooled_width + pw) * nchannels;
-            for (int i = h_start; i < h_end; ++i) {
-                for (int j = w_start; j < w_end; ++j) {
-                    const Dtype* p_image = image + (i * width + j) * nchannels;
-                    for (int c = 0; c < nchannels; ++c) {
-                        p_pooled[c] += p_image[c];
-                    }
-                }
-            }
-            // normalize
-            Dtype scale = 1. / Dtype((h_end - h_start) * (w_end - w_start));
+            int offset = (ph * pooled_width + pw) * nchannels;
+            const Dtype* p_pooled_grad = pooled_grad + offset;
+            const short* p_argmax = argmax + offset;
             for (int c = 0; c < nchannels; ++c) {
-                p_pooled[c] *= scale;
+                int i = ph * stride + p_argmax[c] / psize;
+                int j = pw * stride + p_argmax[c] % psize;
+                image_grad[(i * width + j) * nchannels + c] += p_pooled_grad[c];
+            }
+        }
+    }
+}
+
+
+template <typename Dtype>
+inline void _avepooling_forward(
+        const Dtype* image, Dtype* pooled, const int height, const int width,
+        const int nchannels, const int psize, const int stride,
+        const int ph) {
+    // Computes the pooled row ph.
+    int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
+    memset(pooled + ph * pooled_width * nchannels, 0,
+           sizeof(Dtype) * pooled_width * nchannels);
+    for (int pw = 0; pw < pooled_width; ++pw) {
+        int h_start = ph * stride;
+        int h_end = min(height, h_start + psize);
+        int w_start = pw * stride;
+        int w_end = min(width, w_start + psize);
+        Dtype* p_pooled = pooled + (ph * pooled_width + pw) * nchannels;
+        for (int i = h_start; i < h_end; ++i) {
+            for (int j = w_start; j < w_end; ++j) {
+                const Dtype* p_image = image + (i * width + j) * nchannels;
+                for (int c = 0; c < nchannels; ++c) {
+                    p_pooled[c] += p_image[c];
+                }
             }
         }
+        // normalize
+        Dtype scale = 1. / Dtype((h_end - h_start) * (w_end - w_start));
+        for (int c = 0; c < nchannels; ++c) {
+            p_pooled[c] *= scale;
+        }
     }
 }
 
@@ -112,27 +177,30 @@ template <typename Dtype>
 inline void _avepooling_backward(
         Dtype* image_grad, const Dtype* pooled_grad, const int height, 
         const int width, const int nchannels, const int psize,
-        const int stride) {
+        const int stride, const int i) {
+    // Computes the gradient of the image row i, gathering the gradients of
+    // the pooled regions that each pixel maps to.
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
-    memset(image_grad, 0, sizeof(Dtype) * height * width * nchannels);
-    // This code is written in a forward mode: we go through the pixels once,
-    // and write to all the pooled regions that it maps to.
-    for (int ph = 0; ph < pooled_height; ++ph) {
-        for (int pw = 0; pw < pooled_width; ++pw) {
+    memset(image_grad + i * width * nchannels, 0,
+           sizeof(Dtype) * width * nchannels);
+    int ph_start = (i < psize) ? 0 : (i - psize) / stride + 1;
+    int ph_end = min(i / stride + 1, pooled_height);
+    for (int j = 0; j < width; ++j) {
+        int pw_start = (j < psize) ? 0 : (j - psize) / stride + 1;
+        int pw_end = min(j / stride + 1, pooled_width);
+        Dtype* p_image_grad = image_grad + (i * width + j) * nchannels;
+        for (int ph = ph_start; ph < ph_end; ++ph) {
             int h_start = ph * stride;
             int h_end = min(height, h_start + psize);
-            int w_start = pw * stride;
-            int w_end = min(width, w_start + psize);
-            Dtype scale = 1. / Dtype((h_end - h_start) * (w_end - w_start));
-            const Dtype* p_pooled_grad = pooled_grad
-                    + (ph * pooled_width + pw) * nchannels;
-            for (int i = h_start; i < h_end; ++i) {
-                for (int j = w_start; j < w_end; ++j) {
-                    Dtype* p_image_grad = image_grad + (i * width + j) * nchannels;
-                    for (int c = 0; c < nchannels; ++c) {
-                        p_image_grad[c] += p_pooled_grad[c] * scale;
-                    }
+            for (int pw = pw_start; pw < pw_end; ++pw) {
+                int w_start = pw * stride;
+                int w_end = min(width, w_start + psize);
+                Dtype scale = 1. / Dtype((h_end - h_start) * (w_end - w_start));
+                const Dtype* p_pooled_grad = pooled_grad
+                        + (ph * pooled_width + pw) * nchannels;
+                for (int c = 0; c < nchannels; ++c) {
+                    p_image_grad[c] += p_pooled_grad[c] * scale;
                 }
             }
         }
@@ -144,26 +212,34 @@ extern "C" {
 void maxpooling_forward(const int len,
         const void* image, void* pooled, const int num,
         const int height, const int width,
-        const int nchannels, const int psize, const int stride) {
+        const int nchannels, const int psize, const int stride,
+        const int threads) {
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
     int image_step = height * width * nchannels;
     int pooled_step = pooled_height * pooled_width * nchannels;
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pooled_height; ++idx) {
+            int i = idx / pooled_height;
             _maxpooling_forward<float>(
                 ((const float*)image) + image_step * i, 
                 ((float*)pooled) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % pooled_height);
         }
         break;
     case sizeof(double):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pooled_height; ++idx) {
+            int i = idx / pooled_height;
             _maxpooling_forward<double>(
                 ((const double*)image) + image_step * i, 
                 ((double*)pooled) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % pooled_height);
         }
         break;
     default:
@@ -175,29 +251,114 @@ void maxpooling_backward(const int len,
         const void* image, const void* pooled, void* image_grad,
         const void* pooled_grad, const int num,
         const int height, const int width,
-        const int nchannels, const int psize, const int stride) {
+        const int nchannels, const int psize, const int stride,
+        const int threads) {
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
     int image_step = height * width * nchannels;
     int pooled_step = pooled_height * pooled_width * nchannels;
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height; ++idx) {
+            int i = idx / height;
             _maxpooling_backward<float>(
                 ((const float*)image) + image_step * i,
                 ((const float*)pooled) + pooled_step * i,
                 ((float*)image_grad) + image_step * i,
                 ((const float*)pooled_grad) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % height);
         }
         break;
     case sizeof(double):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height; ++idx) {
+            int i = idx / height;
             _maxpooling_backward<double>(
                 ((const double*)image) + image_step * i,
                 ((const double*)pooled) + pooled_step * i,
                 ((double*)image_grad) + image_step * i,
                 ((const double*)pooled_grad) + pooled_step * i,
+                height, width, nchannels, psize, stride,
+                idx % height);
+        }
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    } // switch(len)
+}
+
+void maxpooling_argmax_forward(const int len,
+        const void* image, void* pooled, short* argmax, const int num,
+        const int height, const int width,
+        const int nchannels, const int psize, const int stride,
+        const int threads) {
+    int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
+    int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
+    int image_step = height * width * nchannels;
+    int pooled_step = pooled_height * pooled_width * nchannels;
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pooled_height; ++idx) {
+            int i = idx / pooled_height;
+            _maxpooling_argmax_forward<float>(
+                ((const float*)image) + image_step * i,
+                ((float*)pooled) + pooled_step * i,
+                argmax + pooled_step * i,
+                height, width, nchannels, psize, stride,
+                idx % pooled_height);
+        }
+        break;
+    case sizeof(double):
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pooled_height; ++idx) {
+            int i = idx / pooled_height;
+            _maxpooling_argmax_forward<double>(
+                ((const double*)image) + image_step * i,
+                ((double*)pooled) + pooled_step * i,
+                argmax + pooled_step * i,
+                height, width, nchannels, psize, stride,
+                idx % pooled_height);
+        }
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    } // switch(len)
+}
+
+void maxpooling_argmax_backward(const int len,
+        void* image_grad, const void* pooled_grad, const short* argmax,
+        const int num, const int height, const int width,
+        const int nchannels, const int psize, const int stride,
+        const int threads) {
+    int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
+    int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
+    int image_step = height * width * nchannels;
+    int pooled_step = pooled_height * pooled_width * nchannels;
+    omp_set_num_threads(threads);
+    // the pooling regions overlap, so the images are run in parallel.
+    switch(len) {
+    case sizeof(float):
+#pragma omp parallel for
+        for (int i = 0; i < num; ++i) {
+            _maxpooling_argmax_backward<float>(
+                ((float*)image_grad) + image_step * i,
+                ((const float*)pooled_grad) + pooled_step * i,
+                argmax + pooled_step * i,
+                height, width, nchannels, psize, stride);
+        }
+        break;
+    case sizeof(double):
+#pragma omp parallel for
+        for (int i = 0; i < num; ++i) {
+            _maxpooling_argmax_backward<double>(
+                ((double*)image_grad) + image_step * i,
+                ((const double*)pooled_grad) + pooled_step * i,
+                argmax + pooled_step * i,
                 height, width, nchannels, psize, stride);
         }
         break;
@@ -209,26 +370,34 @@ void maxpooling_backward(const int len,
 void avepooling_forward(const int len,
         const void* image, void* pooled, const int num,
         const int height, const int width,
-        const int nchannels, const int psize, const int stride){
+        const int nchannels, const int psize, const int stride,
+        const int threads) {
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
     int image_step = height * width * nchannels;
     int pooled_step = pooled_height * pooled_width * nchannels;
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pooled_height; ++idx) {
+            int i = idx / pooled_height;
             _avepooling_forward<float>(
                 ((const float*)image) + image_step * i, 
                 ((float*)pooled) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % pooled_height);
         }
         break;
     case sizeof(double):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pooled_height; ++idx) {
+            int i = idx / pooled_height;
             _avepooling_forward<double>(
                 ((const double*)image) + image_step * i, 
                 ((double*)pooled) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % pooled_height);
         }
         break;
     default:
@@ -239,26 +408,33 @@ void avepooling_forward(const int len,
 void avepooling_backward(const int len,
         void* image_grad, const void* pooled_grad, const int num, 
         const int height, const int width, const int nchannels,
-        const int psize, const int stride) {
+        const int psize, const int stride, const int threads) {
     int pooled_height = int(ceil(float(height - psize) / stride)) + 1;
     int pooled_width = int(ceil(float(width - psize) / stride)) + 1;
     int image_step = height * width * nchannels;
     int pooled_step = pooled_height * pooled_width * nchannels;
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height; ++idx) {
+            int i = idx / height;
             _avepooling_backward<float>(
                 ((float*)image_grad) + image_step * i, 
                 ((const float*)pooled_grad) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % height);
         }
         break;
     case sizeof(double):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height; ++idx) {
+            int i = idx / height;
             _avepooling_backward<double>(
                 ((double*)image_grad) + image_step * i, 
                 ((const double*)pooled_grad) + pooled_step * i,
-                height, width, nchannels, psize, stride);
+                height, width, nchannels, psize, stride,
+                idx % height);
         }
         break;
     default:
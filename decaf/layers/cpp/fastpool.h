@@ -9,24 +9,39 @@ extern "C" {
 void maxpooling_forward(const int len,
         const void* image, void* pooled, const int num, 
         const int height, const int width,
-        const int nchannels, const int psize, const int stride);
+        const int nchannels, const int psize, const int stride,
+        const int threads);
 
 void maxpooling_backward(const int len,
         const void* image, const void* pooled, void* image_grad,
         const void* pooled_grad, const int num,
         const int height, const int width,
-        const int nchannels, const int psize, const int stride);
+        const int nchannels, const int psize, const int stride,
+        const int threads);
+
+void maxpooling_argmax_forward(const int len,
+        const void* image, void* pooled, short* argmax, const int num,
+        const int height, const int width,
+        const int nchannels, const int psize, const int stride,
+        const int threads);
+
+void maxpooling_argmax_backward(const int len,
+        void* image_grad, const void* pooled_grad, const short* argmax,
+        const int num, const int height, const int width,
+        const int nchannels, const int psize, const int stride,
+        const int threads);
 
 void avepooling_forward(const int len,
         const void* image, void* pooled, const int num,
         const int height, const int width,
-        const int nchannels, const int psize, const int stride);
+        const int nchannels, const int psize, const int stride,
+        const int threads);
 
 void avepooling_backward(const int len,
         void* image_grad, const void* pooled_grad, 
         const int num, const int height, 
         const int width, const int nchannels, const int psize,
-        const int stride);
+        const int stride, const int threads);
 
 } // extern "C"
 
@@ -4,9 +4,14 @@
 #include <cmath>
 #include <cstdlib>
 #include <cstring>
+#include <omp.h>
 
 #include "im2col.h"
 
+// The extern functions below run the rows of all the images in parallel.
+// Every row is written by a single thread in a fixed order, so the results
+// do not depend on the number of threads.
+
 template <typename Dtype>
 inline void _im2col_forward(const Dtype* data_im,
         Dtype* data_col,
@@ -14,24 +19,36 @@ inline void _im2col_forward(const Dtype* data_im,
         const int width,
         const int nchannels,
         const int psize,
-        const int stride) {
-    // The naive im2col_forward_mc implementation
-    int step_im = width * nchannels;
+        const int stride,
+        const int pad,
+        const int idxh) {
+    // Computes the output row idxh. The image is implicitly padded with pad
+    // zeros on each side, so no padded copy is needed.
     int step_col = psize * nchannels;
-    int height_col = (height - psize) / stride + 1;
-    int width_col = (width - psize) / stride + 1;
-    for (int idxh = 0; idxh < height_col; ++idxh) {
-        Dtype* pointer_col = data_col + idxh * width_col * psize * step_col;
-        for (int idxw = 0; idxw < width_col; ++idxw) {
-            // copy image[idxh:idxh+psize, idxw:idxw+psize, :]
-            int hstart = idxh * stride;
-            const Dtype* pointer_im = data_im + (hstart * width + idxw * stride) * nchannels;
-            for (int i = hstart; i < hstart + psize; ++i) {
-                // copy image[i, idxw:idxw+psize, :]
-                memcpy(pointer_col, pointer_im, sizeof(Dtype) * step_col);
-                pointer_col += step_col;
-                pointer_im += step_im;
+    int width_col = (width + 2 * pad - psize) / stride + 1;
+    Dtype* pointer_col = data_col + idxh * width_col * psize * step_col;
+    for (int idxw = 0; idxw < width_col; ++idxw) {
+        // copy image[hstart:hstart+psize, wstart:wstart+psize, :]
+        int hstart = idxh * stride - pad;
+        int wstart = idxw * stride - pad;
+        // the part of the patch columns that lies inside the image
+        int wbegin = wstart > 0 ? wstart : 0;
+        int wend = wstart + psize < width ? wstart + psize : width;
+        int left = (wbegin - wstart) * nchannels;
+        int count = (wend - wbegin) * nchannels;
+        for (int i = hstart; i < hstart + psize; ++i) {
+            if (i < 0 || i >= height || count <= 0) {
+                memset(pointer_col, 0, sizeof(Dtype) * step_col);
+            } else {
+                // copy image[i, wbegin:wend, :], and zero the rest
+                memset(pointer_col, 0, sizeof(Dtype) * left);
+                memcpy(pointer_col + left,
+                       data_im + (i * width + wbegin) * nchannels,
+                       sizeof(Dtype) * count);
+                memset(pointer_col + left + count, 0,
+                       sizeof(Dtype) * (step_col - left - count));
             }
+            pointer_col += step_col;
         }
     }
 } // im2col_forward
@@ -44,25 +61,35 @@ inline void _im2col_backward(Dtype* data_im,
         const int width,
         const int nchannels,
         const int psize,
-        const int stride) {
-    memset(data_im, 0, sizeof(Dtype) * height * width * nchannels);
-    int step_im = width * nchannels;
+        const int stride,
+        const int pad,
+        const int i) {
+    // Computes the image row i by gathering the patch rows that cover it,
+    // dropping the implicitly padded border.
     int step_col = psize * nchannels;
-    int height_col = (height - psize) / stride + 1;
-    int width_col = (width - psize) / stride + 1;
-    for (int idxh = 0; idxh < height_col; ++idxh) {
-        const Dtype* pointer_col = data_col + idxh * width_col * psize * step_col;
+    int height_col = (height + 2 * pad - psize) / stride + 1;
+    int width_col = (width + 2 * pad - psize) / stride + 1;
+    Dtype* row_im = data_im + i * width * nchannels;
+    memset(row_im, 0, sizeof(Dtype) * width * nchannels);
+    // the row in the padded image, and the patches that cover it
+    int hpad = i + pad;
+    int h_start = (hpad < psize) ? 0 : (hpad - psize) / stride + 1;
+    int h_end = hpad / stride + 1 < height_col ? hpad / stride + 1
+                                               : height_col;
+    for (int idxh = h_start; idxh < h_end; ++idxh) {
+        int offset = hpad - idxh * stride;
         for (int idxw = 0; idxw < width_col; ++idxw) {
-            // copy image[idxh:idxh+psize, idxw:idxw+psize, :]
-            int hstart = idxh * stride;
-            Dtype* pointer_im = data_im + (hstart * width + idxw * stride) * nchannels;
-            for (int i = hstart; i < hstart + psize; ++i) {
-                // Add image[i, idxw:idxw+psize, :]
-                for (int j = 0; j < step_col; ++j) {
-                    pointer_im[j] += pointer_col[j];
-                }
-                pointer_col += step_col;
-                pointer_im += step_im;
+            const Dtype* pointer_col = data_col +
+                    ((idxh * width_col + idxw) * psize + offset) * step_col;
+            int wstart = idxw * stride - pad;
+            int wbegin = wstart > 0 ? wstart : 0;
+            int wend = wstart + psize < width ? wstart + psize : width;
+            int left = (wbegin - wstart) * nchannels;
+            int count = (wend - wbegin) * nchannels;
+            // Add image[i, wbegin:wend, :]
+            Dtype* pointer_im = row_im + wbegin * nchannels;
+            for (int j = 0; j < count; ++j) {
+                pointer_im[j] += pointer_col[left + j];
             }
         }
     }
@@ -79,26 +106,35 @@ void im2col_forward(const int len,
         const int width,
         const int nchannels,
         const int psize,
-        const int stride) {
-    const int height_col = (height - psize) / stride + 1;
-    const int width_col = (width - psize) / stride + 1;
+        const int stride,
+        const int pad,
+        const int threads) {
+    const int height_col = (height + 2 * pad - psize) / stride + 1;
+    const int width_col = (width + 2 * pad - psize) / stride + 1;
     const int image_step = height * width * nchannels;
     const int col_step = height_col * width_col * psize * psize * nchannels;
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height_col; ++idx) {
+            int i = idx / height_col;
             _im2col_forward<float>(
                     ((const float*)data_im) + image_step * i,
                     ((float*)data_col) + col_step * i,
-                    height, width, nchannels, psize, stride);
+                    height, width, nchannels, psize, stride, pad,
+                    idx % height_col);
         }
         break;
     case sizeof(double):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height_col; ++idx) {
+            int i = idx / height_col;
             _im2col_forward<double>(
                     ((const double*)data_im) + image_step * i,
                     ((double*)data_col) + col_step * i,
-                    height, width, nchannels, psize, stride);
+                    height, width, nchannels, psize, stride, pad,
+                    idx % height_col);
         }
         break;
     default:
@@ -114,26 +150,35 @@ void im2col_backward(const int len,
         const int width,
         const int nchannels,
         const int psize,
-        const int stride) {
-    const int height_col = (height - psize) / stride + 1;
-    const int width_col = (width - psize) / stride + 1;
+        const int stride,
+        const int pad,
+        const int threads) {
+    const int height_col = (height + 2 * pad - psize) / stride + 1;
+    const int width_col = (width + 2 * pad - psize) / stride + 1;
     const int image_step = height * width * nchannels;
     const int col_step = height_col * width_col * psize * psize * nchannels;
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height; ++idx) {
+            int i = idx / height;
             _im2col_backward<float>(
                     ((float*)data_im) + image_step * i,
                     ((const float*)data_col) + col_step * i,
-                    height, width, nchannels, psize, stride);
+                    height, width, nchannels, psize, stride, pad,
+                    idx % height);
         }
         break;
     case sizeof(double):
-        for (int i = 0; i < num; ++i) {
+#pragma omp parallel for
+        for (int idx = 0; idx < num * height; ++idx) {
+            int i = idx / height;
             _im2col_backward<double>(
                     ((double*)data_im) + image_step * i,
                     ((const double*)data_col) + col_step * i,
-                    height, width, nchannels, psize, stride);
+                    height, width, nchannels, psize, stride, pad,
+                    idx % height);
         }
         break;
     default:
@@ -11,7 +11,9 @@ void im2col_forward(const int len,
         const int width,
         const int nchannels,
         const int psize,
-        const int stride);
+        const int stride,
+        const int pad,
+        const int threads);
 
 void im2col_backward(const int len,
         void* data_im,
@@ -21,7 +23,9 @@ void im2col_backward(const int len,
         const int width,
         const int nchannels,
         const int psize,
-        const int stride);
+        const int stride,
+        const int pad,
+        const int threads);
 
 } // extern "C"
 
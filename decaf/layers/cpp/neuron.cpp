@@ -1,19 +1,52 @@
 #include <algorithm>
+#include <omp.h>
 #include "neuron.h"
 
 using std::max;
 
+// Below this number of elements, the functions run on a single thread since
+// starting the threads would cost more than it saves. The elements are
+// independent, so the results do not depend on the number of threads.
+static const int PARALLEL_MIN_SIZE = 32768;
+
 template <typename Dtype>
 inline void _relu_forward(const Dtype* input, Dtype* output, int n) {
+#pragma omp parallel for if (n >= PARALLEL_MIN_SIZE)
     for (int i = 0; i < n; ++i) {
         output[i] = max(input[i], Dtype(0));
     }
     return;
 }
 
+template <typename Dtype>
+inline void _relu_backward(const Dtype* output, const Dtype* top_diff,
+        Dtype* bottom_diff, int n) {
+#pragma omp parallel for if (n >= PARALLEL_MIN_SIZE)
+    for (int i = 0; i < n; ++i) {
+        bottom_diff[i] = (output[i] > 0) ? top_diff[i] : Dtype(0);
+    }
+    return;
+}
+
+template <typename Dtype>
+inline void _bias_relu_forward(Dtype* data, const Dtype* bias, int num,
+        int dim) {
+#pragma omp parallel for if (num * dim >= PARALLEL_MIN_SIZE)
+    for (int i = 0; i < num; ++i) {
+        Dtype* row = data + i * dim;
+        for (int j = 0; j < dim; ++j) {
+            Dtype value = row[j] + bias[j];
+            row[j] = (value > 0) ? value : Dtype(0);
+        }
+    }
+    return;
+}
+
 extern "C" {
 
-void relu_forward(const int len, const void* input, void* output, int n) {
+void relu_forward(const int len, const void* input, void* output, int n,
+        const int threads) {
+    omp_set_num_threads(threads);
     switch(len) {
     case sizeof(float):
         _relu_forward<float>((const float*) input, (float*) output, n);
@@ -26,4 +59,39 @@ void relu_forward(const int len, const void* input, void* output, int n) {
     } // switch(len)
 }
 
+void relu_backward(const int len, const void* output, const void* top_diff,
+        void* bottom_diff, int n, const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _relu_backward<float>((const float*) output, (const float*) top_diff,
+                              (float*) bottom_diff, n);
+        break;
+    case sizeof(double):
+        _relu_backward<double>((const double*) output,
+                               (const double*) top_diff,
+                               (double*) bottom_diff, n);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    } // switch(len)
+}
+
+void bias_relu_forward(const int len, void* data, const void* bias, int num,
+        int dim, const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _bias_relu_forward<float>((float*) data, (const float*) bias, num,
+                                  dim);
+        break;
+    case sizeof(double):
+        _bias_relu_forward<double>((double*) data, (const double*) bias, num,
+                                   dim);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    } // switch(len)
+}
+
 }
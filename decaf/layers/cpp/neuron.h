@@ -3,7 +3,14 @@
 
 extern "C" {
 
-void relu_forward(const int len, const void* input, void* output, int n);
+void relu_forward(const int len, const void* input, void* output, int n,
+        const int threads);
+
+void relu_backward(const int len, const void* output, const void* top_diff,
+        void* bottom_diff, int n, const int threads);
+
+void bias_relu_forward(const int len, void* data, const void* bias, int num,
+        int dim, const int threads);
 
 } // extern "C"
 
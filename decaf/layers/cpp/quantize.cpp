@@ -0,0 +1,154 @@
+#include <cmath>
+#include <cstdlib>
+#include <omp.h>
+#include "quantize.h"
+
+// The number of output columns each thread computes at a time. The rows of B
+// for one block are reused across all the rows of A, so a block should fit
+// in the cache.
+#define COL_BLOCK 16
+
+// Quantizes the input to int8 as round(input / scale), saturating at
+// [-127, 127] so that the range is symmetric.
+template <typename Dtype>
+inline void _quantize_int8(const Dtype* input, signed char* output, int n,
+        Dtype scale) {
+    Dtype inv_scale = Dtype(1) / scale;
+#pragma omp parallel for
+    for (int i = 0; i < n; ++i) {
+        Dtype value = input[i] * inv_scale;
+        value = (value > 127) ? 127 : ((value < -127) ? -127 : value);
+        output[i] = (signed char)(lrint(value));
+    }
+    return;
+}
+
+// Computes the int32 dot products of the int8 vector a with the rows
+// [col_start, col_end) of the (n x k) int8 matrix B.
+static void _int8_dots(const signed char* a, const signed char* B,
+        int* accum, int col_start, int col_end, int k) {
+    for (int j = col_start; j < col_end; ++j) {
+        const signed char* b = B + j * k;
+        int sum = 0;
+        for (int l = 0; l < k; ++l) {
+            sum += int(a[l]) * int(b[l]);
+        }
+        accum[j - col_start] = sum;
+    }
+}
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#include <immintrin.h>
+
+// The AVX2 version of _int8_dots, which multiplies 16 pairs of int8 values
+// sign-extended to int16 and adds adjacent pairs into int32 in a single
+// instruction, computing two dot products at a time to share the loads of a.
+__attribute__((target("avx2")))
+static void _int8_dots_avx2(const signed char* a, const signed char* B,
+        int* accum, int col_start, int col_end, int k) {
+    int k16 = k - k % 16;
+    int j = col_start;
+    for (; j + 1 < col_end; j += 2) {
+        const signed char* b0 = B + j * k;
+        const signed char* b1 = b0 + k;
+        __m256i sum0 = _mm256_setzero_si256();
+        __m256i sum1 = _mm256_setzero_si256();
+        for (int l = 0; l < k16; l += 16) {
+            __m256i va = _mm256_cvtepi8_epi16(
+                    _mm_loadu_si128((const __m128i*)(a + l)));
+            __m256i vb0 = _mm256_cvtepi8_epi16(
+                    _mm_loadu_si128((const __m128i*)(b0 + l)));
+            __m256i vb1 = _mm256_cvtepi8_epi16(
+                    _mm_loadu_si128((const __m128i*)(b1 + l)));
+            sum0 = _mm256_add_epi32(sum0, _mm256_madd_epi16(va, vb0));
+            sum1 = _mm256_add_epi32(sum1, _mm256_madd_epi16(va, vb1));
+        }
+        int partial0[8], partial1[8];
+        _mm256_storeu_si256((__m256i*)partial0, sum0);
+        _mm256_storeu_si256((__m256i*)partial1, sum1);
+        int total0 = 0, total1 = 0;
+        for (int l = 0; l < 8; ++l) {
+            total0 += partial0[l];
+            total1 += partial1[l];
+        }
+        for (int l = k16; l < k; ++l) {
+            total0 += int(a[l]) * int(b0[l]);
+            total1 += int(a[l]) * int(b1[l]);
+        }
+        accum[j - col_start] = total0;
+        accum[j + 1 - col_start] = total1;
+    }
+    if (j < col_end) {
+        _int8_dots(a, B, accum + (j - col_start), j, col_end, k);
+    }
+}
+#define DECAF_HAS_AVX2_DISPATCH
+#endif
+
+// Computes C = A_scale * dot(A, B.T) * B_scale, where A is an (m x k) int8
+// matrix, B is an (n x k) int8 matrix holding one output channel per row, and
+// B_scale holds the scale of each output channel. The products are
+// accumulated in int32, which cannot overflow as long as k < 2^17.
+template <typename Dtype>
+inline void _int8_gemm(const signed char* A, const signed char* B,
+        const Dtype* B_scale, Dtype* C, int m, int n, int k, Dtype A_scale) {
+    void (*dots)(const signed char*, const signed char*, int*, int, int,
+                 int) = _int8_dots;
+#ifdef DECAF_HAS_AVX2_DISPATCH
+    if (__builtin_cpu_supports("avx2")) {
+        dots = _int8_dots_avx2;
+    }
+#endif
+    int num_blocks = (n + COL_BLOCK - 1) / COL_BLOCK;
+#pragma omp parallel for
+    for (int block = 0; block < num_blocks; ++block) {
+        int accum[COL_BLOCK];
+        int col_start = block * COL_BLOCK;
+        int col_end = (col_start + COL_BLOCK < n) ? col_start + COL_BLOCK : n;
+        for (int i = 0; i < m; ++i) {
+            dots(A + i * k, B, accum, col_start, col_end, k);
+            for (int j = col_start; j < col_end; ++j) {
+                C[i * n + j] = Dtype(accum[j - col_start]) * A_scale
+                        * B_scale[j];
+            }
+        }
+    }
+    return;
+}
+
+extern "C" {
+
+void quantize_int8(const int len, const void* input, signed char* output,
+        int n, double scale, const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _quantize_int8<float>((const float*) input, output, n, (float)scale);
+        break;
+    case sizeof(double):
+        _quantize_int8<double>((const double*) input, output, n, scale);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    } // switch(len)
+}
+
+void int8_gemm(const int len, const signed char* A, const signed char* B,
+        const void* B_scale, void* C, int m, int n, int k, double A_scale,
+        const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _int8_gemm<float>(A, B, (const float*) B_scale, (float*) C, m, n, k,
+                          (float)A_scale);
+        break;
+    case sizeof(double):
+        _int8_gemm<double>(A, B, (const double*) B_scale, (double*) C, m, n,
+                           k, A_scale);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    } // switch(len)
+}
+
+}
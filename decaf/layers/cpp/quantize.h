@@ -0,0 +1,15 @@
+#ifndef _DECAF_QUANTIZE_H
+#define _DECAF_QUANTIZE_H
+
+extern "C" {
+
+void quantize_int8(const int len, const void* input, signed char* output,
+        int n, double scale, const int threads);
+
+void int8_gemm(const int len, const signed char* A, const signed char* B,
+        const void* B_scale, void* C, int m, int n, int k, double A_scale,
+        const int threads);
+
+} // extern "C"
+
+#endif // _DECAF_QUANTIZE_H
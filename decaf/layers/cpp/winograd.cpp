@@ -0,0 +1,330 @@
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+#include <omp.h>
+
+#include "winograd.h"
+
+// The input and output transforms of the Winograd F(2x2, 3x3) convolution.
+// The data of height x width pixels is cut into tile_rows x tile_cols tiles
+// of 4x4 pixels that overlap by 2 pixels, with tile_rows = (height - 1) / 2
+// and tile_cols = (width - 1) / 2. The tiles of the last row and column may
+// cross the border, in which case the missing pixels are zero.
+//
+// The transformed tiles are stored as 16 matrices, one per element of the
+// 4x4 transform, of shape (num * tile_rows * tile_cols, channels), so that
+// the product with the transformed kernels is 16 GEMMs. The output
+// transform maps every tile of the products to a 2x2 output tile, and the
+// output has (height - 2) x (width - 2) pixels.
+//
+// The extern functions below run the tile rows of all the images in
+// parallel. Every output element is written by a single thread in a fixed
+// order, so the results do not depend on the number of threads.
+
+// Computes BT * d * B for the 4x4 tile d of every channel, where
+// d[i][j][c] = tile[i * row_step + j * col_step + c].
+template <typename Dtype>
+inline void _input_tile(const Dtype* tile, Dtype* data_t,
+        const int row_step, const int col_step, const int nchannels,
+        const long matrix_step) {
+    for (int c = 0; c < nchannels; ++c) {
+        Dtype t[4][4];
+        for (int j = 0; j < 4; ++j) {
+            const Dtype* column = tile + j * col_step + c;
+            Dtype d0 = column[0];
+            Dtype d1 = column[row_step];
+            Dtype d2 = column[2 * row_step];
+            Dtype d3 = column[3 * row_step];
+            t[0][j] = d0 - d2;
+            t[1][j] = d1 + d2;
+            t[2][j] = d2 - d1;
+            t[3][j] = d1 - d3;
+        }
+        Dtype* out = data_t + c;
+        for (int i = 0; i < 4; ++i) {
+            out[(i * 4) * matrix_step] = t[i][0] - t[i][2];
+            out[(i * 4 + 1) * matrix_step] = t[i][1] + t[i][2];
+            out[(i * 4 + 2) * matrix_step] = t[i][2] - t[i][1];
+            out[(i * 4 + 3) * matrix_step] = t[i][1] - t[i][3];
+        }
+    }
+}
+
+template <typename Dtype>
+void _winograd_input_forward(const Dtype* data, Dtype* data_t,
+        const int num, const int height, const int width,
+        const int nchannels) {
+    const int tile_rows = (height - 1) / 2;
+    const int tile_cols = (width - 1) / 2;
+    const long matrix_step = (long)num * tile_rows * tile_cols * nchannels;
+    const int row_step = width * nchannels;
+#pragma omp parallel for
+    for (int idx = 0; idx < num * tile_rows; ++idx) {
+        const int n = idx / tile_rows;
+        const int row = (idx % tile_rows) * 2;
+        // the tiles that cross the border are copied with zeros first.
+        std::vector<Dtype> border;
+        for (int tc = 0; tc < tile_cols; ++tc) {
+            const int col = tc * 2;
+            Dtype* out = data_t + ((long)idx * tile_cols + tc) * nchannels;
+            const Dtype* tile = data +
+                    (((long)n * height + row) * width + col) * nchannels;
+            if (row + 4 <= height && col + 4 <= width) {
+                _input_tile(tile, out, row_step, nchannels, nchannels,
+                            matrix_step);
+                continue;
+            }
+            border.assign(16 * nchannels, 0);
+            for (int i = 0; i < 4 && row + i < height; ++i) {
+                for (int j = 0; j < 4 && col + j < width; ++j) {
+                    memcpy(&border[(i * 4 + j) * nchannels],
+                           tile + (i * width + j) * nchannels,
+                           sizeof(Dtype) * nchannels);
+                }
+            }
+            _input_tile(&border[0], out, 4 * nchannels, nchannels, nchannels,
+                        matrix_step);
+        }
+    }
+}
+
+template <typename Dtype>
+void _winograd_input_backward(Dtype* data_diff, const Dtype* data_t_diff,
+        const int num, const int height, const int width,
+        const int nchannels) {
+    const int tile_rows = (height - 1) / 2;
+    const int tile_cols = (width - 1) / 2;
+    const long matrix_step = (long)num * tile_rows * tile_cols * nchannels;
+    memset(data_diff, 0, sizeof(Dtype) * num * height * width * nchannels);
+    // The tiles overlap, so we add up the even tile rows first and then the
+    // odd ones: the tiles of one pass do not share any pixel rows.
+    for (int parity = 0; parity < 2; ++parity) {
+        const int pass_rows = (tile_rows - parity + 1) / 2;
+#pragma omp parallel for
+        for (int idx = 0; idx < num * pass_rows; ++idx) {
+            const int n = idx / pass_rows;
+            const int tr = (idx % pass_rows) * 2 + parity;
+            const int row = tr * 2;
+            for (int tc = 0; tc < tile_cols; ++tc) {
+                const int col = tc * 2;
+                const Dtype* grad = data_t_diff +
+                        (((long)n * tile_rows + tr) * tile_cols + tc) *
+                        nchannels;
+                Dtype* tile = data_diff +
+                        (((long)n * height + row) * width + col) * nchannels;
+                for (int c = 0; c < nchannels; ++c) {
+                    // computes B * m * BT, the transpose of _input_tile().
+                    Dtype t[4][4];
+                    for (int j = 0; j < 4; ++j) {
+                        Dtype m0 = grad[j * matrix_step + c];
+                        Dtype m1 = grad[(4 + j) * matrix_step + c];
+                        Dtype m2 = grad[(8 + j) * matrix_step + c];
+                        Dtype m3 = grad[(12 + j) * matrix_step + c];
+                        t[0][j] = m0;
+                        t[1][j] = m1 - m2 + m3;
+                        t[2][j] = m1 + m2 - m0;
+                        t[3][j] = -m3;
+                    }
+                    for (int i = 0; i < 4 && row + i < height; ++i) {
+                        Dtype d[4] = {t[i][0],
+                                      t[i][1] - t[i][2] + t[i][3],
+                                      t[i][1] + t[i][2] - t[i][0],
+                                      -t[i][3]};
+                        for (int j = 0; j < 4 && col + j < width; ++j) {
+                            tile[(i * width + j) * nchannels + c] += d[j];
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+template <typename Dtype>
+void _winograd_output_forward(const Dtype* product, Dtype* output,
+        const int num, const int height, const int width,
+        const int nkernels) {
+    const int tile_rows = (height - 1) / 2;
+    const int tile_cols = (width - 1) / 2;
+    const int out_height = height - 2;
+    const int out_width = width - 2;
+    const long matrix_step = (long)num * tile_rows * tile_cols * nkernels;
+#pragma omp parallel for
+    for (int idx = 0; idx < num * tile_rows; ++idx) {
+        const int n = idx / tile_rows;
+        const int row = (idx % tile_rows) * 2;
+        const int rows = row + 2 <= out_height ? 2 : 1;
+        for (int tc = 0; tc < tile_cols; ++tc) {
+            const int col = tc * 2;
+            const int cols = col + 2 <= out_width ? 2 : 1;
+            const Dtype* prod = product + ((long)idx * tile_cols + tc) *
+                    nkernels;
+            Dtype* out = output +
+                    (((long)n * out_height + row) * out_width + col) *
+                    nkernels;
+            for (int k = 0; k < nkernels; ++k) {
+                // computes AT * m * A.
+                Dtype t[2][4];
+                for (int j = 0; j < 4; ++j) {
+                    Dtype m0 = prod[j * matrix_step + k];
+                    Dtype m1 = prod[(4 + j) * matrix_step + k];
+                    Dtype m2 = prod[(8 + j) * matrix_step + k];
+                    Dtype m3 = prod[(12 + j) * matrix_step + k];
+                    t[0][j] = m0 + m1 + m2;
+                    t[1][j] = m1 - m2 - m3;
+                }
+                for (int i = 0; i < rows; ++i) {
+                    out[(i * out_width) * nkernels + k] =
+                            t[i][0] + t[i][1] + t[i][2];
+                    if (cols == 2) {
+                        out[(i * out_width + 1) * nkernels + k] =
+                                t[i][1] - t[i][2] - t[i][3];
+                    }
+                }
+            }
+        }
+    }
+}
+
+template <typename Dtype>
+void _winograd_output_backward(Dtype* product_diff, const Dtype* output_diff,
+        const int num, const int height, const int width,
+        const int nkernels) {
+    const int tile_rows = (height - 1) / 2;
+    const int tile_cols = (width - 1) / 2;
+    const int out_height = height - 2;
+    const int out_width = width - 2;
+    const long matrix_step = (long)num * tile_rows * tile_cols * nkernels;
+#pragma omp parallel for
+    for (int idx = 0; idx < num * tile_rows; ++idx) {
+        const int n = idx / tile_rows;
+        const int row = (idx % tile_rows) * 2;
+        const bool full_rows = row + 2 <= out_height;
+        for (int tc = 0; tc < tile_cols; ++tc) {
+            const int col = tc * 2;
+            const bool full_cols = col + 2 <= out_width;
+            Dtype* grad = product_diff + ((long)idx * tile_cols + tc) *
+                    nkernels;
+            const Dtype* diff = output_diff +
+                    (((long)n * out_height + row) * out_width + col) *
+                    nkernels;
+            const int row_step = out_width * nkernels;
+            for (int k = 0; k < nkernels; ++k) {
+                // computes A * y * AT, the transpose of the forward pass,
+                // where the outputs beyond the border are zero.
+                Dtype y00 = diff[k];
+                Dtype y01 = full_cols ? diff[nkernels + k] : 0;
+                Dtype y10 = full_rows ? diff[row_step + k] : 0;
+                Dtype y11 = (full_rows && full_cols) ?
+                        diff[row_step + nkernels + k] : 0;
+                Dtype t[4][2] = {{y00, y01},
+                                 {y00 + y10, y01 + y11},
+                                 {y00 - y10, y01 - y11},
+                                 {-y10, -y11}};
+                for (int i = 0; i < 4; ++i) {
+                    grad[(i * 4) * matrix_step + k] = t[i][0];
+                    grad[(i * 4 + 1) * matrix_step + k] = t[i][0] + t[i][1];
+                    grad[(i * 4 + 2) * matrix_step + k] = t[i][0] - t[i][1];
+                    grad[(i * 4 + 3) * matrix_step + k] = -t[i][1];
+                }
+            }
+        }
+    }
+}
+
+
+extern "C" {
+
+void winograd_input_forward(const int len,
+        const void* data,
+        void* data_t,
+        const int num,
+        const int height,
+        const int width,
+        const int nchannels,
+        const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _winograd_input_forward<float>((const float*)data, (float*)data_t,
+                num, height, width, nchannels);
+        break;
+    case sizeof(double):
+        _winograd_input_forward<double>((const double*)data, (double*)data_t,
+                num, height, width, nchannels);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    }
+}
+
+void winograd_input_backward(const int len,
+        void* data_diff,
+        const void* data_t_diff,
+        const int num,
+        const int height,
+        const int width,
+        const int nchannels,
+        const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _winograd_input_backward<float>((float*)data_diff,
+                (const float*)data_t_diff, num, height, width, nchannels);
+        break;
+    case sizeof(double):
+        _winograd_input_backward<double>((double*)data_diff,
+                (const double*)data_t_diff, num, height, width, nchannels);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    }
+}
+
+void winograd_output_forward(const int len,
+        const void* product,
+        void* output,
+        const int num,
+        const int height,
+        const int width,
+        const int nkernels,
+        const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _winograd_output_forward<float>((const float*)product,
+                (float*)output, num, height, width, nkernels);
+        break;
+    case sizeof(double):
+        _winograd_output_forward<double>((const double*)product,
+                (double*)output, num, height, width, nkernels);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    }
+}
+
+void winograd_output_backward(const int len,
+        void* product_diff,
+        const void* output_diff,
+        const int num,
+        const int height,
+        const int width,
+        const int nkernels,
+        const int threads) {
+    omp_set_num_threads(threads);
+    switch(len) {
+    case sizeof(float):
+        _winograd_output_backward<float>((float*)product_diff,
+                (const float*)output_diff, num, height, width, nkernels);
+        break;
+    case sizeof(double):
+        _winograd_output_backward<double>((double*)product_diff,
+                (const double*)output_diff, num, height, width, nkernels);
+        break;
+    default:
+        exit(EXIT_FAILURE);
+    }
+}
+
+} // extern "C"
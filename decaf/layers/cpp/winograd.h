@@ -0,0 +1,44 @@
+#ifndef _DECAF_WINOGRAD_H
+#define _DECAF_WINOGRAD_H
+
+extern "C" {
+
+void winograd_input_forward(const int len,
+        const void* data,
+        void* data_t,
+        const int num,
+        const int height,
+        const int width,
+        const int nchannels,
+        const int threads);
+
+void winograd_input_backward(const int len,
+        void* data_diff,
+        const void* data_t_diff,
+        const int num,
+        const int height,
+        const int width,
+        const int nchannels,
+        const int threads);
+
+void winograd_output_forward(const int len,
+        const void* product,
+        void* output,
+        const int num,
+        const int height,
+        const int width,
+        const int nkernels,
+        const int threads);
+
+void winograd_output_backward(const int len,
+        void* product_diff,
+        const void* output_diff,
+        const int num,
+        const int height,
+        const int width,
+        const int nkernels,
+        const int threads);
+
+} // extern "C"
+
+#endif // _DECAF_WINOGRAD_H
@@ -5,6 +5,7 @@ faster or handles some numpy tricky issues.
 import ctypes as ct
 import numpy as np
 import os
+import threading
 
 # first, let's import the library
 try:
@@ -21,12 +22,36 @@ except KeyError:
     except ImportError:
         _OMP_NUM_THREADS=1
 
+# The number of OpenMP threads may be overridden for the kernels called from
+# a specific thread, see set_num_threads().
+_LOCAL = threading.local()
+
+def set_num_threads(num_threads):
+    """Sets the number of OpenMP threads used by the kernels that are called
+    from the current thread. Pass None to use the default, which is given by
+    the OMP_NUM_THREADS environment variable or the number of cores.
+    """
+    _LOCAL.num_threads = num_threads
+
+def _num_threads():
+    """Returns the number of OpenMP threads for the current thread."""
+    num_threads = getattr(_LOCAL, 'num_threads', None)
+    if num_threads is None:
+        return _OMP_NUM_THREADS
+    return num_threads
+
+def get_num_threads():
+    """Returns the number of OpenMP threads used by the kernels that are
+    called from the current thread.
+    """
+    return _num_threads()
+
 ################################################################################
 # im2col operation
 ################################################################################
 _DLL.im2col_forward.restype = _DLL.im2col_backward.restype = None
 
-def im2col_forward(im, col, psize, stride):
+def im2col_forward(im, col, psize, stride, pad=0):
     num, height, width, channels = im.shape
     _DLL.im2col_forward(ct.c_int(im.itemsize),
                 im.ctypes.data_as(ct.c_void_p),
@@ -36,9 +61,11 @@ def im2col_forward(im, col, psize, stride):
                 ct.c_int(width),
                 ct.c_int(channels),
                 ct.c_int(psize),
-                ct.c_int(stride))
+                ct.c_int(stride),
+                ct.c_int(pad),
+                ct.c_int(_num_threads()))
 
-def im2col_backward(im, col, psize, stride):
+def im2col_backward(im, col, psize, stride, pad=0):
     num, height, width, channels = im.shape
     _DLL.im2col_backward(ct.c_int(im.itemsize),
                 im.ctypes.data_as(ct.c_void_p),
@@ -48,13 +75,17 @@ def im2col_backward(im, col, psize, stride):
                 ct.c_int(width),
                 ct.c_int(channels),
                 ct.c_int(psize),
-                ct.c_int(stride))
+                ct.c_int(stride),
+                ct.c_int(pad),
+                ct.c_int(_num_threads()))
 
 ################################################################################
 # pooling operation
 ################################################################################
 _DLL.maxpooling_forward.restype = \
 _DLL.maxpooling_backward.restype = \
+_DLL.maxpooling_argmax_forward.restype = \
+_DLL.maxpooling_argmax_backward.restype = \
 _DLL.avepooling_forward.restype = \
 _DLL.avepooling_backward.restype = None
 
@@ -68,7 +99,8 @@ def maxpooling_forward(image, pooled, psize, stride):
                             ct.c_int(width),
                             ct.c_int(channels),
                             ct.c_int(psize),
-                            ct.c_int(stride))
+                            ct.c_int(stride),
+                            ct.c_int(_num_threads()))
 
 def avepooling_forward(image, pooled, psize, stride):
     num, height, width, channels = image.shape
@@ -80,7 +112,8 @@ def avepooling_forward(image, pooled, psize, stride):
                             ct.c_int(width),
                             ct.c_int(channels),
                             ct.c_int(psize),
-                            ct.c_int(stride))
+                            ct.c_int(stride),
+                            ct.c_int(_num_threads()))
 
 def maxpooling_backward(image, pooled, image_diff, pooled_diff, psize,
                         stride):
@@ -95,7 +128,51 @@ def maxpooling_backward(image, pooled, image_diff, pooled_diff, psize,
                              ct.c_int(width),
                              ct.c_int(channels),
                              ct.c_int(psize),
-                             ct.c_int(stride))
+                             ct.c_int(stride),
+                             ct.c_int(_num_threads()))
+
+def maxpooling_argmax_forward(image, pooled, argmax, psize, stride):
+    """Computes max pooling like maxpooling_forward, and writes to the int16
+    array argmax (of the shape of pooled) the offset of each maximum within
+    its pooling region, i.e. row * psize + column.
+    """
+    num, height, width, channels = image.shape
+    if (argmax.dtype != np.int16 or argmax.shape != pooled.shape or
+        not argmax.flags.c_contiguous):
+        raise ValueError('Argmax should be a C-contiguous int16 array of the'
+                         ' pooled shape.')
+    _DLL.maxpooling_argmax_forward(ct.c_int(image.itemsize),
+                                   image.ctypes.data_as(ct.c_void_p),
+                                   pooled.ctypes.data_as(ct.c_void_p),
+                                   argmax.ctypes.data_as(ct.c_void_p),
+                                   ct.c_int(num),
+                                   ct.c_int(height),
+                                   ct.c_int(width),
+                                   ct.c_int(channels),
+                                   ct.c_int(psize),
+                                   ct.c_int(stride),
+                                   ct.c_int(_num_threads()))
+
+def maxpooling_argmax_backward(image_diff, pooled_diff, argmax, psize,
+                               stride):
+    """Routes the pooled gradient to the maxima recorded by
+    maxpooling_argmax_forward."""
+    num, height, width, channels = image_diff.shape
+    if (argmax.dtype != np.int16 or argmax.shape != pooled_diff.shape or
+        not argmax.flags.c_contiguous):
+        raise ValueError('Argmax should be a C-contiguous int16 array of the'
+                         ' pooled shape.')
+    _DLL.maxpooling_argmax_backward(ct.c_int(image_diff.itemsize),
+                                    image_diff.ctypes.data_as(ct.c_void_p),
+                                    pooled_diff.ctypes.data_as(ct.c_void_p),
+                                    argmax.ctypes.data_as(ct.c_void_p),
+                                    ct.c_int(num),
+                                    ct.c_int(height),
+                                    ct.c_int(width),
+                                    ct.c_int(channels),
+                                    ct.c_int(psize),
+                                    ct.c_int(stride),
+                                    ct.c_int(_num_threads()))
 
 def avepooling_backward(image_diff, pooled_diff, psize, stride):
     num, height, width, channels = image_diff.shape
@@ -107,7 +184,8 @@ def avepooling_backward(image_diff, pooled_diff, psize, stride):
                              ct.c_int(width),
                              ct.c_int(channels),
                              ct.c_int(psize),
-                             ct.c_int(stride))
+                             ct.c_int(stride),
+                             ct.c_int(_num_threads()))
 
 
 
@@ -128,7 +206,7 @@ def lrn_forward(bottom, top, scale, size, k, alpha, beta):
                      ct.c_double(k),
                      ct.c_double(alpha),
                      ct.c_double(beta),
-                     ct.c_int(_OMP_NUM_THREADS))
+                     ct.c_int(_num_threads()))
 
 
 def lrn_backward(bottom, top, bottom_diff, top_diff, scale, size, k, alpha,
@@ -145,15 +223,164 @@ def lrn_backward(bottom, top, bottom_diff, top_diff, scale, size, k, alpha,
                      ct.c_double(k),
                      ct.c_double(alpha),
                      ct.c_double(beta),
-                     ct.c_int(_OMP_NUM_THREADS))
+                     ct.c_int(_num_threads()))
 
 ################################################################################
 # local contrast normalization operation
 ################################################################################
-_DLL.relu_forward.restype = None
+_DLL.relu_forward.restype = \
+_DLL.relu_backward.restype = \
+_DLL.bias_relu_forward.restype = None
 
 def relu_forward(bottom, top):
     _DLL.relu_forward(ct.c_int(bottom.itemsize),
                       bottom.ctypes.data_as(ct.c_void_p),
                       top.ctypes.data_as(ct.c_void_p),
-                      ct.c_int(bottom.size))
+                      ct.c_int(bottom.size),
+                      ct.c_int(_num_threads()))
+
+def relu_backward(top, top_diff, bottom_diff):
+    _DLL.relu_backward(ct.c_int(top.itemsize),
+                       top.ctypes.data_as(ct.c_void_p),
+                       top_diff.ctypes.data_as(ct.c_void_p),
+                       bottom_diff.ctypes.data_as(ct.c_void_p),
+                       ct.c_int(top.size),
+                       ct.c_int(_num_threads()))
+
+def bias_relu_forward(data, bias):
+    """Adds the bias to the last dimension of data and applies ReLU, in place.
+    """
+    if not data.flags.c_contiguous or data.dtype != bias.dtype:
+        raise ValueError('Data should be C-contiguous and of the same dtype'
+                         ' as the bias.')
+    _DLL.bias_relu_forward(ct.c_int(data.itemsize),
+                           data.ctypes.data_as(ct.c_void_p),
+                           bias.ctypes.data_as(ct.c_void_p),
+                           ct.c_int(data.size / bias.size),
+                           ct.c_int(bias.size),
+                           ct.c_int(_num_threads()))
+
+################################################################################
+# int8 quantization
+################################################################################
+_DLL.quantize_int8.restype = \
+_DLL.int8_gemm.restype = None
+
+def quantize_int8(data, output, scale):
+    """Quantizes data to int8 as round(data / scale), saturating at
+    [-127, 127]. Both data and output should be C-contiguous.
+    """
+    if (not data.flags.c_contiguous or not output.flags.c_contiguous or
+        output.dtype != np.int8 or output.size != data.size):
+        raise ValueError('Data and output should be C-contiguous, and output'
+                         ' should be an int8 array of the same size.')
+    _DLL.quantize_int8(ct.c_int(data.itemsize),
+                       data.ctypes.data_as(ct.c_void_p),
+                       output.ctypes.data_as(ct.c_void_p),
+                       ct.c_int(data.size),
+                       ct.c_double(scale),
+                       ct.c_int(_num_threads()))
+
+def int8_gemm(A, B, B_scale, C, A_scale):
+    """Computes C = A_scale * dot(A, B.T) * B_scale, where A (m x k) and B
+    (n x k) are C-contiguous int8 matrices, B_scale holds the n per-row scales
+    of B, and C is a C-contiguous (m x n) matrix of the same dtype as B_scale.
+    """
+    m, k = A.shape
+    n = B.shape[0]
+    if (A.dtype != np.int8 or B.dtype != np.int8 or B.shape[1] != k or
+        C.shape != (m, n) or C.dtype != B_scale.dtype or B_scale.size != n):
+        raise ValueError('Incorrect shapes or dtypes for int8_gemm.')
+    if not (A.flags.c_contiguous and B.flags.c_contiguous and
+            C.flags.c_contiguous and B_scale.flags.c_contiguous):
+        raise ValueError('The matrices should be C-contiguous.')
+    _DLL.int8_gemm(ct.c_int(C.itemsize),
+                   A.ctypes.data_as(ct.c_void_p),
+                   B.ctypes.data_as(ct.c_void_p),
+                   B_scale.ctypes.data_as(ct.c_void_p),
+                   C.ctypes.data_as(ct.c_void_p),
+                   ct.c_int(m),
+                   ct.c_int(n),
+                   ct.c_int(k),
+                   ct.c_double(A_scale),
+                   ct.c_int(_num_threads()))
+
+################################################################################
+# winograd transforms
+################################################################################
+_DLL.winograd_input_forward.restype = \
+_DLL.winograd_input_backward.restype = \
+_DLL.winograd_output_forward.restype = \
+_DLL.winograd_output_backward.restype = None
+
+def _check_winograd(num, height, width, tiles, images):
+    """Checks that the tiles of shape (16, num_tiles, channels) are the
+    transforms of the images for a padded input of the given size.
+    """
+    num_tiles = num * ((height - 1) / 2) * ((width - 1) / 2)
+    if (tiles.shape != (16, num_tiles, images.shape[-1]) or
+        images.shape[0] != num or tiles.dtype != images.dtype or
+        not tiles.flags.c_contiguous or not images.flags.c_contiguous):
+        raise ValueError('Incorrect shapes or dtypes for the winograd'
+                         ' transforms.')
+
+def winograd_input_forward(data, data_t):
+    """Computes the transforms of the 4x4 tiles of the padded data of shape
+    (num, height, width, channels). data_t has shape
+    (16, num * tile_rows * tile_cols, channels).
+    """
+    num, height, width, channels = data.shape
+    _check_winograd(num, height, width, data_t, data)
+    _DLL.winograd_input_forward(ct.c_int(data.itemsize),
+                data.ctypes.data_as(ct.c_void_p),
+                data_t.ctypes.data_as(ct.c_void_p),
+                ct.c_int(num),
+                ct.c_int(height),
+                ct.c_int(width),
+                ct.c_int(channels),
+                ct.c_int(_num_threads()))
+
+def winograd_input_backward(data_diff, data_t_diff):
+    """Computes the gradient of the padded data from the gradient of the
+    transforms of its tiles.
+    """
+    num, height, width, channels = data_diff.shape
+    _check_winograd(num, height, width, data_t_diff, data_diff)
+    _DLL.winograd_input_backward(ct.c_int(data_diff.itemsize),
+                data_diff.ctypes.data_as(ct.c_void_p),
+                data_t_diff.ctypes.data_as(ct.c_void_p),
+                ct.c_int(num),
+                ct.c_int(height),
+                ct.c_int(width),
+                ct.c_int(channels),
+                ct.c_int(_num_threads()))
+
+def winograd_output_forward(product, output):
+    """Computes the output of shape (num, height - 2, width - 2, num_kernels)
+    from the products of the tile transforms with the kernel transforms, for
+    a padded input of height x width pixels.
+    """
+    num, height, width, num_kernels = output.shape
+    _check_winograd(num, height + 2, width + 2, product, output)
+    _DLL.winograd_output_forward(ct.c_int(output.itemsize),
+                product.ctypes.data_as(ct.c_void_p),
+                output.ctypes.data_as(ct.c_void_p),
+                ct.c_int(num),
+                ct.c_int(height + 2),
+                ct.c_int(width + 2),
+                ct.c_int(num_kernels),
+                ct.c_int(_num_threads()))
+
+def winograd_output_backward(product_diff, output_diff):
+    """Computes the gradient of the products from the gradient of the output.
+    """
+    num, height, width, num_kernels = output_diff.shape
+    _check_winograd(num, height + 2, width + 2, product_diff, output_diff)
+    _DLL.winograd_output_backward(ct.c_int(output_diff.itemsize),
+                product_diff.ctypes.data_as(ct.c_void_p),
+                output_diff.ctypes.data_as(ct.c_void_p),
+                ct.c_int(num),
+                ct.c_int(height + 2),
+                ct.c_int(width + 2),
+                ct.c_int(num_kernels),
+                ct.c_int(_num_threads()))
@@ -26,13 +26,13 @@ class CIFARDataLayer(ndarraydata.NdarrayDataLayer):
             is_training: whether to load the training data. Default True.
             is_gray: whether to load gray image. Default False.
             rootfolder: the folder that stores the mnist data.
-            dtype: the data type. Default numpy.float64.
+            dtype: the data type. Default numpy.float32.
         """
         # get keywords
         is_training = kwargs.get('is_training', True)
         is_gray = kwargs.get('is_gray', False)
         rootfolder = kwargs['rootfolder']
-        dtype = kwargs.get('dtype', np.float64)
+        dtype = kwargs.get('dtype', np.float32)
         self._data = None
         self._label = None
         self._coarselabel = None
@@ -15,11 +15,11 @@ class MNISTDataLayer(ndarraydata.NdarrayDataLayer):
         kwargs:
             is_training: whether to load the training data. Default True.
             rootfolder: the folder that stores the mnist data.
-            dtype: the data type. Default numpy.float64.
+            dtype: the data type. Default numpy.float32.
         """
         is_training = kwargs.get('is_training', True)
         rootfolder = kwargs['rootfolder']
-        dtype = kwargs.get('dtype', np.float64)
+        dtype = kwargs.get('dtype', np.float32)
         self._load_mnist(rootfolder, is_training, dtype)
         # normalize data.
         self._data /= 255.
@@ -1,6 +1,7 @@
 """A simple ndarray data layer that wraps around numpy arrays."""
 
 from decaf import base
+import numpy as np
 
 class NdarrayDataLayer(base.DataLayer):
     """This layer takes a bunch of data as a dictionary, and then emits
@@ -25,3 +26,10 @@ class NdarrayDataLayer(base.DataLayer):
         for top_blob, source in zip(top, self._sources):
             top_blob.mirror(source)
 
+    def infer_data_shapes(self, bottom, num_tops):
+        """The layer emits its sources."""
+        return [(source.shape, source.dtype) for source in self._sources]
+
+    def data_indices(self):
+        """The layer always emits the whole data set."""
+        return np.arange(self._sources[0].shape[0])
@@ -41,10 +41,6 @@ class DeconvolutionLayer(base.Layer):
             raise ValueError('Invalid kernel size. Kernel size should > 1.')
         if self._mode == 'same' and self._ksize % 2 == 0:
             raise ValueError('The "same" mode should have an odd kernel size.')
-        # since the im2col operation often creates large intermediate matrices,
-        # we will have intermediate blobs to store them.
-        self._padded = base.Blob()
-        self._col = base.Blob()
         # set up the parameter
         self._kernels = base.Blob(filler=self._filler)
         self._param = [self._kernels]
@@ -67,59 +63,60 @@ class DeconvolutionLayer(base.Layer):
                 (bottom_data.shape[-1],
                  self._ksize * self._ksize * self._num_channels),
                 bottom_data.dtype)
-        # initialize the buffers.
-        self._col.init_data((1, bottom_data.shape[1], bottom_data.shape[2],
-                             self._kernels.data().shape[1]),
-                            dtype = bottom_data.dtype)
         pad_height = self._ksize + (bottom_data.shape[1] - 1) \
                 * self._stride
         pad_width = self._ksize + (bottom_data.shape[2] - 1) \
                 * self._stride
-        if self._mode != 'valid':
-            padded_data = self._padded.init_data(
-                (1, pad_height, pad_width, self._num_channels),
-                dtype = bottom_data.dtype)
         top_data = top[0].init_data(
             (bottom_data.shape[0], pad_height - self._border * 2,
              pad_width - self._border * 2, self._num_channels),
-            dtype=bottom_data.dtype)
-        # process data individually
-        for i in range(bottom_data.shape[0]):
-            # first, compute the convolution as a gemm operation
-            blasdot.dot_lastdim(bottom_data[i:i+1], self._kernels.data(),
-                                out=self._col.data())
-            if self._mode != 'valid':
-            # do col2im
-                wrapper.im2col_backward(padded_data, self._col.data(),
-                               self._ksize, self._stride)
-                top_data[i] = padded_data[0, self._border:-self._border,
-                                          self._border:-self._border]
-            else:
-                wrapper.im2col_backward(top_data[i:i+1], self._col.data(),
-                                        self._ksize, self._stride)
+            dtype=bottom_data.dtype, setdata=False)
+        # since the im2col operation often creates large intermediate matrices,
+        # we request them from the workspace for the duration of the call.
+        workspace = self.workspace()
+        with workspace.frame():
+            col_data = workspace.array(
+                (1, bottom_data.shape[1], bottom_data.shape[2],
+                 self._kernels.data().shape[1]), bottom_data.dtype)
+            # process data individually
+            for i in range(bottom_data.shape[0]):
+                # first, compute the convolution as a gemm operation
+                blasdot.dot_lastdim(bottom_data[i:i+1], self._kernels.data(),
+                                    out=col_data)
+                # do col2im, dropping the border implicitly.
+                wrapper.im2col_backward(top_data[i:i+1], col_data,
+                                        self._ksize, self._stride,
+                                        self._border)
         return
 
     def backward(self, bottom, top, propagate_down):
         """Runs the backward pass."""
+        bottom_data = bottom[0].data()
+        with self.workspace().frame():
+            self._backward(bottom, top, propagate_down)
+        # finally, add the regularization term
+        if self._reg is not None:
+            return self._reg.reg(self._kernels, bottom_data.shape[0])
+        else:
+            return 0.
+
+    def _backward(self, bottom, top, propagate_down):
+        """Computes the gradients within a workspace frame."""
+        workspace = self.workspace()
         top_diff = top[0].diff()
         bottom_data = bottom[0].data()
         kernel_diff = self._kernels.init_diff()
-        kernel_diff_buffer = np.zeros_like(kernel_diff)
-        col_diff = self._col.init_diff()
+        kernel_diff_buffer = workspace.array(kernel_diff.shape,
+                                             kernel_diff.dtype)
+        col_diff = workspace.array(
+            (1, bottom_data.shape[1], bottom_data.shape[2],
+             kernel_diff.shape[1]), bottom_data.dtype)
         if propagate_down:
             bottom_diff = bottom[0].init_diff()
-        if self._mode != 'valid':
-            pad_diff = self._padded.init_diff()
         for i in range(bottom_data.shape[0]):
-            if self._mode != 'valid':
-                # do padding
-                pad_diff[0, self._border:-self._border,
-                         self._border:-self._border] = top_diff[i]
-            else:
-                pad_diff = top_diff[i:i+1].view()
-            # run im2col
-            wrapper.im2col_forward(pad_diff, col_diff, self._ksize,
-                                   self._stride)
+            # run im2col, padding the border implicitly.
+            wrapper.im2col_forward(top_diff[i:i+1], col_diff, self._ksize,
+                                   self._stride, self._border)
             blasdot.dot_firstdims(bottom_data[i], col_diff,
                                  out=kernel_diff_buffer)
             kernel_diff += kernel_diff_buffer
@@ -127,20 +124,25 @@ class DeconvolutionLayer(base.Layer):
                 # compute final gradient
                 blasdot.dot_lastdim(col_diff, self._kernels.data().T,
                                     out=bottom_diff[i])
-        # finally, add the regularization term
-        if self._reg is not None:
-            return self._reg.reg(self._kernels, bottom_data.shape[0])
-        else:
-            return 0.
 
-    def __getstate__(self):
-        """When pickling, we will remove the intermediate data."""
-        self._padded = base.Blob()
-        self._col = base.Blob()
-        return self.__dict__
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """Computes the output shape as in forward()."""
+        num, height, width, _ = bottom_shapes[0]
+        return [(num,
+                 self._ksize + (height - 1) * self._stride - self._border * 2,
+                 self._ksize + (width - 1) * self._stride - self._border * 2,
+                 self._num_channels)]
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the multiply-adds of the product with the kernels."""
+        return (2 * int(np.prod(bottom_shapes[0])) * self._ksize *
+                self._ksize * self._num_channels)
 
     def update(self):
         """updates the parameters."""
         # Only the inner product layer needs to be updated.
         self._kernels.update()
 
+    def backward_needs_top_data(self):
+        """The deconvolution backward pass only needs the bottom data."""
+        return False
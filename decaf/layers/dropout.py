@@ -29,37 +29,69 @@ class DropoutLayer(base.Layer):
 
     def forward(self, bottom, top):
         """Computes the forward pass."""
-        # Get features and output
         features = bottom[0].data()
-        output = top[0].init_data(features.shape, features.dtype, setdata=False)
         if not self._mask.has_data():
-            mask = self._mask.init_data(features.shape, np.bool)
-        elif self.spec.get('debug_freeze', False):
-            mask = self._mask.data()
+            self._mask.init_data(features.shape, np.bool)
+        elif not self.spec.get('debug_freeze', False):
+            self._mask.init_data(features.shape, np.bool)
+        self._apply_mask(bottom, top)
+
+    def recompute(self, bottom, top):
+        """Recomputes the forward pass with the mask of the last forward
+        pass."""
+        self._apply_mask(bottom, top)
+
+    def _apply_mask(self, bottom, top):
+        """Applies the current mask to the bottom data."""
+        # Get features and output
+        features = bottom[0].data()
+        if top[0] is bottom[0]:
+            output = features
         else:
-            mask = self._mask.init_data(features.shape, np.bool)
+            output = top[0].init_data(features.shape, features.dtype,
+                                      setdata=False)
         upscale = 1. / self.spec['ratio']
-        output[:] = features * mask
+        np.multiply(features, self._mask.data(), out=output)
         output *= upscale
 
     def predict(self, bottom, top):
         """The dropout predict pass. Under our definition, it is simply a
         mirror operation.
         """
-        top[0].mirror(bottom[0])
+        if top[0] is not bottom[0]:
+            top[0].mirror(bottom[0])
 
     def backward(self, bottom, top, propagate_down):
         """Computes the backward pass."""
         if not propagate_down:
             return 0.
         top_diff = top[0].diff()
-        bottom_diff = bottom[0].init_diff(setzero=False)
+        if top[0] is bottom[0]:
+            bottom_diff = top_diff
+        else:
+            bottom_diff = bottom[0].init_diff(setzero=False)
         mask = self._mask.data()
         upscale = 1. / self.spec['ratio']
-        bottom_diff[:] = top_diff * mask
+        np.multiply(top_diff, mask, out=bottom_diff)
         bottom_diff *= upscale
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
     def update(self):
         """Dropout has nothing to update."""
         pass
+
+    def is_mirror(self):
+        """The dropout predict pass simply mirrors its input."""
+        return True
+
+    def supports_inplace(self):
+        """Dropout can run in place."""
+        return True
+
+    def backward_needs_top_data(self):
+        """Dropout only needs its mask in the backward pass."""
+        return False
@@ -21,6 +21,19 @@ class FlattenLayer(base.Layer):
                 blob_b.mirror_diff(blob_t, shape=blob_b.data().shape)
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """Each input is flattened to a matrix."""
+        return [(shape[0], int(np.prod(shape[1:])))
+                for shape in bottom_shapes]
+
     def update(self):
         """FlattenLayer has nothing to update."""
         pass
+
+    def is_mirror(self):
+        """FlattenLayer returns reshaped views of its input."""
+        return True
+
+    def is_reshape(self):
+        """FlattenLayer changes the shape of its input."""
+        return True
@@ -20,15 +20,15 @@ class GroupConvolutionLayer(base.Layer):
             num_kernels: the number of kernels PER GROUP. As a result, the
                 output would have (num_kernels * group) channels.
         Also the layer should be provided all the appropriate parameters for
-        the underlying convolutional layer.
+        the underlying convolutional layer. The inputs and outputs of the
+        groups are requested from the workspace of the layer, which is shared
+        with the convolution layers.
         """
         base.Layer.__init__(self, **kwargs)
         self._group = self.spec['group']
         self._conv_args = dict(self.spec)
         self._conv_args['name'] = self.spec['name'] + '_sub'
         del self._conv_args['group']
-        self._bottom_sub = [base.Blob() for _ in range(self._group)]
-        self._top_sub = [base.Blob() for _ in range(self._group)]
         self._conv_layers = None
         self._blocksize = 0
         self._num_kernels = self.spec['num_kernels']
@@ -49,27 +49,36 @@ class GroupConvolutionLayer(base.Layer):
                                ' divisible by the number of groups (%d).' %
                                (bottom_data.shape[-1], self._group))
         self._blocksize = bottom_data.shape[-1] / self._group
+        top_shape = self.infer_shapes([bottom_data.shape], 1)[0]
+        top_data = top[0].init_data(top_shape, bottom_data.dtype,
+                                    setdata=False)
+        workspace = self.workspace()
         for i in range(self._group):
             in_start = i * self._blocksize
             in_end = in_start + self._blocksize
             out_start = i * self._num_kernels
             out_end = out_start + self._num_kernels
             # Now, create intermediate blobs, and compute forward by group
-            bottom_sub_data = self._bottom_sub[i].init_data(
-                bottom_data.shape[:-1] + (self._blocksize,),
-                bottom_data.dtype, setdata=False)
-            bottom_sub_data[:] = bottom_data[:, :, :, in_start:in_end]
-            self._conv_layers[i].forward([self._bottom_sub[i]],
-                                         [self._top_sub[i]])
-            top_sub_data = self._top_sub[i].data()
-            if i == 0:
-                top_data = top[0].init_data(
-                    top_sub_data.shape[:-1] + \
-                    (top_sub_data.shape[-1] * self._group,),
-                    top_sub_data.dtype, setdata=False)
-            top_data[:, :, :, out_start:out_end] = top_sub_data
+            with workspace.frame():
+                bottom_sub, top_sub = self._sub_blobs(bottom_data, top_data)
+                bottom_sub.data()[:] = bottom_data[:, :, :, in_start:in_end]
+                self._conv_layers[i].forward([bottom_sub], [top_sub])
+                top_data[:, :, :, out_start:out_end] = top_sub.data()
         return
 
+    def _sub_blobs(self, bottom_data, top_data):
+        """Returns the input and output blobs of a group, whose data live in
+        the workspace. Should be called within a workspace frame.
+        """
+        workspace = self.workspace()
+        bottom_sub = base.Blob()
+        bottom_sub.mirror(workspace.array(
+            bottom_data.shape[:-1] + (self._blocksize,), bottom_data.dtype))
+        top_sub = base.Blob()
+        top_sub.mirror(workspace.array(
+            top_data.shape[:-1] + (self._num_kernels,), top_data.dtype))
+        return bottom_sub, top_sub
+
     def backward(self, bottom, top, propagate_down):
         """Runs the backward pass."""
         loss = 0.
@@ -78,31 +87,88 @@ class GroupConvolutionLayer(base.Layer):
         # initialize the sub diff
         if propagate_down:
             bottom_diff = bottom[0].init_diff(setzero=False)
+        top_data = top[0].data()
+        workspace = self.workspace()
         for i in range(self._group):
-            top_sub_diff = self._top_sub[i].init_diff(setzero=False)
-            bottom_sub_data = self._bottom_sub[i].data()
             in_start = i * self._blocksize
             in_end = in_start + self._blocksize
             out_start = i * self._num_kernels
             out_end = out_start + self._num_kernels
-            # Since the convolutional layers will need the input data,
-            # we will need to provide them.
-            bottom_sub_data[:] = bottom_data[:, :, :, in_start:in_end]
-            top_sub_diff[:] = top_diff[:, :, :, out_start:out_end]
-            loss += self._conv_layers[i].backward(
-                [self._bottom_sub[i]], [self._top_sub[i]], propagate_down)
-            if propagate_down:
-                bottom_sub_diff = self._bottom_sub[i].init_diff(setzero=False)
-                bottom_diff[:, :, :, in_start:in_end] = bottom_sub_diff
+            with workspace.frame():
+                bottom_sub, top_sub = self._sub_blobs(bottom_data, top_diff)
+                # Since the convolutional layers will need the input data
+                # (and the output data if a ReLU is fused), we will need to
+                # provide them.
+                bottom_sub.data()[:] = bottom_data[:, :, :, in_start:in_end]
+                if self.backward_needs_top_data():
+                    top_sub.data()[:] = top_data[:, :, :, out_start:out_end]
+                top_sub.mirror_diff(workspace.array(top_sub.data().shape,
+                                                    top_diff.dtype))
+                top_sub.diff()[:] = top_diff[:, :, :, out_start:out_end]
+                if propagate_down:
+                    bottom_sub.mirror_diff(workspace.array(
+                        bottom_sub.data().shape, bottom_data.dtype))
+                loss += self._conv_layers[i].backward(
+                    [bottom_sub], [top_sub], propagate_down)
+                if propagate_down:
+                    bottom_diff[:, :, :, in_start:in_end] = bottom_sub.diff()
         return loss
 
-    def __getstate__(self):
-        """When pickling, we will remove the intermediate data."""
-        self._bottom_sub = [base.Blob() for _ in range(self._group)]
-        self._top_sub = [base.Blob() for _ in range(self._group)]
-        return self.__dict__
+    def release_buffers(self):
+        """Releases the convolution buffers."""
+        for layer in self._conv_layers:
+            layer.release_buffers()
+
+    def set_workspace(self, workspace):
+        """The convolution layers share the workspace of the layer."""
+        base.Layer.set_workspace(self, workspace)
+        for layer in self._conv_layers:
+            layer.set_workspace(workspace)
     
+    def _group_shape(self, bottom_shape):
+        """Returns the shape of the input of each convolution."""
+        return bottom_shape[:-1] + (bottom_shape[-1] / self._group,)
+
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The groups are stacked along the channels."""
+        shape = self._conv_layers[0].infer_shapes(
+            [self._group_shape(bottom_shapes[0])], 1)[0]
+        return [shape[:-1] + (shape[-1] * self._group,)]
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Sums the operations of the convolutions."""
+        group_top = top_shapes[0][:-1] + (self._num_kernels,)
+        return self._group * self._conv_layers[0].flops(
+            [self._group_shape(bottom_shapes[0])], [group_top])
+
     def update(self):
         """updates the parameters."""
         for layer in self._conv_layers:
             layer.update()
+
+    def backward_needs_top_data(self):
+        """The convolution backward pass only needs the bottom data, unless
+        a ReLU is fused into the convolutions."""
+        return self._conv_layers[0].backward_needs_top_data()
+
+    def fuse_relu(self, fuse=True):
+        """The group convolution layer supports ReLU fusion by fusing the ReLU
+        into each of its convolution layers."""
+        for layer in self._conv_layers:
+            layer.fuse_relu(fuse)
+        return True
+
+    def fuse_padding(self, pad):
+        """The group convolution layer supports padding fusion by fusing the
+        padding into each of its convolution layers."""
+        for layer in self._conv_layers:
+            layer.fuse_padding(pad)
+        return True
+
+    def quantize(self, input_scale):
+        """The group convolution layer supports quantization by quantizing
+        each of its convolution layers with the same input scale."""
+        for layer in self._conv_layers:
+            layer.quantize(input_scale)
+        self._param = sum((layer.param() for layer in self._conv_layers), [])
+        return True
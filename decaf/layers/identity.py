@@ -26,6 +26,14 @@ class IdentityLayer(base.Layer):
             bottom_blob.mirror_diff(top_blob)
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
     def update(self):
         """Identity Layer has nothing to update."""
         pass
+
+    def is_mirror(self):
+        """Identity Layer simply mirrors its input."""
+        return True
@@ -13,28 +13,29 @@ class Im2colLayer(base.Layer):
             name: the name of the layer.
             psize: the patch size (patch will be a square).
             stride: the patch stride.
+            pad: the number of zero pixels the image is implicitly padded
+                with on each side. Default 0.
 
         If the input image has shape [height, width, nchannels], the output
-        will have shape [(height-psize)/stride+1, (width-psize)/stride+1,
-        nchannels * psize * psize].
+        will have shape [(height+2*pad-psize)/stride+1,
+        (width+2*pad-psize)/stride+1, nchannels * psize * psize].
         """
         base.Layer.__init__(self, **kwargs)
         self._psize = self.spec['psize']
         self._stride = self.spec['stride']
+        self._pad = self.spec.get('pad', 0)
         if self._psize <= 1:
             raise ValueError('Padding should be larger than 1.')
         if self._stride < 1:
             raise ValueError('Stride should be larger than 0.')
+        if self._pad < 0:
+            raise ValueError('Padding should be nonnegative.')
 
     def _get_new_shape(self, features):
         """Gets the new shape of the im2col operation."""
         if features.ndim != 4:
             raise ValueError('Input features should be 4-dimensional.')
-        num, height, width, channels = features.shape
-        return (num,
-                (height - self._psize) / self._stride + 1,
-                (width - self._psize) / self._stride + 1,
-                channels * self._psize * self._psize)
+        return self.infer_shapes([features.shape], 1)[0]
 
     def forward(self, bottom, top):
         """Computes the forward pass."""
@@ -42,7 +43,8 @@ class Im2colLayer(base.Layer):
         features = bottom[0].data()
         output = top[0].init_data(self._get_new_shape(features),
                                   features.dtype, setdata=False)
-        wrapper.im2col_forward(features, output, self._psize, self._stride)
+        wrapper.im2col_forward(features, output, self._psize, self._stride,
+                               self._pad)
 
     def backward(self, bottom, top, propagate_down):
         """Computes the backward pass."""
@@ -51,9 +53,25 @@ class Im2colLayer(base.Layer):
         top_diff = top[0].diff()
         bottom_diff = bottom[0].init_diff(setzero=False)
         wrapper.im2col_backward(bottom_diff, top_diff, self._psize,
-                                self._stride)
+                                self._stride, self._pad)
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """See _get_new_shape()."""
+        num, height, width, channels = bottom_shapes[0]
+        return [(num,
+                 (height + self._pad * 2 - self._psize) / self._stride + 1,
+                 (width + self._pad * 2 - self._psize) / self._stride + 1,
+                 channels * self._psize * self._psize)]
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Im2col only copies data."""
+        return 0
+
     def update(self):
         """Im2col has nothing to update."""
         pass
+
+    def backward_needs_top_data(self):
+        """The im2col backward pass does not need any data."""
+        return False
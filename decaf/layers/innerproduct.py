@@ -1,7 +1,8 @@
 """Implements the inner product layer."""
 
 from decaf import base
-from decaf.util import blasdot
+from decaf.layers.cpp import wrapper
+from decaf.util import blasdot, quantize
 import numpy as np
 
 class InnerProductLayer(base.Layer):
@@ -29,6 +30,13 @@ class InnerProductLayer(base.Layer):
         self._filler = self.spec.get('filler', None)
         self._weight = base.Blob(filler=self._filler)
         self._has_bias = self.spec.get('bias', True)
+        self._fused_relu = False
+        self._flatten_input = False
+        # the quantized weights and their scales, see quantize().
+        self._quantized = False
+        self._input_scale = None
+        self._qweight = base.Blob()
+        self._qscale = base.Blob()
         if self._has_bias:
             self._bias_filler = self.spec.get('bias_filler', None)
             self._bias = base.Blob(filler=self._bias_filler)
@@ -39,27 +47,42 @@ class InnerProductLayer(base.Layer):
     def forward(self, bottom, top):
         """Computes the forward pass."""
         # Get features and output
-        features = bottom[0].data()
+        features = self._features(bottom)
         output = top[0].init_data(
             features.shape[:-1] + (self._num_output,), features.dtype,
             setdata=False)
-        # initialize weights
-        if not self._weight.has_data():
-            self._weight.init_data(
-                (features.shape[-1], self._num_output), features.dtype)
-        if self._has_bias and not self._bias.has_data():
-            self._bias.init_data((self._num_output), features.dtype)
-        # computation
-        weight = self._weight.data()
-        blasdot.dot_lastdim(features, weight, out=output)
-        if self._has_bias:
+        if self._quantized:
+            blasdot.dot_lastdim_quantized(
+                features, self._qweight.data(), self._qscale.data(),
+                out=output, A_scale=self._input_scale)
+        else:
+            # initialize weights
+            if not self._weight.has_data():
+                self._weight.init_data(
+                    (features.shape[-1], self._num_output), features.dtype)
+            if self._has_bias and not self._bias.has_data():
+                self._bias.init_data((self._num_output), features.dtype)
+            # computation
+            weight = self._weight.data()
+            blasdot.dot_lastdim(features, weight, out=output)
+        if self._fused_relu:
+            if self._has_bias:
+                wrapper.bias_relu_forward(output, self._bias.data())
+            else:
+                wrapper.relu_forward(output, output)
+        elif self._has_bias:
             output += self._bias.data()
 
     def backward(self, bottom, top, propagate_down):
         """Computes the backward pass."""
+        if self._quantized:
+            raise base.DecafError(
+                'Quantized layer %s only supports prediction.' % self.name)
         # get diff
         top_diff = top[0].diff()
-        features = bottom[0].data()
+        if self._fused_relu:
+            wrapper.relu_backward(top[0].data(), top_diff, top_diff)
+        features = self._features(bottom)
         # compute the gradient
         weight_diff = self._weight.init_diff(setzero=False)
         blasdot.dot_firstdims(features, top_diff, out=weight_diff)
@@ -71,15 +94,75 @@ class InnerProductLayer(base.Layer):
         if propagate_down:
             bottom_diff = bottom[0].init_diff(setzero=False)
             blasdot.dot_lastdim(top_diff, self._weight.data().T,
-                                out=bottom_diff)
+                                out=bottom_diff.reshape(features.shape))
         if self._reg is not None:
             return self._reg.reg(self._weight)
         else:
             return 0.
 
+    def _features(self, bottom):
+        """Returns the input features, flattened if a flatten layer is fused
+        into the layer."""
+        features = bottom[0].data()
+        if self._flatten_input:
+            return features.reshape(features.shape[0], -1)
+        return features
+
+    def _feature_shape(self, bottom_shape):
+        """Returns the shape of the features for the given input shape."""
+        if self._flatten_input:
+            return (bottom_shape[0], int(np.prod(bottom_shape[1:])))
+        return bottom_shape
+
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The last dimension is replaced by the number of outputs."""
+        return [self._feature_shape(bottom_shapes[0])[:-1] +
+                (self._num_output,)]
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the multiply-adds of the product and the bias."""
+        output_size = int(np.prod(top_shapes[0]))
+        flops = 2 * output_size * self._feature_shape(bottom_shapes[0])[-1]
+        if self._has_bias:
+            flops += output_size
+        return flops
+
     def update(self):
         """Updates the parameters."""
+        if self._quantized:
+            return
         self._weight.update()
         if self._has_bias:
             self._bias.update()
 
+    def backward_needs_top_data(self):
+        """The inner product backward pass only needs the bottom data, unless
+        a ReLU is fused into the layer."""
+        return self._fused_relu
+
+    def fuse_relu(self, fuse=True):
+        """The inner product layer supports ReLU fusion."""
+        self._fused_relu = fuse
+        return True
+
+    def fuse_flatten(self, fuse=True):
+        """The inner product layer can flatten its input."""
+        self._flatten_input = fuse
+        return True
+
+    def quantize(self, input_scale):
+        """Quantizes the weights to int8 with one scale per output, and
+        releases the float weights."""
+        if not self._weight.has_data():
+            raise base.DecafError(
+                'Run layer %s before quantizing it.' % self.name)
+        weight, scale = quantize.quantize_weights(self._weight.data())
+        self._qweight.mirror(weight)
+        self._qscale.mirror(scale)
+        self._input_scale = input_scale
+        self._quantized = True
+        self._weight.clear()
+        self._param = [self._qweight, self._qscale]
+        if self._has_bias:
+            self._param.append(self._bias)
+        return True
@@ -33,6 +33,14 @@ class MeanNormalizeLayer(base.Layer):
             bottom_diff -= (top_diff.sum(1) / top_diff.shape[-1])[:, np.newaxis]
         return 0.
         
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the mean and the subtraction."""
+        return 2 * int(np.prod(top_shapes[0]))
+
     def update(self):
         """Has nothing to update."""
         pass
@@ -92,6 +100,14 @@ class ResponseNormalizeLayer(base.Layer):
                     [:, np.newaxis]
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the squared norm and the division."""
+        return 3 * int(np.prod(top_shapes[0]))
+
     def update(self):
         """Has nothing to update."""
         pass
@@ -148,6 +164,14 @@ class LocalResponseNormalizeLayer(base.Layer):
         self._scale = base.Blob()
         return self.__dict__
     
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the local sum of squares and the scaling."""
+        return (2 * self._size + 4) * int(np.prod(top_shapes[0]))
+
     def update(self):
         """Has nothing to update."""
         pass
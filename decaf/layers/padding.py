@@ -50,6 +50,20 @@ class PaddingLayer(base.Layer):
             bottom_diff[:] = top_diff[:, pad:-pad, pad:-pad]
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output is padded on both sides of the two spatial axes."""
+        num, height, width, channels = bottom_shapes[0]
+        return [(num, height + self._pad * 2, width + self._pad * 2,
+                 channels)]
+
     def update(self):
         """Padding has nothing to update."""
         pass
+
+    def is_mirror(self):
+        """With zero padding, the layer simply mirrors its input."""
+        return self._pad == 0
+
+    def backward_needs_top_data(self):
+        """The padding backward pass does not need any data."""
+        return False
@@ -3,6 +3,7 @@
 from decaf import base
 from decaf.layers.cpp import wrapper
 import math
+import numpy as np
 
 class PoolingLayer(base.Layer):
     """A layer that implements the pooling function."""
@@ -16,21 +17,44 @@ class PoolingLayer(base.Layer):
             stride: the pooling stride. If not given, it will be the same as
                 the psize.
             mode: 'max' or 'ave'.
+            argmax: if True, max pooling records the position of the maximum
+                of every output in an int16 mask, so that the backward pass
+                routes each gradient to a single input with one pass over the
+                output instead of rescanning the pooling regions. Under ties
+                the gradient goes to the first maximum only, instead of to all
+                of them. The mask is not recorded by predict(). Default False.
         """
         base.Layer.__init__(self, **kwargs)
         self._psize = self.spec['psize']
         self._stride = self.spec.get('stride', self._psize)
         self._mode = self.spec['mode']
+        self._fused_relu = False
+        self._use_argmax = self.spec.get('argmax', False)
+        self._argmax = base.Blob()
+        if self._use_argmax and self._mode != 'max':
+            raise ValueError('The argmax mask needs max pooling.')
         if self._stride > self._psize:
             raise ValueError(
                     'Currently, we do not support stride > psize case.')
         if self._psize <= 1:
             raise ValueError('Invalid pool size. Pool size should > 1.')
+        if self._use_argmax and self._psize * self._psize > 32768:
+            raise ValueError('The argmax mask supports pool sizes up to 181.')
         if self._stride <= 0:
             raise ValueError('Invalid stride size. Stride size should > 0.')
     
     def forward(self, bottom, top):
         """Runs the forward pass."""
+        self._forward(bottom, top, self._use_argmax)
+
+    def predict(self, bottom, top):
+        """Runs the forward pass without recording the argmax mask, since
+        there is no backward pass, and frees the mask."""
+        self._argmax = base.Blob()
+        self._forward(bottom, top, False)
+
+    def _forward(self, bottom, top, record_argmax):
+        """Computes the pooled output, recording the argmax mask if asked."""
         bottom_data = bottom[0].data()
         num, height, width, nchannels = bottom_data.shape
         pooled_height = int(math.ceil(
@@ -41,8 +65,19 @@ class PoolingLayer(base.Layer):
             (num, pooled_height, pooled_width, nchannels),
             dtype=bottom_data.dtype)
         if self._mode == 'max':
-            wrapper.maxpooling_forward(bottom_data, top_data,
-                                       self._psize, self._stride)
+            if record_argmax:
+                argmax = self._argmax.init_data(top_data.shape, np.int16,
+                                                setdata=False)
+                wrapper.maxpooling_argmax_forward(bottom_data, top_data,
+                                                  argmax, self._psize,
+                                                  self._stride)
+            else:
+                wrapper.maxpooling_forward(bottom_data, top_data,
+                                           self._psize, self._stride)
+            if self._fused_relu:
+                # max pooling commutes with ReLU, so we apply the ReLU to the
+                # (smaller) pooled output.
+                wrapper.relu_forward(top_data, top_data)
         elif self._mode == 'ave':
             wrapper.avepooling_forward(bottom_data, top_data,
                                        self._psize, self._stride)
@@ -57,7 +92,13 @@ class PoolingLayer(base.Layer):
             top_data = top[0].data()
             bottom_diff = bottom[0].init_diff()
             top_diff = top[0].diff()
-            if self._mode == 'max':
+            if self._fused_relu:
+                wrapper.relu_backward(top_data, top_diff, top_diff)
+            if self._use_argmax:
+                wrapper.maxpooling_argmax_backward(
+                        bottom_diff, top_diff, self._argmax.data(),
+                        self._psize, self._stride)
+            elif self._mode == 'max':
                 wrapper.maxpooling_backward(
                         bottom_data, top_data, bottom_diff,
                         top_diff, self._psize, self._stride)
@@ -69,5 +110,39 @@ class PoolingLayer(base.Layer):
                 raise ValueError('Unknown mode: %s.' % self._mode)
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """Computes the pooled shape as in forward()."""
+        num, height, width, nchannels = bottom_shapes[0]
+        pooled_height = int(math.ceil(
+            float(height - self._psize) / self._stride)) + 1
+        pooled_width = int(math.ceil(
+            float(width - self._psize) / self._stride)) + 1
+        return [(num, pooled_height, pooled_width, nchannels)]
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts one operation per pooled input value."""
+        return int(np.prod(top_shapes[0])) * self._psize * self._psize
+
     def update(self):
         pass
+
+    def release_buffers(self):
+        """Releases the argmax mask."""
+        self._argmax = base.Blob()
+
+    def __getstate__(self):
+        """When pickling, we will remove the argmax mask."""
+        self._argmax = base.Blob()
+        return self.__dict__
+
+    def backward_needs_top_data(self):
+        """The backward pass reads the pooled data, unless the argmax mask is
+        recorded and no ReLU is fused into the layer."""
+        return self._fused_relu or not self._use_argmax
+
+    def fuse_relu(self, fuse=True):
+        """Max pooling supports fusing a ReLU that precedes it."""
+        if self._mode != 'max':
+            return False
+        self._fused_relu = fuse
+        return True
@@ -22,14 +22,17 @@ class PuffSamplerLayer(base.DataLayer):
                 case, one need to make sure that the minibatch size is smaller
                 than the number of data points in the local range on every mpi
                 node. Default True.
+            dtype: if set, floating point data is converted to the given
+                dtype. Default None, which keeps the dtype of the puff files.
         """
         base.DataLayer.__init__(self, **kwargs)
+        self._indices = None
         self._filenames = self.spec['puff']
         self._use_mpi = self.spec.get('use_mpi', True)
         self._minibatch = self.spec['minibatch']
         self._puffs = [base.Puff(filename) for filename in self._filenames]
         num_data = [puff.num_data() for puff in self._puffs]
-        if len(set(num_data)) == 1:
+        if len(set(num_data)) != 1:
             raise ValueError('The puff files have different number of data.')
         if self._use_mpi:
             local_start = int(num_data[0] * mpi.RANK / mpi.SIZE)
@@ -42,7 +45,44 @@ class PuffSamplerLayer(base.DataLayer):
 
     def forward(self, bottom, top):
         """The forward pass."""
-        for puff, top_blob in zip(self._puffs, top):
-            top_blob.mirror(puff.read(self._minibatch))
+        self.forward_tops(bottom, top, range(len(top)))
+
+    def forward_tops(self, bottom, top, needed):
+        """Moves to the next minibatch, and only reads the puff files at the
+        positions in needed."""
+        self._indices = self._puffs[0].next_indices(self._minibatch)
+        # the position after the minibatch, wrapping around like read().
+        after = self._puffs[0].next_indices(self._minibatch + 1)[-1]
+        for i, (puff, top_blob) in enumerate(zip(self._puffs, top)):
+            if i in needed:
+                self._emit(puff.read(self._minibatch), top_blob)
+            else:
+                puff.seek(after)
         return
 
+    def fill_tops(self, bottom, top, needed):
+        """Reads the last minibatch of the puff files at the positions in
+        needed."""
+        for i in needed:
+            puff = self._puffs[i]
+            after = puff.next_indices(1)[0]
+            puff.seek(self._indices[0])
+            self._emit(puff.read(self._minibatch), top[i])
+            puff.seek(after)
+
+    def _emit(self, data, top_blob):
+        """Puts the data read from a puff file into a top blob."""
+        dtype = self.output_dtype(data.dtype)
+        if dtype == data.dtype:
+            top_blob.mirror(data)
+        else:
+            top_blob.init_data(data.shape, dtype, setdata=False)[:] = data
+
+    def infer_data_shapes(self, bottom, num_tops):
+        """Every top blob holds a minibatch of its puff file."""
+        return [((self._minibatch,) + tuple(puff.shape()),
+                 self.output_dtype(puff.dtype())) for puff in self._puffs]
+
+    def data_indices(self):
+        """Returns the indices of the last minibatch in the puff files."""
+        return self._indices
@@ -17,22 +17,36 @@ class ReLULayer(base.Layer):
         """Computes the forward pass."""
         # Get features and output
         features = bottom[0].data()
-        output = top[0].init_data(features.shape, features.dtype)
+        if top[0] is bottom[0]:
+            output = features
+        else:
+            output = top[0].init_data(features.shape, features.dtype,
+                                      setdata=False)
         wrapper.relu_forward(features, output)
-        #output[:] = features
-        #output *= (features > 0)
 
     def backward(self, bottom, top, propagate_down):
         """Computes the backward pass."""
         if not propagate_down:
             return 0.
+        # Since the output is positive exactly where the input is, we use the
+        # output to compute the mask, which also works in place.
+        top_data = top[0].data()
         top_diff = top[0].diff()
-        features = bottom[0].data()
-        bottom_diff = bottom[0].init_diff()
-        bottom_diff[:] = top_diff
-        bottom_diff *= (features > 0)
+        if top[0] is bottom[0]:
+            bottom_diff = top_diff
+        else:
+            bottom_diff = bottom[0].init_diff(setzero=False)
+        wrapper.relu_backward(top_data, top_diff, bottom_diff)
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
     def update(self):
         """ReLU has nothing to update."""
         pass
+
+    def supports_inplace(self):
+        """ReLU can run in place."""
+        return True
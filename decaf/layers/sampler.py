@@ -16,30 +16,57 @@ class BasicMinibatchLayer(base.DataLayer):
 
         kwargs:
             minibatch: the minibatch size.
+            dtype: if set, floating point data is converted to the given
+                dtype. Default None, which keeps the dtype of the bottom blobs.
         """
         base.DataLayer.__init__(self, **kwargs)
         self._minibatch = self.spec['minibatch']
         self._index = 0
+        self._indices = None
 
     def forward(self, bottom, top):
         """Computes the forward pass."""
+        self.forward_tops(bottom, top, range(len(top)))
+
+    def forward_tops(self, bottom, top, needed):
+        """Moves to the next minibatch, and only copies the bottom blobs at
+        the positions in needed."""
         size = bottom[0].data().shape[0]
-        end_id = self._index + self._minibatch
-        for bottom_blob, top_blob in zip(bottom, top):
-            bottom_data = bottom_blob.data()
-            if bottom_data.shape[0] != size:
+        for bottom_blob in bottom:
+            if bottom_blob.data().shape[0] != size:
                 raise RuntimeError(
                     'Inputs do not have identical number of data points!')
-            top_data = top_blob.init_data(
-                (self._minibatch,) + bottom_data.shape[1:], bottom_data.dtype)
+        end_id = self._index + self._minibatch
+        self._indices = np.arange(self._index, end_id) % size
+        self._index = end_id % size
+        self.fill_tops(bottom, top, needed)
+
+    def fill_tops(self, bottom, top, needed):
+        """Copies the last minibatch of the bottom blobs at the positions in
+        needed."""
+        start = self._indices[0]
+        end_id = start + self._minibatch
+        for i in needed:
+            bottom_data = bottom[i].data()
+            size = bottom_data.shape[0]
+            top_data = top[i].init_data(
+                (self._minibatch,) + bottom_data.shape[1:],
+                self.output_dtype(bottom_data.dtype), setdata=False)
             # copy data
             if end_id <= size:
-                top_data[:] = bottom_data[self._index:end_id]
+                top_data[:] = bottom_data[start:end_id]
             else:
-                top_data[:(size - self._index)] = bottom_data[self._index:]
+                top_data[:(size - start)] = bottom_data[start:]
                 top_data[-(end_id - size):] = bottom_data[:(end_id - size)]
-        # finally, compute the new index.
-        self._index = end_id % size
+
+    def infer_data_shapes(self, bottom, num_tops):
+        """Every top blob holds a minibatch of its bottom blob."""
+        return [((self._minibatch,) + tuple(shape[1:]),
+                 self.output_dtype(dtype)) for shape, dtype in bottom]
+
+    def data_indices(self):
+        """Returns the indices of the last minibatch in the bottom blobs."""
+        return self._indices
         
 
 class RandomPatchLayer(base.DataLayer):
@@ -52,6 +79,8 @@ class RandomPatchLayer(base.DataLayer):
         kwargs:
             psize: the patch size.
             factor: the number of patches per bottom layer's image.
+            dtype: if set, floating point data is converted to the given
+                dtype. Default None, which keeps the dtype of the bottom blob.
         """
         base.DataLayer.__init__(self, **kwargs)
 
@@ -63,7 +92,7 @@ class RandomPatchLayer(base.DataLayer):
         num_img, height, width, num_channels = bottom_data.shape
         top_data = top[0].init_data(
             (num_img * factor, psize, psize, num_channels),
-            dtype=bottom_data.dtype)
+            dtype=self.output_dtype(bottom_data.dtype), setdata=False)
         h_indices = np.random.randint(height - psize, size=num_img * factor)
         w_indices = np.random.randint(width - psize, size=num_img * factor)
         for i in range(num_img):
@@ -75,3 +104,9 @@ class RandomPatchLayer(base.DataLayer):
                                                 w_index:w_index + psize]
         return
 
+    def infer_data_shapes(self, bottom, num_tops):
+        """The top blob holds factor patches of every bottom image."""
+        shape, dtype = bottom[0]
+        return [((shape[0] * self.spec['factor'], self.spec['psize'],
+                  self.spec['psize'], shape[3]), self.output_dtype(dtype))]
+
@@ -3,6 +3,7 @@
 from decaf import base
 from decaf.util import logexp
 import numexpr
+import numpy as np
 
 class SigmoidLayer(base.Layer):
     """A layer that implements the sigmoid operation."""
@@ -16,7 +17,11 @@ class SigmoidLayer(base.Layer):
         """Computes the forward pass."""
         # Get features and top_data
         bottom_data = bottom[0].data()
-        top_data = top[0].init_data(bottom_data.shape, bottom_data.dtype)
+        if top[0] is bottom[0]:
+            top_data = bottom_data
+        else:
+            top_data = top[0].init_data(bottom_data.shape, bottom_data.dtype,
+                                        setdata=False)
         numexpr.evaluate('1. / (exp(-bottom_data) + 1.)', out=top_data)
 
     def backward(self, bottom, top, propagate_down):
@@ -24,10 +29,25 @@ class SigmoidLayer(base.Layer):
         if propagate_down:
             top_data = top[0].data()
             top_diff = top[0].diff()
-            bottom_diff = bottom[0].init_diff()
+            if top[0] is bottom[0]:
+                bottom_diff = top_diff
+            else:
+                bottom_diff = bottom[0].init_diff(setzero=False)
             numexpr.evaluate('top_data * top_diff * (1. - top_data)', out=bottom_diff)
         return 0
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the exponential, the addition and the division."""
+        return 3 * int(np.prod(top_shapes[0]))
+
     def update(self):
-        """ReLU has nothing to update."""
+        """Sigmoid has nothing to update."""
         pass
+
+    def supports_inplace(self):
+        """Sigmoid can run in place."""
+        return True
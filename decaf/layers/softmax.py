@@ -41,6 +41,15 @@ class SoftmaxLayer(base.Layer):
         bottom_diff *= prob
         return 0.
 
+    def infer_shapes(self, bottom_shapes, num_tops):
+        """The output has the shape of the input."""
+        return list(bottom_shapes)
+
+    def flops(self, bottom_shapes, top_shapes):
+        """Counts the max, the subtraction, the exponential, the sum and the
+        division."""
+        return 5 * int(np.prod(top_shapes[0]))
+
     def update(self):
         """Softmax has nothing to update."""
         pass
@@ -22,9 +22,20 @@ class StochasticSolver(base.Solver):
             snapshot_interval: the snapshot interval. Default 0.
             folder: the snapshot folder. Should be provided
                 if snapshot_interval is not zero.
+            micro_batches: the number of micro-batches each minibatch is split
+                into, with the gradients accumulated over them. This bounds
+                the memory needed by the intermediate blobs. See
+                decaf.base.Net.forward_backward(). Default 1.
+            dtype: if set, the net is converted to the given dtype with
+                decaf.base.Net.astype() before solving, so that the
+                parameters and the solver state are kept in that dtype. The
+                data layers should produce data of the same dtype. Default
+                None, which keeps the dtype of the net.
         """
         base.Solver.__init__(self, **kwargs)
         self._max_iter = self.spec.get('max_iter', 1000)
+        self._micro_batches = self.spec.get('micro_batches', 1)
+        self._dtype = self.spec.get('dtype', None)
         self._snapshot_interval = self.spec.get('snapshot_interval', 0)
         if self._snapshot_interval > 0 and 'folder' not in self.spec:
             raise ValueError('You should provide a folder to write result to.')
@@ -97,7 +108,10 @@ class StochasticSolver(base.Solver):
         self._iter_idx = 0
         self._decaf_net = decaf_net
         self._previous_net = previous_net
-        initial_loss = decaf_net.forward_backward(self._previous_net)
+        if self._dtype is not None:
+            decaf_net.astype(self._dtype)
+        initial_loss = decaf_net.forward_backward(self._previous_net,
+                                                  self._micro_batches)
         logging.info('StochasticSolver: initial loss: %f.', initial_loss)
         logging.info('(Under mpirun, the given loss will just be an estimate'
                      ' on the root node.)')
@@ -108,7 +122,8 @@ class StochasticSolver(base.Solver):
         for _ in range(self._max_iter):
             if mpi.SIZE > 1:
                 loss = mpi.COMM.allreduce(
-                    decaf_net.forward_backward(self._previous_net)) / mpi.SIZE
+                    decaf_net.forward_backward(
+                        self._previous_net, self._micro_batches)) / mpi.SIZE
                 # we need to broadcast and average the parameters
                 params = decaf_net.params()
                 for param in params:
@@ -117,7 +132,8 @@ class StochasticSolver(base.Solver):
                     mpi.COMM.Allreduce(diff_cache, diff)
                     diff /= mpi.SIZE
             else:
-                loss = decaf_net.forward_backward(self._previous_net)
+                loss = decaf_net.forward_backward(self._previous_net,
+                                                  self._micro_batches)
             self.compute_update_value()
             decaf_net.update()
             if (mpi.is_root() and 
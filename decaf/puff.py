@@ -188,6 +188,12 @@ class Puff(object):
         self.seek(self._start)
         return self.read(self._num_local_data)
 
+    def next_indices(self, count):
+        """Returns the indices of the data points that read(count) would
+        return, wrapping around at the end of the local range."""
+        return self._start + (self._curr - self._start + np.arange(count)) \
+                % self._num_local_data
+
 
 class PuffStreamedWriter(object):
     """A streamed writer to write a large puff incrementally."""
@@ -235,6 +241,143 @@ class PuffStreamedWriter(object):
                          'num': self._num_data}, fid)
 
 
+class IndexedPuff(object):
+    """A puff that stores data points at arbitrary indices, such as the
+    activations of a net computed for some data points of a data set. Data
+    points may be written in any order, and only the indices that have been
+    written can be read back. After flush(), the file is a valid puff that
+    can be opened with Puff, where the data points never written are zero.
+
+    The puff may record a key identifying the computation that produced its
+    data, such as a hash of the weights of a net, see check_key().
+    """
+    def __init__(self, name):
+        """Opens the indexed puff, creating it if it does not exist.
+
+        Input:
+            name: the puff file name, without the .puff extension.
+        """
+        self._name = name
+        self._shape = None
+        self._dtype = None
+        self._key = None
+        # filled[i] tells if the i-th data point has been written.
+        self._filled = np.zeros(0, np.bool)
+        self._dirty = False
+        if os.path.exists(name + '.icing'):
+            with open(name + '.icing', 'rb') as fid:
+                icing = pickle.load(fid)
+            self._shape = icing['shape']
+            self._dtype = icing['dtype']
+            self._key = icing.get('key', None)
+            self._filled = np.zeros(icing['num'], np.bool)
+            self._filled[icing['filled']] = True
+            self._fid = open(name + '.puff', 'r+b')
+        else:
+            self._fid = open(name + '.puff', 'w+b')
+
+    def check_key(self, key):
+        """Checks that the data was written for the given key. If the puff
+        holds data written for another key, or without a key, the data is
+        discarded. The key is stored on disk by flush().
+        """
+        if self._key == key:
+            return
+        if self._shape is not None:
+            logging.info('Discarding the content of %s, which was written'
+                         ' for another key.', self._name)
+            self._shape = None
+            self._dtype = None
+            self._filled = np.zeros(0, np.bool)
+            self._fid.seek(0)
+            self._fid.truncate()
+        self._key = key
+        self._dirty = True
+
+    def contains(self, indices):
+        """Returns True if all the given indices have been written. An empty
+        list of indices is contained once the shape of the data is known.
+        """
+        indices = np.asarray(indices)
+        if self._shape is None:
+            return False
+        if indices.size == 0:
+            return True
+        return bool(indices.max() < self._filled.size and
+                    self._filled[indices].all())
+
+    @staticmethod
+    def _runs(indices):
+        """Splits the indices into runs of consecutive indices, and returns
+        the (start, end) positions of the runs."""
+        if len(indices) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        bounds = [0] + breaks.tolist() + [len(indices)]
+        return zip(bounds[:-1], bounds[1:])
+
+    def read(self, indices):
+        """Reads the data points with the given indices."""
+        if not self.contains(indices):
+            raise ValueError('Some data points have not been written.')
+        indices = np.asarray(indices)
+        step = reduce(mul, self._shape, 1)
+        data = np.empty((len(indices),) + self._shape, self._dtype)
+        for start, end in IndexedPuff._runs(indices):
+            self._fid.seek(indices[start] * step * self._dtype.itemsize)
+            data[start:end].flat = np.fromfile(
+                self._fid, self._dtype, (end - start) * step)
+        return data
+
+    def write(self, indices, data):
+        """Writes the data points with the given indices."""
+        indices = np.asarray(indices)
+        if self._shape is None:
+            self._shape = data.shape[1:]
+            self._dtype = data.dtype
+        elif self._shape != data.shape[1:] or self._dtype != data.dtype:
+            raise TypeError('Array invalid with previous inputs! '
+                            'Previous: %s, %s, current: %s %s' %
+                            (str(self._shape), str(self._dtype),
+                             str(data.shape[1:]), str(data.dtype)))
+        if len(indices) != data.shape[0]:
+            raise ValueError('The number of indices and data points should'
+                             ' be the same.')
+        step = reduce(mul, self._shape, 1)
+        data = np.ascontiguousarray(data)
+        for start, end in IndexedPuff._runs(indices):
+            self._fid.seek(indices[start] * step * self._dtype.itemsize)
+            data[start:end].tofile(self._fid)
+        if len(indices) and indices.max() >= self._filled.size:
+            filled = np.zeros(indices.max() + 1, np.bool)
+            filled[:self._filled.size] = self._filled
+            self._filled = filled
+        self._filled[indices] = True
+        self._dirty = True
+
+    def num_written(self):
+        """Returns the number of data points written."""
+        return int(self._filled.sum())
+
+    def flush(self):
+        """Writes the pending data and the meta information to disk."""
+        if not self._dirty:
+            return
+        self._fid.flush()
+        with open(self._name + '.icing', 'wb') as fid:
+            pickle.dump({'shape': self._shape,
+                         'dtype': self._dtype,
+                         'num': self._filled.size,
+                         'filled': np.flatnonzero(self._filled),
+                         'key': self._key}, fid)
+        self._dirty = False
+
+    def close(self):
+        """Flushes and closes the puff."""
+        self.flush()
+        self._fid.close()
+
+
 def write_puff(arr, name):
     """Write a single numpy array to puff format."""
     writer = PuffStreamedWriter(name)
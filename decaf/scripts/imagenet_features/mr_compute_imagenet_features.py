@@ -52,8 +52,7 @@ class DecafnetMapper(mapreducer.BasicMapper):
             try:
                 img = io.imread(f)
                 logging.info(f)
-                _ = self._net.classify(img)
-                feat = self._net.feature(FLAGS.feature_name) 
+                feat = self._net.feature(FLAGS.feature_name, img)
                 dim = np.prod(feat.shape[1:])
                 if FLAGS.randprojection > 0:
                     if self._randproj is None:
@@ -1,6 +1,7 @@
 """jeffnet implements a wrapper over the imagenet classifier trained by Jeff
 Donahue using the cuda convnet code.
 """
+import copy
 import cPickle as pickle
 from decaf.util import translator, transform
 import logging
@@ -69,6 +70,21 @@ class JeffNet(object):
         """
         return self._net.predict(data=images)['probs_cudanet_out']
 
+    def net(self):
+        """Returns the underlying decaf net, for example to save it or to
+        quantize it with decaf.util.quantize.
+        """
+        return self._net
+
+    def clone_for_inference(self):
+        """Returns a copy of the classifier that shares the network parameters
+        with this one, so that the two can classify images concurrently from
+        different threads. See decaf.base.Net.clone_for_inference().
+        """
+        clone = copy.copy(self)
+        clone._net = self._net.clone_for_inference()
+        return clone
+
     @staticmethod
     def oversample(image, center_only=False):
         """Oversamples an image. Currently the indices are hard coded to the
@@ -102,15 +118,17 @@ class JeffNet(object):
             images[5:] = images[:5, ::-1]
             return images
     
-    def classify(self, image, center_only=False):
-        """Classifies an input image.
-        
+    def prepare_image(self, image, center_only=False):
+        """Returns the oversampled images to be fed into the network, given
+        an input image.
+
         Input:
             image: an image of 3 channels and has data type uint8. Only the
-                center region will be used for classification.
+                center region will be used.
+            center_only: if True, only return the center image.
         Output:
-            scores: a numpy vector of size 1000 containing the
-                predicted scores for the 1000 classes.
+            images: the preprocessed images of size (10 x 227 x 227 x 3), or
+                (1 x 227 x 227 x 3) if center_only is True.
         """
         # first, extract the 256x256 center.
         image = transform.scale_and_extract(transform.as_rgb(image), 256)
@@ -122,7 +140,19 @@ class JeffNet(object):
         # subtract the mean
         image -= self._data_mean
         # oversample the images
-        images = JeffNet.oversample(image, center_only)
+        return JeffNet.oversample(image, center_only)
+
+    def classify(self, image, center_only=False):
+        """Classifies an input image.
+        
+        Input:
+            image: an image of 3 channels and has data type uint8. Only the
+                center region will be used for classification.
+        Output:
+            scores: a numpy vector of size 1000 containing the
+                predicted scores for the 1000 classes.
+        """
+        images = self.prepare_image(image, center_only)
         predictions = self.classify_direct(images)
         return predictions.mean(0)
 
@@ -140,13 +170,21 @@ class JeffNet(object):
         return (indices[:-(k+1):-1],
                 [self.label_names[i] for i in indices[:-(k+1):-1]])
 
-    def feature(self, blob_name):
+    def feature(self, blob_name, image=None, center_only=False):
         """Returns the feature of a specific blob.
         Input:
             blob_name: the name of the blob requested.
+            image: if given, the image to compute the feature for. Only the
+                layers needed to compute the blob will be run. If None, the
+                feature from the last classify() call is returned.
+            center_only: if True, only compute the feature for the center
+                image.
         Output:
             array: the numpy array storing the feature.
         """
+        if image is not None:
+            images = self.prepare_image(image, center_only)
+            self._net.predict([blob_name], data=images)
         # We will copy the feature matrix in case further calls overwrite
         # it.
         return self._net.feature(blob_name).copy()
@@ -0,0 +1,69 @@
+"""This script quantizes JeffNet to int8 for CPU inference, and reports the
+accuracy and the speed of the quantized net against the float net.
+
+Usage:
+    quantize_jeffnet.py
+        --calibration=/name/of/the/calibration/image/puff
+        --evaluation=/name/of/the/evaluation/image/puff
+        [--labels=/name/of/the/evaluation/label/puff]
+        [--output=/name/of/the/output/net]
+        [--num_calibration=100]
+        [--num_evaluation=500]
+where the image puffs contain 256x256x3 uint8 images as produced by
+convert_imagenet_to_puff.py, and the label puff contains their labels.
+"""
+
+from decaf import puff
+from decaf.scripts import jeffnet
+from decaf.util import quantize
+import gflags
+import logging
+import numpy as np
+import sys
+
+gflags.DEFINE_string('calibration', '', 'The calibration image puff.')
+gflags.DEFINE_string('evaluation', '', 'The evaluation image puff.')
+gflags.DEFINE_string('labels', '', 'The evaluation label puff.')
+gflags.DEFINE_string('output', '', 'If set, the quantized net is saved here.')
+gflags.DEFINE_integer('num_calibration', 100,
+                      'The number of calibration images.')
+gflags.DEFINE_integer('num_evaluation', 500,
+                      'The number of evaluation images.')
+gflags.DEFINE_integer('batch_size', 10, 'The batch size.')
+FLAGS = gflags.FLAGS
+
+OUTPUT_BLOB = 'probs_cudanet_out'
+
+
+def read_images(net, filename, count):
+    """Reads count images from a puff, and prepares their center crops."""
+    images = puff.Puff(filename).read(count)
+    return np.vstack([net.prepare_image(image, center_only=True)
+                      for image in images])
+
+
+def main(argv):
+    """The main function."""
+    logging.getLogger().setLevel(logging.INFO)
+    FLAGS(argv)
+    float_net = jeffnet.JeffNet()
+    quantized_net = jeffnet.JeffNet()
+    calibration = read_images(float_net, FLAGS.calibration,
+                              FLAGS.num_calibration)
+    quantize.quantize_net(quantized_net.net(), calibration,
+                          batch_size=FLAGS.batch_size)
+    if FLAGS.output:
+        quantized_net.net().save(FLAGS.output)
+    evaluation = read_images(float_net, FLAGS.evaluation,
+                             FLAGS.num_evaluation)
+    labels = None
+    if FLAGS.labels:
+        labels = puff.Puff(FLAGS.labels).read(FLAGS.num_evaluation)
+    report = quantize.compare(float_net.net(), quantized_net.net(),
+                              evaluation, OUTPUT_BLOB, labels=labels,
+                              batch_size=FLAGS.batch_size)
+    print quantize.format_report(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
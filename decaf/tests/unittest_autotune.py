@@ -0,0 +1,98 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+from decaf.util import autotune
+import json
+import numpy as np
+import numpy.testing as npt
+import os
+import tempfile
+import unittest
+
+
+class TestAutotune(unittest.TestCase):
+    def setUp(self):
+        self.filename = tempfile.mktemp('.json')
+        autotune.set_cache_file(self.filename)
+        np.random.seed(1701)
+        self.bottom = base.Blob((4, 8, 8, 3),
+                                filler=fillers.GaussianRandFiller())
+        self.top_diff = np.random.randn(4, 8, 8, 5)
+
+    def tearDown(self):
+        autotune.set_cache_file(None)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def _forward_backward(self, engine):
+        np.random.seed(1702)
+        layer = core_layers.ConvolutionLayer(
+            name='conv', num_kernels=5, ksize=3, stride=1, mode='same',
+            engine=engine, filler=fillers.GaussianRandFiller())
+        top = base.Blob()
+        layer.forward([self.bottom], [top])
+        top.init_diff()[:] = self.top_diff
+        layer.backward([self.bottom], [top], True)
+        return layer, [top.data().copy(), self.bottom.diff().copy()] + \
+                [param.diff().copy() for param in layer.param()]
+
+    def testAutotune(self):
+        _, expected = self._forward_backward('im2col')
+        layer, result = self._forward_backward('auto')
+        for actual, value in zip(result, expected):
+            npt.assert_array_almost_equal(actual, value)
+        self.assertTrue(layer._engine in ('im2col', 'fft', 'winograd'))
+        with open(self.filename) as fid:
+            entries = json.load(fid)
+        self.assertEqual(len(entries), 1)
+        key, choice = entries.items()[0]
+        self.assertTrue(key.startswith(autotune.machine_key()))
+        self.assertEqual(tuple(choice), (layer._engine, layer._memory))
+
+    def testCachedChoice(self):
+        self._forward_backward('auto')
+        # a later process reads the decision from the file instead of
+        # timing the engines.
+        with open(self.filename) as fid:
+            entries = json.load(fid)
+        key = entries.keys()[0]
+        entries[key] = ['winograd', 0]
+        with open(self.filename, 'w') as fid:
+            json.dump(entries, fid)
+        autotune.set_cache_file(self.filename)
+        layer, result = self._forward_backward('auto')
+        self.assertEqual(layer._engine, 'winograd')
+        _, expected = self._forward_backward('im2col')
+        for actual, value in zip(result, expected):
+            npt.assert_array_almost_equal(actual, value)
+
+    def testGroupConvolution(self):
+        layer = core_layers.GroupConvolutionLayer(
+            name='conv', group=3, num_kernels=2, ksize=3, stride=2,
+            mode='valid', engine='auto', filler=fillers.GaussianRandFiller())
+        top = base.Blob()
+        layer.forward([self.bottom], [top])
+        # the groups have the same shapes, and share a single decision that
+        # only considers the engines supporting stride 2.
+        with open(self.filename) as fid:
+            entries = json.load(fid)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries.values()[0][0], 'im2col')
+
+    def testDefaultCache(self):
+        # without the environment variable the decisions stay in memory.
+        saved = os.environ.pop('DECAF_AUTOTUNE_CACHE', None)
+        try:
+            autotune._DEFAULT_CACHE = None
+            self.assertTrue(autotune.default_cache()._filename is None)
+            os.environ['DECAF_AUTOTUNE_CACHE'] = self.filename
+            autotune._DEFAULT_CACHE = None
+            self._forward_backward('auto')
+            self.assertTrue(os.path.exists(self.filename))
+        finally:
+            os.environ.pop('DECAF_AUTOTUNE_CACHE', None)
+            if saved is not None:
+                os.environ['DECAF_AUTOTUNE_CACHE'] = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
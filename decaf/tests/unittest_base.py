@@ -3,6 +3,7 @@ from decaf import base
 import logging
 import numpy as np
 import numpy.testing as npt
+import os
 import tempfile
 import unittest
 
@@ -62,6 +63,75 @@ class TestBlob(unittest.TestCase):
         self.assertEqual(output.shape, (3,4))
 
 
+class TestBlobPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = base.BlobPool()
+        base.Blob.set_pool(self.pool)
+
+    def tearDown(self):
+        base.Blob.set_pool(None)
+
+    def testBlobPoolReuse(self):
+        blob = base.Blob((10, 3), np.float64)
+        address = blob.data().ctypes.data
+        # a slightly smaller shape falls into the same size class.
+        blob.init_data((9, 3), np.float64)
+        self.assertEqual(blob.data().ctypes.data, address)
+        self.assertEqual(blob.data().shape, (9, 3))
+        stats = self.pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        diff = blob.init_diff()
+        npt.assert_array_equal(diff, 0.)
+        del diff
+        blob.clear()
+        self.assertEqual(self.pool.stats()['bytes_held'], 512)
+
+    def testBlobPoolReferenced(self):
+        blob = base.Blob((10, 3), np.float64)
+        data = blob.data()
+        data[:] = 1.
+        blob.init_data((20, 3), np.float64)
+        # the old data is still referenced, so it should not be recycled.
+        self.assertEqual(self.pool.stats()['bytes_held'], 0)
+        npt.assert_array_equal(data, 1.)
+
+    def testBlobPoolCapacity(self):
+        pool = base.BlobPool(capacity=1024)
+        base.Blob.set_pool(pool)
+        blobs = [base.Blob((64,), np.float64) for _ in range(4)]
+        for blob in blobs:
+            blob.clear()
+        stats = pool.stats()
+        self.assertEqual(stats['bytes_held'], 1024)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(pool.trim(512), 512)
+        self.assertEqual(pool.trim(), 512)
+        self.assertEqual(pool.stats()['bytes_held'], 0)
+
+    def testBlobPoolNet(self):
+        from decaf.layers import core_layers, fillers
+        np.random.seed(1701)
+        decaf_net = base.Net()
+        decaf_net.add_layers([
+            core_layers.ConvolutionLayer(
+                name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+                filler=fillers.GaussianRandFiller()),
+            core_layers.ReLULayer(name='relu'),
+            core_layers.FlattenLayer(name='flatten'),
+            core_layers.InnerProductLayer(
+                name='ip', num_output=5, filler=fillers.GaussianRandFiller())],
+            needs='data', provides='score')
+        decaf_net.finish()
+        data = np.random.randn(8, 8, 8, 2)
+        expected = decaf_net.predict(data=data)['score'].copy()
+        for batch_size in [3, 7, 4, 8, 5]:
+            npt.assert_array_almost_equal(
+                decaf_net.predict(data=data[:batch_size])['score'],
+                expected[:batch_size])
+        self.assertTrue(self.pool.stats()['hits'] > 0)
+
+
 class TestNet(unittest.TestCase):
     def setUp(self):
         self.decaf_net = base.Net()
@@ -77,6 +147,12 @@ class TestNet(unittest.TestCase):
         self.assertEqual(len(self.decaf_net.blobs), 3)
         self.assertTrue(any(isinstance(layer, base.SplitLayer)
                              for layer in self.decaf_net.layers.values()))
+
+    def testSplitRefinish(self):
+        """testSplitRefinish tests if finish() can be called again."""
+        self.decaf_net.finish()
+        self.assertEqual(len(self.decaf_net.layers), 4)
+        self.assertEqual(len(self.decaf_net.blobs), 3)
     
     def testVisualize(self):
         from decaf.util import visualize
@@ -88,6 +164,73 @@ class TestNet(unittest.TestCase):
                 'pydot not configured correctly. Skipping test.')
         self.assertTrue(True)
 
+
+class TestNetSave(unittest.TestCase):
+    def setUp(self):
+        from decaf.layers import core_layers, fillers
+        np.random.seed(1701)
+        self.decaf_net = base.Net()
+        self.decaf_net.add_layers([
+            core_layers.ConvolutionLayer(
+                name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+                filler=fillers.GaussianRandFiller()),
+            core_layers.ReLULayer(name='relu'),
+            core_layers.FlattenLayer(name='flatten'),
+            core_layers.InnerProductLayer(
+                name='ip', num_output=5, filler=fillers.GaussianRandFiller())],
+            needs='data', provides='score')
+        self.decaf_net.finish()
+        self.data = np.random.randn(3, 8, 8, 2).astype(np.float32)
+        self.expected = self.decaf_net.predict(data=self.data)['score'].copy()
+
+    def testSaveLoad(self):
+        filename = tempfile.mktemp('.decafnet')
+        self.decaf_net.save(filename)
+        for mmap in [False, True]:
+            decaf_net = base.Net.load(filename, mmap=mmap)
+            npt.assert_array_almost_equal(
+                decaf_net.predict(data=self.data)['score'], self.expected)
+        # memory mapped parameters are read-only.
+        self.assertFalse(decaf_net.params()[0].data().flags.writeable)
+        decaf_net = base.Net.load(filename)
+        self.assertTrue(decaf_net.params()[0].data().flags.writeable)
+        for param in decaf_net.params():
+            self.assertEqual(param.data().ctypes.data % 16, 0)
+        os.remove(filename)
+
+    def testAstype(self):
+        self.assertEqual(self.decaf_net.params()[0].data().dtype, np.float32)
+        self.decaf_net.astype(np.float64)
+        for param in self.decaf_net.params():
+            self.assertEqual(param.data().dtype, np.float64)
+        output = self.decaf_net.predict(data=self.data.astype(np.float64))
+        self.assertEqual(output['score'].dtype, np.float64)
+        npt.assert_array_almost_equal(output['score'], self.expected, 5)
+
+    def testLoadLegacy(self):
+        filename = tempfile.mktemp('.decafnet')
+        layers = dict((name, (layer, self.decaf_net.needs[name],
+                              self.decaf_net.provides[name]))
+                      for name, layer in self.decaf_net.layers.iteritems())
+        with open(filename, 'wb') as fid:
+            pickle.dump([self.decaf_net.name, layers], fid,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        decaf_net = base.Net.load(filename)
+        npt.assert_array_almost_equal(
+            decaf_net.predict(data=self.data)['score'], self.expected)
+        os.remove(filename)
+
+    def testLoadFrom(self):
+        filename = tempfile.mktemp('.decafnet')
+        self.decaf_net.save(filename)
+        for param in self.decaf_net.params():
+            param.data()[:] = 0.
+        self.decaf_net.load_from(filename)
+        npt.assert_array_almost_equal(
+            self.decaf_net.predict(data=self.data)['score'], self.expected)
+        os.remove(filename)
+
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
     unittest.main()
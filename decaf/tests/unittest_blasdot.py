@@ -52,6 +52,62 @@ class TestBlasdot(unittest.TestCase):
             self.assertTrue(result.flags.f_contiguous)
             np.testing.assert_array_almost_equal(result, result_ref)
 
+    def testdot_mixed_dtype(self):
+        for A, B in self.test_matrices:
+            result_ref = np.dot(A, B)
+            result = np.empty(result_ref.shape, dtype=np.float32)
+            blasdot.dot(A.astype(np.float64), B.astype(np.float32),
+                        out=result)
+            np.testing.assert_array_almost_equal(result, result_ref, 5)
+            result = blasdot.dot(A.astype(np.float32), B.astype(np.float64))
+            self.assertEqual(result.dtype, np.float64)
+            np.testing.assert_array_almost_equal(result, result_ref, 5)
+
+    def testSingleThreadedBlas(self):
+        previous = blasdot.get_blas_num_threads()
+        if previous is None:
+            self.skipTest('The BLAS library does not expose its threads.')
+        blasdot.set_blas_num_threads(2)
+        if blasdot.get_blas_num_threads() != 2:
+            blasdot.set_blas_num_threads(previous)
+            self.skipTest('The BLAS library does not support 2 threads.')
+        try:
+            # two overlapping blocks, as in concurrent calls.
+            first = blasdot.single_threaded_blas()
+            second = blasdot.single_threaded_blas()
+            first.__enter__()
+            second.__enter__()
+            self.assertEqual(blasdot.get_blas_num_threads(), 1)
+            first.__exit__(None, None, None)
+            self.assertEqual(blasdot.get_blas_num_threads(), 1)
+            second.__exit__(None, None, None)
+            self.assertEqual(blasdot.get_blas_num_threads(), 2)
+        finally:
+            blasdot.set_blas_num_threads(previous)
+
+    def testSingleThreadedBlasLocal(self):
+        # a library with a per-thread setting and a library without one.
+        threads = {'global': 4, 'local': 0, 'shared': 4}
+        def setter(key):
+            def set_threads(num_threads):
+                previous = threads[key]
+                threads[key] = num_threads.value
+                return previous
+            return set_threads
+        functions = [(setter('global'), lambda: threads['global'],
+                      setter('local')),
+                     (setter('shared'), lambda: threads['shared'], None)]
+        saved = blasdot._BLAS_THREAD_FUNCTIONS
+        blasdot._BLAS_THREAD_FUNCTIONS = functions
+        try:
+            with blasdot.single_threaded_blas():
+                self.assertEqual(threads, {'global': 4, 'local': 1,
+                                           'shared': 1})
+            self.assertEqual(threads, {'global': 4, 'local': 0,
+                                       'shared': 4})
+        finally:
+            blasdot._BLAS_THREAD_FUNCTIONS = saved
+
 
 @unittest.skipIf(not blasdot._HAS_GPU, 
                  'No cuda gpu found.')
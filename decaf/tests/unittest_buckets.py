@@ -0,0 +1,91 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import threading
+import unittest
+
+
+def bucket_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.LocalResponseNormalizeLayer(
+            name='lrn', k=1., alpha=0.1, beta=0.75, size=3),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller()),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='data', provides='prob')
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestBatchBuckets(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(10, 8, 8, 2).astype(np.float32)
+        self.decaf_net = bucket_net()
+        self.expected = self.decaf_net.predict(data=self.data)['prob'].copy()
+
+    def testBuckets(self):
+        self.decaf_net.set_batch_buckets([1, 2, 4, 8])
+        self.decaf_net.warm_up(data=self.data[:1])
+        self.assertEqual(len(self.decaf_net._bucket_plans), 4)
+        addresses = dict((key, plan[0].blobs['prob'].data().ctypes.data)
+                         for key, plan in
+                         self.decaf_net._bucket_plans.iteritems())
+        for num in [1, 3, 4, 7, 2, 8, 10, 5]:
+            output = self.decaf_net.predict(data=self.data[:num])['prob']
+            self.assertEqual(output.shape, (num, 5))
+            npt.assert_array_almost_equal(output, self.expected[:num])
+        # no plan reallocated its blobs after the warm up.
+        for key, plan in self.decaf_net._bucket_plans.iteritems():
+            self.assertEqual(plan[0].blobs['prob'].data().ctypes.data,
+                             addresses[key])
+
+    def testBucketsEviction(self):
+        self.decaf_net.set_batch_buckets([2, 4, 8])
+        self.decaf_net.predict(data=self.data[:2])
+        small = self.decaf_net._bucket_plans.values()[0][2]
+        self.decaf_net.set_batch_buckets([2, 4, 8], max_bytes=small * 5)
+        for num in [2, 4, 1, 8]:
+            npt.assert_array_almost_equal(
+                self.decaf_net.predict(data=self.data[:num])['prob'],
+                self.expected[:num])
+        # the plan for 8 does not fit with the others, and the plan for 4 is
+        # the least recently used one.
+        self.assertEqual([key[0] for key in self.decaf_net._bucket_plans],
+                         [2, 8])
+
+    def testBucketsThreads(self):
+        num_threads = threading.active_count()
+        self.decaf_net.set_num_threads(2)
+        self.decaf_net.set_batch_buckets([2, 4, 8])
+        self.decaf_net.predict(data=self.data[:2])
+        small = self.decaf_net._bucket_plans.values()[0][2]
+        self.decaf_net.set_batch_buckets([2, 4, 8], max_bytes=small * 5)
+        for _ in range(5):
+            for num in [2, 4, 1, 8]:
+                npt.assert_array_almost_equal(
+                    self.decaf_net.predict(data=self.data[:num])['prob'],
+                    self.expected[:num])
+        # only the kept plans have threads.
+        self.assertEqual(threading.active_count(), num_threads +
+                         2 * len(self.decaf_net._bucket_plans))
+        self.decaf_net.close()
+        self.assertEqual(threading.active_count(), num_threads)
+
+    def testMemoryUsage(self):
+        usage = self.decaf_net.memory_usage()
+        self.assertTrue(usage > self.data.nbytes)
+        self.decaf_net.predict(data=self.data[:2])
+        self.assertTrue(self.decaf_net.memory_usage() < usage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def checkpoint_net(data, target, debug_freeze=True):
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layer(
+        core_layers.NdarrayDataLayer(name='input', sources=[data, target]),
+        provides=['data', 'target'])
+    decaf_net.add_layer(
+        core_layers.ConvolutionLayer(
+            name='conv1', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        needs='data', provides='conv1_out')
+    decaf_net.add_layer(core_layers.ReLULayer(name='relu1'),
+                        needs='conv1_out', provides='relu1_out')
+    decaf_net.add_layer(
+        core_layers.PoolingLayer(name='pool1', psize=2, stride=2, mode='max'),
+        needs='relu1_out', provides='pool1_out')
+    decaf_net.add_layer(
+        core_layers.ConvolutionLayer(
+            name='conv2', num_kernels=3, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        needs='pool1_out', provides='conv2_out')
+    decaf_net.add_layer(core_layers.ReLULayer(name='relu2'),
+                        needs='conv2_out', provides='relu2_out')
+    decaf_net.add_layer(
+        core_layers.DropoutLayer(name='dropout', ratio=0.5,
+                                 debug_freeze=debug_freeze),
+        needs='relu2_out', provides='dropout_out')
+    decaf_net.add_layer(core_layers.FlattenLayer(name='flatten'),
+                        needs='dropout_out', provides='flatten_out')
+    decaf_net.add_layer(
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller()),
+        needs='flatten_out', provides='score')
+    decaf_net.add_layer(
+        core_layers.SquaredLossLayer(name='loss'), needs=['score', 'target'])
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(4, 8, 8, 2)
+        self.target = np.random.randn(4, 5)
+
+    def testCheckpoint(self):
+        decaf_net = checkpoint_net(self.data, self.target)
+        loss = decaf_net.forward_backward()
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        for checkpoints in [[], ['pool1_out'], ['relu1_out', 'relu2_out']]:
+            decaf_net.set_checkpoints(checkpoints)
+            self.assertAlmostEqual(decaf_net.forward_backward(), loss)
+            for param, diff in zip(decaf_net.params(), expected):
+                npt.assert_array_almost_equal(param.diff(), diff)
+        # the blobs that are not checkpointed are discarded.
+        decaf_net.set_checkpoints(['pool1_out'])
+        decaf_net.forward_backward()
+        for name in ['conv1_out', 'relu1_out', 'conv2_out', 'relu2_out',
+                     'dropout_out']:
+            self.assertFalse(decaf_net.blobs[name].has_data())
+        for name in ['data', 'pool1_out', 'score']:
+            self.assertTrue(decaf_net.blobs[name].has_data())
+        self.assertFalse(decaf_net.layers['conv1']._col.has_data())
+        # disabling checkpointing keeps all blobs again.
+        decaf_net.set_checkpoints(None)
+        self.assertAlmostEqual(decaf_net.forward_backward(), loss)
+        self.assertTrue(decaf_net.blobs['relu1_out'].has_data())
+
+    def testCheckpointDropout(self):
+        # the recomputed dropout output should reuse the forward mask.
+        decaf_net = checkpoint_net(self.data, self.target, debug_freeze=False)
+        decaf_net.set_checkpoints(['pool1_out'])
+        loss = decaf_net.forward_backward()
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        # rerun without checkpoints, freezing the mask of the last pass.
+        decaf_net.layers['dropout'].spec['debug_freeze'] = True
+        decaf_net.set_checkpoints(None)
+        self.assertAlmostEqual(decaf_net.forward_backward(), loss)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+
+    def testCheckpointInvalid(self):
+        decaf_net = checkpoint_net(self.data, self.target)
+        self.assertRaises(base.InvalidNetError,
+                          decaf_net.set_checkpoints, ['unknown'])
+
+
+if __name__ == '__main__':
+    unittest.main()
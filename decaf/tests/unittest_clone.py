@@ -0,0 +1,82 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import threading
+import unittest
+
+
+def clone_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.LocalResponseNormalizeLayer(
+            name='lrn', k=1., alpha=0.1, beta=0.75, size=3),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller()),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='data', provides='prob')
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestClone(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = [np.random.randn(3, 8, 8, 2) for _ in range(4)]
+
+    def testCloneSharesParams(self):
+        decaf_net = clone_net()
+        expected = decaf_net.predict(data=self.data[0])['prob'].copy()
+        clone = decaf_net.clone_for_inference()
+        for param, cloned in zip(decaf_net.params(), clone.params()):
+            self.assertTrue(param is cloned)
+        npt.assert_array_almost_equal(
+            clone.predict(data=self.data[0])['prob'], expected)
+        # the clone owns its activations and scratch state.
+        for name in decaf_net.blobs:
+            self.assertFalse(decaf_net.blobs[name] is clone.blobs[name])
+        self.assertFalse(decaf_net.layers['conv']._col is
+                         clone.layers['conv']._col)
+        self.assertRaises(base.DecafError, clone.forward_backward)
+        self.assertRaises(base.DecafError, clone.update)
+
+    def testCloneThreads(self):
+        decaf_net = clone_net()
+        decaf_net.predict(data=self.data[0])
+        expected = [decaf_net.predict(data=data)['prob'].copy()
+                    for data in self.data]
+        clones = [decaf_net.clone_for_inference() for _ in self.data]
+        results = [None] * len(self.data)
+        def serve(idx):
+            for _ in range(10):
+                results[idx] = clones[idx].predict(
+                    data=self.data[idx])['prob'].copy()
+        threads = [threading.Thread(target=serve, args=(i,))
+                   for i in range(len(self.data))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for result, prob in zip(results, expected):
+            npt.assert_array_almost_equal(result, prob)
+
+    def testCloneMemoryPlan(self):
+        decaf_net = clone_net()
+        decaf_net.finish(inplace=True, optimize=True)
+        decaf_net.plan_memory(['prob'])
+        expected = decaf_net.predict(data=self.data[0])['prob'].copy()
+        clone = decaf_net.clone_for_inference()
+        npt.assert_array_almost_equal(
+            clone.predict(data=self.data[0])['prob'], expected)
+        npt.assert_array_almost_equal(
+            decaf_net.predict(data=self.data[0])['prob'], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
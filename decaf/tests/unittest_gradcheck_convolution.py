@@ -29,5 +29,88 @@ class TestConvolutionGrad(unittest.TestCase):
                 print(result)
                 self.assertTrue(result[0])
 
+    def testEngineGrad(self):
+        np.random.seed(1701)
+        output_blob = base.Blob()
+        checker = gradcheck.GradChecker(1e-4)
+        params = [('fft', 3, 'same'), ('fft', 2, 'full'),
+                  ('winograd', 3, 'valid'), ('winograd', 3, 'same')]
+        for engine, ksize, mode in params:
+            input_blob = base.Blob((1,5,5,3),
+                                   filler=fillers.GaussianRandFiller())
+            layer = core_layers.ConvolutionLayer(
+                name='conv', ksize=ksize, stride=1, mode=mode,
+                num_kernels=2, engine=engine,
+                filler=fillers.GaussianRandFiller())
+            result = checker.check(layer, [input_blob], [output_blob])
+            self.assertTrue(result[0])
+
+    def _forward_backward(self, bottom, top_diff, **kwargs):
+        np.random.seed(1702)
+        layer = core_layers.ConvolutionLayer(
+            name='conv', stride=1, mode='same', num_kernels=4,
+            filler=fillers.GaussianRandFiller(), **kwargs)
+        top = base.Blob()
+        layer.forward([bottom], [top])
+        top.init_diff()[:] = top_diff
+        layer.backward([bottom], [top], True)
+        return ([top.data().copy(), bottom.diff().copy()] +
+                [param.diff().copy() for param in layer.param()])
+
+    def testConvolutionChunks(self):
+        np.random.seed(1701)
+        bottom = base.Blob((5, 6, 6, 3), filler=fillers.GaussianRandFiller())
+        top_diff = np.random.randn(5, 6, 6, 4)
+        expected = self._forward_backward(bottom, top_diff, ksize=3)
+        # one image per chunk, chunks of two images with a smaller last
+        # chunk, the whole batch, large_mem, and the other engines.
+        image_bytes = 6 * 6 * 3 * 3 * 3 * 8
+        for kwargs in [{'memory': 0}, {'memory': image_bytes * 2},
+                       {'memory': 1e9}, {'large_mem': True},
+                       {'engine': 'fft', 'memory': 0},
+                       {'engine': 'fft', 'memory': 1e9},
+                       {'engine': 'winograd', 'memory': 0},
+                       {'engine': 'winograd', 'memory': 1e9}]:
+            result = self._forward_backward(bottom, top_diff, ksize=3,
+                                            **kwargs)
+            for actual, value in zip(result, expected):
+                np.testing.assert_array_almost_equal(actual, value)
+
+    def testEngineLargeKernel(self):
+        np.random.seed(1701)
+        bottom = base.Blob((2, 15, 15, 3), filler=fillers.GaussianRandFiller())
+        top_diff = np.random.randn(2, 15, 15, 4)
+        expected = self._forward_backward(bottom, top_diff, ksize=11)
+        result = self._forward_backward(bottom, top_diff, ksize=11,
+                                        engine='fft')
+        for actual, value in zip(result, expected):
+            np.testing.assert_array_almost_equal(actual, value)
+        self.assertRaises(ValueError, core_layers.ConvolutionLayer,
+                          name='conv', ksize=5, stride=1, mode='same',
+                          num_kernels=4, engine='winograd')
+        self.assertRaises(ValueError, core_layers.ConvolutionLayer,
+                          name='conv', ksize=3, stride=2, mode='same',
+                          num_kernels=4, engine='fft')
+
+    def testEngineKernelCache(self):
+        np.random.seed(1701)
+        bottom = base.Blob((2, 7, 8, 3), filler=fillers.GaussianRandFiller())
+        for engine in ['fft', 'winograd']:
+            layer = core_layers.ConvolutionLayer(
+                name='conv', ksize=3, stride=1, mode='same', num_kernels=4,
+                engine=engine, has_bias=False,
+                filler=fillers.GaussianRandFiller())
+            top = base.Blob()
+            layer.forward([bottom], [top])
+            expected = top.data().copy()
+            transformed = layer._transformed[2]
+            layer.forward([bottom], [top])
+            self.assertTrue(layer._transformed[2] is transformed)
+            # changing the kernels in place invalidates the transforms.
+            layer.param()[0].data()[:] *= 2
+            layer.forward([bottom], [top])
+            self.assertFalse(layer._transformed[2] is transformed)
+            np.testing.assert_array_almost_equal(top.data(), expected * 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -23,5 +23,19 @@ class TestIm2colGrad(unittest.TestCase):
                 print(result)
                 self.assertTrue(result[0])
 
+    def testIm2colPadGrad(self):
+        np.random.seed(1701)
+        output_blob = base.Blob()
+        checker = gradcheck.GradChecker(1e-4)
+        shapes = [(1,5,5,1), (1,4,3,3)]
+        params = [(2,1,1), (3,2,1), (3,1,2)]
+        for psize, stride, pad in params:
+            for shape in shapes:
+                input_blob = base.Blob(shape, filler=fillers.GaussianRandFiller())
+                layer = core_layers.Im2colLayer(name='im2col', psize=psize,
+                                                stride=stride, pad=pad)
+                result = checker.check(layer, [input_blob], [output_blob])
+                self.assertTrue(result[0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -26,5 +26,20 @@ class TestPoolingGrad(unittest.TestCase):
                 print(result)
                 self.assertTrue(result[0])
 
+    def testArgmaxPoolingGrad(self):
+        np.random.seed(1701)
+        output_blob = base.Blob()
+        checker = gradcheck.GradChecker(1e-4)
+        shapes = [(2,7,7,1), (1,8,8,3), (1,13,13,2)]
+        params = [(3,2), (3,3), (5,3)]
+        for shape in shapes:
+            for psize, stride in params:
+                input_blob = base.Blob(shape, filler=fillers.GaussianRandFiller())
+                layer = core_layers.PoolingLayer(
+                    name='pool', psize=psize, stride=stride, mode='max',
+                    argmax=True)
+                result = checker.check(layer, [input_blob], [output_blob])
+                self.assertTrue(result[0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -30,5 +30,27 @@ class TestIm2col(unittest.TestCase):
                                               j*stride:j*stride+psize,
                                               :].flatten())
 
+    def testIm2colPad(self):
+        np.random.seed(1701)
+        output_blob = base.Blob()
+        padded_blob = base.Blob()
+        expected_blob = base.Blob()
+        shapes = [(1,5,5,3), (3,4,3,1)]
+        params = [(2,1,1), (3,1,1), (3,2,1), (3,1,2)]
+        for psize, stride, pad in params:
+            for shape in shapes:
+                input_blob = base.Blob(shape, filler=fillers.GaussianRandFiller())
+                layer = core_layers.Im2colLayer(name='im2col', psize=psize,
+                                                stride=stride, pad=pad)
+                layer.forward([input_blob], [output_blob])
+                # compare against padding the input explicitly
+                core_layers.PaddingLayer(name='pad', pad=pad).forward(
+                    [input_blob], [padded_blob])
+                core_layers.Im2colLayer(name='im2col', psize=psize,
+                                        stride=stride).forward(
+                    [padded_blob], [expected_blob])
+                np.testing.assert_array_equal(output_blob.data(),
+                                              expected_blob.data())
+
 if __name__ == '__main__':
     unittest.main()
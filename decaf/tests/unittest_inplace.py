@@ -0,0 +1,72 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def small_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip1', num_output=10, filler=fillers.GaussianRandFiller()),
+        core_layers.DropoutLayer(name='dropout', ratio=0.5,
+                                 debug_freeze=True),
+        core_layers.SigmoidLayer(name='sigmoid'),
+        core_layers.InnerProductLayer(
+            name='ip2', num_output=5, filler=fillers.GaussianRandFiller())],
+        needs='data', provides='score')
+    decaf_net.add_layer(
+        core_layers.SquaredLossLayer(name='loss'), needs=['score', 'target'])
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestInplace(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+        self.target = np.random.randn(3, 5)
+
+    def testInplaceLayers(self):
+        decaf_net = small_net()
+        self.assertEqual(len(decaf_net._inplace_layers), 0)
+        decaf_net.finish(inplace=True)
+        # sigmoid follows dropout, which mirrors its input at prediction
+        # time, so it should not run in place.
+        self.assertEqual(decaf_net._inplace_layers,
+                         set(['relu', 'dropout']))
+        decaf_net.finish(inplace=False)
+        self.assertEqual(len(decaf_net._inplace_layers), 0)
+
+    def testInplaceGradients(self):
+        decaf_net = small_net()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        decaf_net.finish(inplace=True)
+        loss_inplace = decaf_net.forward_backward(inputs)
+        self.assertAlmostEqual(loss, loss_inplace)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+
+    def testInplaceKeep(self):
+        decaf_net = small_net()
+        conv_out = base.Net._make_output_name(decaf_net.layers['conv'])
+        decaf_net.finish(inplace=True)
+        decaf_net.plan_memory(keep=[conv_out])
+        self.assertFalse('relu' in decaf_net._inplace_layers)
+        self.assertTrue('dropout' in decaf_net._inplace_layers)
+        decaf_net.clear_memory_plan()
+        decaf_net.finish()
+        self.assertTrue('relu' in decaf_net._inplace_layers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def small_net():
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.PoolingLayer(name='pool', psize=2, mode='max'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip1', num_output=10, filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu2')],
+        needs='data', provides='hidden')
+    # two branches on top of the hidden layer
+    decaf_net.add_layers([
+        core_layers.InnerProductLayer(
+            name='ip2', num_output=5, filler=fillers.GaussianRandFiller()),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='hidden', provides='prob')
+    decaf_net.add_layer(
+        core_layers.InnerProductLayer(
+            name='ip3', num_output=3, filler=fillers.GaussianRandFiller()),
+        needs='hidden', provides='score')
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestMemoryPlan(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+
+    def testPlanPreservesOutputs(self):
+        decaf_net = small_net()
+        result = decaf_net.predict(data=self.data)
+        expected = dict((k, v.copy()) for k, v in result.iteritems())
+        decaf_net.plan_memory()
+        result = decaf_net.predict(data=self.data)
+        for name in expected:
+            npt.assert_array_almost_equal(result[name], expected[name])
+        # run again to make sure that reusing the buffers is fine.
+        result = decaf_net.predict(data=self.data * 2.)
+        result = decaf_net.predict(data=self.data)
+        for name in expected:
+            npt.assert_array_almost_equal(result[name], expected[name])
+
+    def testPlanSharesMemory(self):
+        decaf_net = small_net()
+        decaf_net.plan_memory()
+        decaf_net.predict(data=self.data)
+        intermediate = [name for name in decaf_net.blobs
+                        if name not in ('data', 'prob', 'score')]
+        buffers = set(id(decaf_net.blobs[name]._buffer)
+                      for name in intermediate
+                      if decaf_net.blobs[name]._buffer is not None)
+        planned = [name for name in intermediate
+                   if decaf_net.blobs[name]._buffer is not None]
+        self.assertGreater(len(planned), len(buffers))
+
+    def testKeep(self):
+        decaf_net = small_net()
+        decaf_net.predict(data=self.data)
+        expected = decaf_net.feature('hidden').copy()
+        decaf_net.plan_memory(keep=['hidden'])
+        decaf_net.predict(data=self.data)
+        npt.assert_array_almost_equal(decaf_net.feature('hidden'), expected)
+        self.assertRaises(base.DecafError, decaf_net.feature,
+                          base.Net._make_output_name(
+                              decaf_net.layers['conv']))
+        self.assertRaises(base.DecafError, decaf_net.forward_backward)
+        decaf_net.clear_memory_plan()
+        decaf_net.predict(data=self.data)
+        decaf_net.feature(base.Net._make_output_name(
+            decaf_net.layers['conv']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from decaf import base
+from decaf.layers import core_layers, fillers, regularization
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def small_net(data=None, target=None):
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    if data is not None:
+        decaf_net.add_layer(
+            core_layers.NdarrayDataLayer(name='input', sources=[data, target]),
+            provides=['data', 'target'])
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller(),
+            reg=regularization.L2Regularizer(weight=0.1))],
+        needs='data', provides='score')
+    decaf_net.add_layer(
+        core_layers.SquaredLossLayer(name='loss'), needs=['score', 'target'])
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestMicroBatch(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(10, 8, 8, 2)
+        self.target = np.random.randn(10, 5)
+
+    def testMicroBatch(self):
+        decaf_net = small_net(self.data, self.target)
+        loss = decaf_net.forward_backward()
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        for micro_batches in [2, 3, 10, 20]:
+            self.assertAlmostEqual(
+                decaf_net.forward_backward(micro_batches=micro_batches), loss)
+            for param, diff in zip(decaf_net.params(), expected):
+                npt.assert_array_almost_equal(param.diff(), diff)
+        # the intermediate blobs only hold a micro-batch.
+        decaf_net.forward_backward(micro_batches=5)
+        conv_out = base.Net._make_output_name(decaf_net.layers['conv'])
+        self.assertEqual(decaf_net.blobs[conv_out].data().shape[0], 2)
+        self.assertEqual(decaf_net.blobs['data'].data().shape[0], 10)
+
+    def testMicroBatchInputs(self):
+        # run with a dict as the input instead of the data layer.
+        decaf_net = small_net()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        self.assertAlmostEqual(decaf_net.forward_backward(inputs, 4), loss)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+        self.assertRaises(base.DecafError, decaf_net.forward_backward,
+                          {'data': self.data, 'target': self.target[:5]}, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+from decaf.layers.cpp import wrapper
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+class TestOpenMP(unittest.TestCase):
+    """Checks that the results of the parallel kernels do not depend on the
+    number of threads."""
+    def setUp(self):
+        np.random.seed(1701)
+
+    def tearDown(self):
+        wrapper.set_num_threads(None)
+
+    def _run(self, func, outputs, *args):
+        results = []
+        for num_threads in [1, 3, 8]:
+            wrapper.set_num_threads(num_threads)
+            for output in outputs:
+                output.fill(np.nan if output.dtype.kind == 'f' else -1)
+            func(*args)
+            results.append([output.copy() for output in outputs])
+        for result in results[1:]:
+            for actual, expected in zip(result, results[0]):
+                npt.assert_array_equal(actual, expected)
+
+    def testIm2col(self):
+        for dtype in [np.float32, np.float64]:
+            for num in [1, 4]:
+                image = np.random.randn(num, 9, 7, 3).astype(dtype)
+                col = np.empty((num, 5, 4, 27), dtype)
+                self._run(wrapper.im2col_forward, [col],
+                          image, col, 3, 2, 1)
+                col[:] = np.random.randn(*col.shape)
+                self._run(wrapper.im2col_backward, [image],
+                          image, col, 3, 2, 1)
+
+    def testPooling(self):
+        for dtype in [np.float32, np.float64]:
+            for num in [1, 4]:
+                image = np.random.randn(num, 9, 7, 3).astype(dtype)
+                pooled = np.empty((num, 4, 3, 3), dtype)
+                image_diff = np.empty_like(image)
+                pooled_diff = np.random.randn(*pooled.shape).astype(dtype)
+                self._run(wrapper.avepooling_forward, [pooled],
+                          image, pooled, 3, 2)
+                self._run(wrapper.avepooling_backward, [image_diff],
+                          image_diff, pooled_diff, 3, 2)
+                self._run(wrapper.maxpooling_forward, [pooled],
+                          image, pooled, 3, 2)
+                self._run(wrapper.maxpooling_backward, [image_diff],
+                          image, pooled, image_diff, pooled_diff, 3, 2)
+                argmax = np.empty(pooled.shape, np.int16)
+                self._run(wrapper.maxpooling_argmax_forward, [pooled, argmax],
+                          image, pooled, argmax, 3, 2)
+                self._run(wrapper.maxpooling_argmax_backward, [image_diff],
+                          image_diff, pooled_diff, argmax, 3, 2)
+
+    def testReLU(self):
+        data = np.random.randn(100, 1000)
+        output = np.empty_like(data)
+        diff = np.random.randn(*data.shape)
+        bias = np.random.randn(1000)
+        self._run(wrapper.relu_forward, [output], data, output)
+        npt.assert_array_equal(output, np.maximum(data, 0))
+        self._run(wrapper.relu_backward, [diff], output, data, diff)
+        npt.assert_array_equal(diff, data * (output > 0))
+
+        def bias_relu():
+            output[:] = data
+            wrapper.bias_relu_forward(output, bias)
+        self._run(bias_relu, [output])
+        npt.assert_array_equal(output, np.maximum(data + bias, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
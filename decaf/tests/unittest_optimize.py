@@ -0,0 +1,103 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def small_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ReLULayer(name='relu0'),
+        core_layers.PoolingLayer(name='pool', psize=2, mode='max'),
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller(),
+            bias_filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu1'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip1', num_output=10, filler=fillers.GaussianRandFiller(),
+            bias_filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu2'),
+        core_layers.InnerProductLayer(
+            name='ip2', num_output=5, filler=fillers.GaussianRandFiller())],
+        needs='data', provides='score')
+    decaf_net.add_layer(
+        core_layers.SquaredLossLayer(name='loss'), needs=['score', 'target'])
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestOptimize(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+        self.target = np.random.randn(3, 5)
+
+    def testFusedLayers(self):
+        decaf_net = small_net()
+        self.assertEqual(len(decaf_net._fused_layers), 0)
+        decaf_net.optimize()
+        self.assertEqual(decaf_net._fused_layers,
+                         set(['relu0', 'relu1', 'relu2']))
+        self.assertTrue(decaf_net.layers['pool']._fused_relu)
+        self.assertTrue(decaf_net.layers['conv']._fused_relu)
+        self.assertTrue(decaf_net.layers['ip1']._fused_relu)
+        decaf_net.finish(optimize=False)
+        self.assertEqual(len(decaf_net._fused_layers), 0)
+        self.assertFalse(decaf_net.layers['conv']._fused_relu)
+
+    def testFusedPadding(self):
+        decaf_net = base.Net()
+        decaf_net.add_layers([
+            core_layers.PaddingLayer(name='pad', pad=2),
+            core_layers.ConvolutionLayer(
+                name='conv', num_kernels=4, ksize=3, stride=2, mode='same',
+                filler=fillers.GaussianRandFiller(),
+                bias_filler=fillers.GaussianRandFiller()),
+            core_layers.FlattenLayer(name='flatten'),
+            core_layers.InnerProductLayer(
+                name='ip', num_output=5, filler=fillers.GaussianRandFiller())],
+            needs='data', provides='score')
+        decaf_net.add_layer(
+            core_layers.SquaredLossLayer(name='loss'),
+            needs=['score', 'target'])
+        decaf_net.finish()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        decaf_net.optimize()
+        self.assertEqual(decaf_net._fused_layers, set(['pad']))
+        self.assertEqual(decaf_net.layers['conv']._pad_size, 3)
+        loss_fused = decaf_net.forward_backward(inputs)
+        self.assertAlmostEqual(loss, loss_fused)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+        decaf_net.finish(optimize=False)
+        self.assertEqual(decaf_net.layers['conv']._pad_size, 1)
+
+    def testFusedOutputs(self):
+        decaf_net = small_net()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        decaf_net.optimize()
+        loss_fused = decaf_net.forward_backward(inputs)
+        self.assertAlmostEqual(loss, loss_fused)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+
+    def testFusedInplacePredict(self):
+        decaf_net = small_net()
+        inputs = {'data': self.data, 'target': self.target}
+        expected = decaf_net.predict(['score'], **inputs)['score'].copy()
+        decaf_net.finish(inplace=True, optimize=True)
+        decaf_net.plan_memory(keep=['score'])
+        npt.assert_array_almost_equal(
+            decaf_net.predict(['score'], **inputs)['score'], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
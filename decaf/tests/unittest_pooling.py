@@ -46,6 +46,41 @@ class TestPoolingGrad(unittest.TestCase):
                             j*stride:j*stride+psize,
                             c].mean())
 
+    def testArgmaxPooling(self):
+        np.random.seed(1701)
+        input_blob = base.Blob((2,9,9,3), filler=fillers.GaussianRandFiller())
+        top_diff = np.random.randn(2,4,4,3)
+        results = []
+        for argmax in [False, True]:
+            output_blob = base.Blob()
+            layer = core_layers.PoolingLayer(
+                name='pool', psize=3, stride=2, mode='max', argmax=argmax)
+            layer.forward([input_blob], [output_blob])
+            output_blob.init_diff()[:] = top_diff
+            layer.backward([input_blob], [output_blob], True)
+            results.append((output_blob.data().copy(),
+                            input_blob.diff().copy()))
+        np.testing.assert_array_equal(results[0][0], results[1][0])
+        np.testing.assert_array_almost_equal(results[0][1], results[1][1])
+        self.assertEqual(layer._argmax.data().dtype, np.int16)
+        # predict does not keep the mask.
+        layer.predict([input_blob], [output_blob])
+        self.assertFalse(layer._argmax.has_data())
+        np.testing.assert_array_equal(output_blob.data(), results[1][0])
+
+    def testArgmaxPoolingTies(self):
+        input_blob = base.Blob((1,4,4,1), filler=fillers.ConstantFiller(value=1.))
+        output_blob = base.Blob()
+        layer = core_layers.PoolingLayer(
+            name='pool', psize=2, stride=2, mode='max', argmax=True)
+        layer.forward([input_blob], [output_blob])
+        output_blob.init_diff()[:] = 1.
+        layer.backward([input_blob], [output_blob], True)
+        # the gradient goes to the first maximum of every region only.
+        expected = np.zeros((1,4,4,1))
+        expected[0, ::2, ::2] = 1.
+        np.testing.assert_array_equal(input_blob.diff(), expected)
+
 
 if __name__ == '__main__':
     unittest.main()
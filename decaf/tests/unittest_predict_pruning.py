@@ -0,0 +1,56 @@
+from decaf import base
+from decaf.layers import core_layers
+from decaf.tests.unittest_memory_plan import small_net
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+class CountingLayer(core_layers.IdentityLayer):
+    """An identity layer that counts how many times it is run."""
+    def __init__(self, **kwargs):
+        core_layers.IdentityLayer.__init__(self, **kwargs)
+        self.count = 0
+
+    def predict(self, bottom, top):
+        self.count += 1
+        core_layers.IdentityLayer.predict(self, bottom, top)
+
+
+class TestPredictPruning(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+
+    def testPruning(self):
+        decaf_net = small_net()
+        expected = dict((key, value.copy()) for key, value in
+                        decaf_net.predict(data=self.data).iteritems())
+        decaf_net.add_layer(CountingLayer(name='counter'), needs='prob',
+                            provides='prob_copy')
+        decaf_net.finish()
+        result = decaf_net.predict(['score'], data=self.data * 2.)
+        self.assertEqual(decaf_net.layers['counter'].count, 0)
+        # prob should not have been recomputed.
+        npt.assert_array_almost_equal(decaf_net.feature('prob'),
+                                      expected['prob'])
+        result = decaf_net.predict(['score'], data=self.data)
+        npt.assert_array_almost_equal(result['score'], expected['score'])
+        self.assertEqual(len(decaf_net._predict_plans), 1)
+        decaf_net.predict(['prob_copy'], data=self.data)
+        self.assertEqual(decaf_net.layers['counter'].count, 1)
+        self.assertRaises(base.DecafError, decaf_net.predict, ['unknown'],
+                          data=self.data)
+
+    def testPruningInputs(self):
+        decaf_net = small_net()
+        decaf_net.add_layer(core_layers.SquaredLossLayer(name='loss'),
+                            needs=['score', 'target'])
+        decaf_net.finish()
+        # the target is not needed to compute prob.
+        result = decaf_net.predict(['prob'], data=self.data)
+        self.assertEqual(result['prob'].shape, (3, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import threading
+import unittest
+
+
+def worker_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller()),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='data', provides='prob')
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestPredictWorkers(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(7, 8, 8, 2)
+        self.decaf_net = worker_net()
+        self.expected = self.decaf_net.predict(data=self.data)['prob'].copy()
+
+    def testPredictWorkers(self):
+        for workers in [2, 3, 10]:
+            for _ in range(2):
+                npt.assert_array_almost_equal(
+                    self.decaf_net.predict(data=self.data,
+                                           workers=workers)['prob'],
+                    self.expected)
+
+    def testPredictWorkersSingle(self):
+        # a single data point runs on one worker, and the outputs are still
+        # fresh arrays.
+        first = self.decaf_net.predict(data=self.data[:1], workers=3)
+        second = self.decaf_net.predict(data=self.data[:1], workers=3)
+        npt.assert_array_almost_equal(first['prob'], self.expected[:1])
+        self.assertFalse(first['prob'] is second['prob'])
+
+    def testPredictWorkersThreads(self):
+        num_threads = threading.active_count()
+        for _ in range(5):
+            for workers in [2, 3]:
+                npt.assert_array_almost_equal(
+                    self.decaf_net.predict(data=self.data,
+                                           workers=workers)['prob'],
+                    self.expected)
+        # the workers are kept for the largest number of workers.
+        self.assertEqual(threading.active_count(), num_threads + 3)
+        # small batches use fewer of the same workers.
+        npt.assert_array_almost_equal(
+            self.decaf_net.predict(data=self.data[:2], workers=3)['prob'],
+            self.expected[:2])
+        self.assertEqual(threading.active_count(), num_threads + 3)
+        self.decaf_net.close()
+        self.assertEqual(threading.active_count(), num_threads)
+
+    def testPredictWorkersOutputs(self):
+        flatten_name = self.decaf_net.provides['flatten'][0]
+        expected = self.decaf_net.predict(
+            [flatten_name], data=self.data)[flatten_name].copy()
+        for _ in range(2):
+            output = self.decaf_net.predict(
+                [flatten_name, 'prob'], data=self.data, workers=3)
+            npt.assert_array_almost_equal(output[flatten_name], expected)
+            npt.assert_array_almost_equal(output['prob'], self.expected)
+        # the outputs are fresh arrays every time.
+        again = self.decaf_net.predict('prob', data=self.data, workers=3)
+        self.assertFalse(again['prob'] is output['prob'])
+
+    def testPredictWorkersBatchMismatch(self):
+        decaf_net = base.Net()
+        decaf_net.add_layer(core_layers.ReLULayer(name='relu_a'),
+                            needs='a', provides='a_out')
+        decaf_net.add_layer(core_layers.ReLULayer(name='relu_b'),
+                            needs='b', provides='b_out')
+        decaf_net.finish()
+        self.assertRaises(base.DecafError, decaf_net.predict,
+                          a=np.ones((4, 2)), b=np.ones((3, 2)), workers=2)
+        output = decaf_net.predict(a=np.ones((4, 2)), b=-np.ones((4, 2)),
+                                   workers=2)
+        npt.assert_array_equal(output['a_out'], 1.)
+        npt.assert_array_equal(output['b_out'], 0.)
+
+if __name__ == '__main__':
+    unittest.main()
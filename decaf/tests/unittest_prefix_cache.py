@@ -0,0 +1,205 @@
+from decaf import base, puff
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import os
+import tempfile
+import unittest
+
+
+def data_layers(images, labels, minibatch=4):
+    return [core_layers.NdarrayDataLayer(name='source',
+                                         sources=[images, labels]),
+            core_layers.BasicMinibatchLayer(name='sampler',
+                                            minibatch=minibatch)]
+
+
+def add_suffix(decaf_net, needs):
+    decaf_net.add_layers([
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=3, filler=fillers.GaussianRandFiller())],
+        needs=needs, provides='pred')
+    decaf_net.add_layer(core_layers.MultinomialLogisticLossLayer(name='loss'),
+                        needs=['pred', 'label'])
+
+
+def prefix_net(images, labels):
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    source, sampler = data_layers(images, labels)
+    decaf_net.add_layer(source, provides=['all_images', 'all_labels'])
+    decaf_net.add_layer(sampler, needs=['all_images', 'all_labels'],
+                        provides=['images', 'label'])
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller(), freeze=True),
+        core_layers.ReLULayer(name='relu')],
+        needs='images', provides='features')
+    add_suffix(decaf_net, 'features')
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestPrefixCache(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.images = np.random.randn(10, 6, 6, 2)
+        self.labels = np.random.randint(3, size=10)
+        self.filename = tempfile.mktemp()
+
+    def tearDown(self):
+        for suffix in ['.puff', '.icing']:
+            for name in ['features', 'conv_out']:
+                filename = '%s_%s%s' % (self.filename, name, suffix)
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def run_net(self, decaf_net, iterations, previous_net=None):
+        losses, grads = [], []
+        for _ in range(iterations):
+            losses.append(decaf_net.forward_backward(previous_net))
+            grads.append(decaf_net.layers['ip'].param()[0].diff().copy())
+        return losses, grads
+
+    def testPrefixCache(self):
+        expected = self.run_net(prefix_net(self.images, self.labels), 10)
+        decaf_net = prefix_net(self.images, self.labels)
+        decaf_net.enable_prefix_cache(self.filename)
+        self.assertEqual(decaf_net._prefix_plan[3], ['features'])
+        losses, grads = self.run_net(decaf_net, 3)
+        params = [param.data().copy()
+                  for param in decaf_net.layers['conv'].param()]
+        # once a pass over the data is done, the prefix is no longer run.
+        decaf_net.layers['conv'].param()[0].data()[:] = 0.
+        more_losses, more_grads = self.run_net(decaf_net, 7)
+        npt.assert_array_almost_equal(losses + more_losses, expected[0])
+        npt.assert_array_almost_equal(grads + more_grads, expected[1])
+        decaf_net.disable_prefix_cache()
+        features = base.Puff('%s_features' % self.filename).read_all()
+        self.assertEqual(features.shape, (10, 6, 6, 4))
+        # the cache is reused by a new net with the same prefix.
+        decaf_net = prefix_net(self.images, self.labels)
+        for param, data in zip(decaf_net.layers['conv'].param(), params):
+            param.mirror(data.copy())
+        decaf_net.enable_prefix_cache(self.filename)
+        self.run_net(decaf_net, 10)
+        npt.assert_array_almost_equal(decaf_net.blobs['features'].data(),
+                                      features[6:])
+        conv_out = decaf_net.provides['conv'][0]
+        self.assertFalse(decaf_net.blobs[conv_out].has_data())
+        decaf_net.disable_prefix_cache()
+        # a net with other prefix weights discards the cache.
+        decaf_net = prefix_net(self.images, self.labels)
+        for param, data in zip(decaf_net.layers['conv'].param(), params):
+            param.mirror(data * 2.)
+        decaf_net.enable_prefix_cache(self.filename)
+        self.run_net(decaf_net, 3)
+        decaf_net.disable_prefix_cache()
+        npt.assert_array_almost_equal(
+            base.Puff('%s_features' % self.filename).read_all(),
+            features * 2.)
+
+    def testPrefixCacheSkipsData(self):
+        # once the features are cached, the sampler only copies the labels.
+        decaf_net = prefix_net(self.images, self.labels)
+        decaf_net.enable_prefix_cache(self.filename)
+        self.run_net(decaf_net, 3)
+        images = decaf_net.blobs['images'].data().copy()
+        labels = decaf_net.blobs['label'].data().copy()
+        decaf_net.forward_backward()
+        npt.assert_array_equal(decaf_net.blobs['images'].data(), images)
+        self.assertFalse(np.array_equal(decaf_net.blobs['label'].data(),
+                                        labels))
+        npt.assert_array_equal(decaf_net.blobs['label'].data(),
+                               self.labels[[2, 3, 4, 5]])
+        decaf_net.disable_prefix_cache()
+
+    def testPrefixCachePreviousNet(self):
+        def nets():
+            np.random.seed(1701)
+            previous_net = base.Net()
+            source, sampler = data_layers(self.images, self.labels)
+            previous_net.add_layer(source,
+                                   provides=['all_images', 'all_labels'])
+            previous_net.add_layer(sampler, needs=['all_images', 'all_labels'],
+                                   provides=['images', 'unused_label'])
+            previous_net.add_layer(core_layers.ConvolutionLayer(
+                name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+                filler=fillers.GaussianRandFiller()),
+                needs='images', provides='conv_out')
+            previous_net.finish()
+            decaf_net = base.Net()
+            source, sampler = data_layers(self.images, self.labels)
+            decaf_net.add_layer(source, provides=['all_images', 'all_labels'])
+            decaf_net.add_layer(sampler, needs=['all_images', 'all_labels'],
+                                provides=['unused_images', 'label'])
+            add_suffix(decaf_net, 'conv_out')
+            decaf_net.finish()
+            return previous_net, decaf_net
+        previous_net, decaf_net = nets()
+        expected = self.run_net(decaf_net, 6, previous_net)
+        previous_net, decaf_net = nets()
+        decaf_net.enable_prefix_cache(self.filename)
+        losses, grads = self.run_net(decaf_net, 3, previous_net)
+        previous_net.layers['conv'].param()[0].data()[:] = 0.
+        more_losses, more_grads = self.run_net(decaf_net, 3, previous_net)
+        npt.assert_array_almost_equal(losses + more_losses, expected[0])
+        npt.assert_array_almost_equal(grads + more_grads, expected[1])
+        decaf_net.disable_prefix_cache()
+
+    def testPuffSamplerTops(self):
+        names = [self.filename + '_features', self.filename + '_conv_out']
+        puff.write_puff(self.images, names[0])
+        puff.write_puff(self.labels, names[1])
+        sampler = core_layers.PuffSamplerLayer(
+            name='sampler', minibatch=4, puff=[name + '.puff'
+                                               for name in names])
+        top = [base.Blob(), base.Blob()]
+        for start in [0, 4, 8, 2]:
+            sampler.forward_tops([], top, [1])
+            indices = np.arange(start, start + 4) % 10
+            npt.assert_array_equal(sampler.data_indices(), indices)
+            npt.assert_array_equal(top[1].data(), self.labels[indices])
+            if start == 4:
+                self.assertFalse(top[0].has_data())
+                sampler.fill_tops([], top, [0])
+                npt.assert_array_equal(top[0].data(), self.images[indices])
+
+    def testIndexedPuff(self):
+        puff = base.IndexedPuff(self.filename + '_features')
+        puff.check_key('a')
+        data = np.random.randn(6, 2, 3)
+        self.assertFalse(puff.contains([]))
+        puff.write([4, 5, 0], data[:3])
+        self.assertTrue(puff.contains([0, 4]))
+        self.assertFalse(puff.contains([0, 1]))
+        self.assertFalse(puff.contains([7]))
+        puff.write([1, 2, 3], data[3:])
+        npt.assert_array_equal(puff.read([3, 4, 5, 0]),
+                               data[[5, 0, 1, 2]])
+        self.assertRaises(TypeError, puff.write, [6], data[:1, :1])
+        self.assertTrue(puff.contains([]))
+        self.assertEqual(puff.read([]).shape, (0, 2, 3))
+        puff.close()
+        npt.assert_array_equal(
+            base.Puff(self.filename + '_features').read_all(),
+            data[[2, 3, 4, 5, 0, 1]])
+        # the data is kept for the same key, and discarded for another one.
+        puff = base.IndexedPuff(self.filename + '_features')
+        puff.check_key('a')
+        self.assertTrue(puff.contains([0, 5]))
+        puff.check_key('b')
+        self.assertFalse(puff.contains([0]))
+        self.assertFalse(puff.contains([]))
+        puff.write([1], data[:1])
+        puff.close()
+        puff = base.IndexedPuff(self.filename + '_features')
+        self.assertFalse(puff.contains([0]))
+        npt.assert_array_equal(puff.read([1]), data[:1])
+        puff.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+from decaf.layers.cpp import wrapper
+from decaf.util import blasdot, quantize
+import numpy as np
+import numpy.testing as npt
+import os
+import tempfile
+import unittest
+
+
+def quantize_net(data):
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=8, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller(std=0.1)),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.PoolingLayer(name='pool', psize=2, stride=2, mode='max'),
+        core_layers.GroupConvolutionLayer(
+            name='gconv', group=2, num_kernels=4, ksize=3, stride=1,
+            mode='same', filler=fillers.GaussianRandFiller(std=0.1)),
+        core_layers.ReLULayer(name='relu2'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=10,
+            filler=fillers.GaussianRandFiller(std=0.1)),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='data', provides='prob')
+    decaf_net.finish()
+    decaf_net.predict(data=data)
+    return decaf_net
+
+
+class TestQuantize(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.rand(20, 8, 8, 3).astype(np.float32)
+
+    def testInt8Gemm(self):
+        A = np.random.randint(-127, 128, size=(7, 33)).astype(np.int8)
+        B = np.random.randint(-127, 128, size=(5, 33)).astype(np.int8)
+        B_scale = np.random.rand(5).astype(np.float32)
+        C = np.empty((7, 5), np.float32)
+        wrapper.int8_gemm(A, B, B_scale, C, 0.5)
+        expected = np.dot(A.astype(np.int64), B.T.astype(np.int64))
+        npt.assert_array_almost_equal(C, expected * 0.5 * B_scale, 2)
+
+    def testQuantizeInt8(self):
+        data = np.random.randn(1000, 7).astype(np.float32) * 50
+        expected = np.clip(np.rint(data / 0.5), -127, 127).astype(np.int8)
+        output = np.empty(data.shape, np.int8)
+        for num_threads in [1, 4]:
+            wrapper.set_num_threads(num_threads)
+            try:
+                output.fill(0)
+                wrapper.quantize_int8(data, output, 0.5)
+            finally:
+                wrapper.set_num_threads(None)
+            npt.assert_array_equal(output, expected)
+
+    def testDotLastdimQuantized(self):
+        A = np.random.randn(4, 3, 50).astype(np.float32)
+        W = np.random.randn(50, 6).astype(np.float32)
+        B, B_scale = quantize.quantize_weights(W)
+        self.assertEqual(B.shape, (6, 50))
+        self.assertEqual(B.dtype, np.int8)
+        npt.assert_array_almost_equal(B.T * B_scale, W, 1)
+        expected = blasdot.dot_lastdim(A, W)
+        result = blasdot.dot_lastdim_quantized(A, B, B_scale)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertTrue(np.abs(result - expected).max() <
+                        0.05 * np.abs(expected).max())
+
+    def testQuantizeNet(self):
+        float_net = quantize_net(self.data)
+        expected = float_net.predict(data=self.data)['prob'].copy()
+        decaf_net = quantize_net(self.data)
+        quantized = quantize.quantize_net(decaf_net, self.data)
+        self.assertEqual(quantized, ['conv', 'gconv', 'ip'])
+        self.assertTrue(any(param.data().dtype == np.int8
+                            for param in decaf_net.params()))
+        self.assertTrue(quantize.param_bytes(decaf_net) <
+                        quantize.param_bytes(float_net) / 2)
+        prob = decaf_net.predict(data=self.data)['prob']
+        npt.assert_array_almost_equal(prob, expected, 2)
+        # the quantized net can be saved and loaded.
+        filename = tempfile.mktemp('.decafnet')
+        decaf_net.save(filename)
+        loaded = base.Net.load(filename, mmap=True)
+        npt.assert_array_almost_equal(
+            loaded.predict(data=self.data)['prob'], prob)
+        os.remove(filename)
+        # the report compares the quantized net against the float net.
+        labels = expected.argmax(axis=1)
+        report = quantize.compare(float_net, decaf_net, self.data, 'prob',
+                                  labels=labels, repeat=1)
+        self.assertEqual(report['float_top1_accuracy'], 1.)
+        self.assertTrue(report['top1_agreement'] > 0.8)
+        self.assertTrue(isinstance(quantize.format_report(report), str))
+
+    def testQuantizedBackward(self):
+        decaf_net = quantize_net(self.data)
+        quantize.quantize_net(decaf_net)
+        layer = decaf_net.layers['ip']
+        self.assertRaises(base.DecafError, layer.backward, [], [], True)
+
+
+if __name__ == '__main__':
+    unittest.main()
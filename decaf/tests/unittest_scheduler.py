@@ -0,0 +1,111 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+from decaf.util.scheduler import DAGScheduler
+import numpy as np
+import numpy.testing as npt
+import threading
+import unittest
+
+
+def two_tower_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    for tower in ['a', 'b']:
+        decaf_net.add_layers([
+            core_layers.ConvolutionLayer(
+                name='conv_' + tower, num_kernels=4, ksize=3, stride=1,
+                mode='same', filler=fillers.GaussianRandFiller()),
+            core_layers.ReLULayer(name='relu_' + tower),
+            core_layers.FlattenLayer(name='flatten_' + tower),
+            core_layers.InnerProductLayer(
+                name='ip_' + tower, num_output=5,
+                filler=fillers.GaussianRandFiller())],
+            needs='data', provides='score_' + tower)
+        decaf_net.add_layer(
+            core_layers.SquaredLossLayer(name='loss_' + tower),
+            needs=['score_' + tower, 'target'])
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestDAGScheduler(unittest.TestCase):
+    def testOrder(self):
+        finished = []
+        lock = threading.Lock()
+        def task(idx):
+            with lock:
+                finished.append(idx)
+            return idx * 2
+        deps = [[], [0], [0], [1, 2], []]
+        scheduler = DAGScheduler(3)
+        results = scheduler.run([(task, (i,)) for i in range(5)], deps)
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        for idx, dep in enumerate(deps):
+            for parent in dep:
+                self.assertLess(finished.index(parent), finished.index(idx))
+
+    def testError(self):
+        def task(idx):
+            if idx == 1:
+                raise ValueError('error')
+            return idx
+        scheduler = DAGScheduler(2)
+        self.assertRaises(ValueError, scheduler.run,
+                          [(task, (i,)) for i in range(3)], [[], [0], [1]])
+        # make sure that the scheduler is still usable.
+        self.assertEqual(scheduler.run([(task, (0,))], [[]]), [0])
+
+    def testClose(self):
+        num_threads = threading.active_count()
+        scheduler = DAGScheduler(3)
+        self.assertEqual(scheduler.run([(abs, (-1,))], [[]]), [1])
+        self.assertEqual(threading.active_count(), num_threads + 3)
+        scheduler.close()
+        self.assertEqual(threading.active_count(), num_threads)
+        # the threads are restarted when needed.
+        self.assertEqual(scheduler.run([(abs, (-2,))], [[]]), [2])
+        scheduler.close()
+        # replacing the scheduler of a net stops its threads.
+        decaf_net = two_tower_net()
+        for _ in range(3):
+            decaf_net.set_num_threads(2)
+            decaf_net._scheduler.run([(abs, (-1,))], [[]])
+        self.assertEqual(threading.active_count(), num_threads + 2)
+        decaf_net.close()
+        self.assertEqual(threading.active_count(), num_threads)
+
+
+class TestParallelNet(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+        self.target = np.random.randn(3, 5)
+
+    def testForwardBackward(self):
+        decaf_net = two_tower_net()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        decaf_net.set_num_threads(4)
+        for _ in range(3):
+            self.assertAlmostEqual(decaf_net.forward_backward(inputs), loss)
+            for param, diff in zip(decaf_net.params(), expected):
+                npt.assert_array_almost_equal(param.diff(), diff)
+
+    def testPredictWithMemoryPlan(self):
+        decaf_net = two_tower_net()
+        inputs = {'data': self.data, 'target': self.target}
+        outputs = ['score_a', 'score_b']
+        expected = dict((key, value.copy()) for key, value in
+                        decaf_net.predict(outputs, **inputs).iteritems())
+        decaf_net.finish(inplace=True, optimize=True)
+        decaf_net.plan_memory(keep=outputs)
+        decaf_net.set_num_threads(4)
+        for _ in range(3):
+            result = decaf_net.predict(outputs, **inputs)
+            for key in outputs:
+                npt.assert_array_almost_equal(result[key], expected[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def shape_net():
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=8, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.PoolingLayer(name='pool', psize=3, stride=2, mode='max'),
+        core_layers.LocalResponseNormalizeLayer(
+            name='lrn', k=1., alpha=0.1, beta=0.75, size=3),
+        core_layers.GroupConvolutionLayer(
+            name='gconv', group=2, num_kernels=3, ksize=3, stride=2,
+            mode='valid', filler=fillers.GaussianRandFiller()),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller()),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='data', provides='prob')
+    return decaf_net
+
+
+class TestShapeInference(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(4, 16, 16, 2).astype(np.float32)
+
+    def testInferShapes(self):
+        for inplace, optimize in [(False, False), (True, False),
+                                  (False, True)]:
+            decaf_net = shape_net()
+            decaf_net.finish(inplace=inplace, optimize=optimize,
+                             input_shapes={'data': self.data.shape})
+            shapes = decaf_net.blob_shapes()
+            self.assertEqual(shapes['prob'], ((4, 5), np.float32))
+            # all the parameters are allocated before the first pass.
+            for param in decaf_net.params():
+                self.assertTrue(param.has_data())
+            addresses = dict((name, blob.data().ctypes.data)
+                             for name, blob in decaf_net.blobs.iteritems()
+                             if name != 'data')
+            decaf_net.predict(data=self.data)
+            for name, blob in decaf_net.blobs.iteritems():
+                self.assertEqual(blob.data().shape, shapes[name][0])
+                self.assertEqual(blob.data().dtype, shapes[name][1])
+                if name in addresses:
+                    # the pass did not reallocate any blob.
+                    self.assertEqual(blob.data().ctypes.data,
+                                     addresses[name])
+
+    def testCostTable(self):
+        decaf_net = shape_net()
+        self.assertRaises(base.DecafError, decaf_net.cost_table)
+        decaf_net.finish(input_shapes={'data': (self.data.shape, np.float64)})
+        table = dict((row['name'], row) for row in decaf_net.cost_table())
+        self.assertEqual(table['conv']['output_shapes'], [(4, 16, 16, 8)])
+        self.assertEqual(table['conv']['flops'],
+                         2 * 4 * 16 * 16 * 8 * 3 * 3 * 2 + 4 * 16 * 16 * 8)
+        self.assertEqual(table['conv']['param_bytes'], (3 * 3 * 2 + 1) * 8 * 8)
+        self.assertEqual(table['pool']['output_shapes'], [(4, 8, 8, 8)])
+        self.assertEqual(table['gconv']['output_shapes'], [(4, 3, 3, 6)])
+        self.assertEqual(table['ip']['flops'], 2 * 4 * 5 * 54 + 4 * 5)
+        self.assertEqual(table['flatten']['activation_bytes'], 0)
+        self.assertEqual(table['flatten']['flops'], 0)
+        self.assertEqual(table['softmax']['activation_bytes'], 4 * 5 * 8)
+        # re-finishing keeps the shapes, and an empty dict disables them.
+        decaf_net.finish()
+        self.assertEqual(len(decaf_net.cost_table()), len(table))
+        decaf_net.finish(input_shapes={})
+        self.assertRaises(base.DecafError, decaf_net.cost_table)
+
+    def testInferShapesDataLayer(self):
+        labels = np.random.randint(5, size=4)
+        decaf_net = base.Net()
+        decaf_net.add_layer(core_layers.NdarrayDataLayer(
+            name='input', sources=[self.data, labels]),
+            provides=['data', 'label'])
+        decaf_net.add_layers([
+            core_layers.FlattenLayer(name='flatten'),
+            core_layers.InnerProductLayer(
+                name='ip', num_output=5, filler=fillers.GaussianRandFiller())],
+            needs='data', provides='pred')
+        decaf_net.add_layer(core_layers.MultinomialLogisticLossLayer(
+            name='loss'), needs=['pred', 'label'])
+        decaf_net.finish(input_shapes={})
+        decaf_net.finish(input_shapes={})
+        decaf_net.finish(input_shapes={'label': ((4,), labels.dtype)})
+        shapes = decaf_net.blob_shapes()
+        self.assertEqual(shapes['data'], ((4, 16, 16, 2), np.float32))
+        self.assertEqual(shapes['pred'], ((4, 5), np.float32))
+        self.assertEqual(decaf_net.cost_table()[-1]['flops'], 2 * 4 * 5)
+        decaf_net.forward_backward()
+
+    def testInferShapesSampler(self):
+        # the data layers infer their shapes without producing any data.
+        labels = np.random.randint(5, size=4)
+        decaf_net = base.Net()
+        decaf_net.add_layer(core_layers.NdarrayDataLayer(
+            name='input', sources=[self.data, labels]),
+            provides=['all_data', 'all_label'])
+        sampler = core_layers.BasicMinibatchLayer(
+            name='sampler', minibatch=3, dtype=np.float64)
+        decaf_net.add_layer(sampler, needs=['all_data', 'all_label'],
+                            provides=['data', 'label'])
+        decaf_net.finish(input_shapes={'all_label': ((4,), labels.dtype)})
+        shapes = decaf_net.blob_shapes()
+        self.assertEqual(shapes['data'], ((3, 16, 16, 2), np.float64))
+        self.assertEqual(shapes['label'], ((3,), labels.dtype))
+        self.assertEqual(sampler._index, 0)
+        self.assertTrue(sampler.data_indices() is None)
+
+    def testInferShapesUnknownDataLayer(self):
+        decaf_net = base.Net()
+        decaf_net.add_layer(base.DataLayer(name='input'),
+                            provides=['data', 'label'])
+        decaf_net.add_layer(core_layers.FlattenLayer(name='flatten'),
+                            needs='data', provides='flat')
+        self.assertRaises(base.InvalidNetError, decaf_net.finish,
+                          input_shapes={'label': (4,)})
+        decaf_net.finish(input_shapes={'label': (4,),
+                                       'data': self.data.shape})
+        self.assertEqual(decaf_net.blob_shapes()['flat'],
+                         ((4, 512), np.float32))
+
+    def testInferShapesMissingInput(self):
+        decaf_net = shape_net()
+        self.assertRaises(base.InvalidNetError, decaf_net.finish,
+                          input_shapes={'label': (4,)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import unittest
+
+
+def simplify_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layer(core_layers.IdentityLayer(name='identity'),
+                        needs='data', provides='data_copy')
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu'),
+        core_layers.DropoutLayer(name='dropout', ratio=0.5),
+        core_layers.PoolingLayer(name='pool', psize=2, mode='max'),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller()),
+        core_layers.SoftmaxLayer(name='softmax')],
+        needs='data_copy', provides='prob')
+    # a second head reading the convolution output creates a split.
+    decaf_net.add_layers([
+        core_layers.FlattenLayer(name='flatten2'),
+        core_layers.InnerProductLayer(
+            name='ip2', num_output=3, filler=fillers.GaussianRandFiller())],
+        needs='_decaf_conv_out', provides='score')
+    decaf_net.add_layer(core_layers.IdentityLayer(name='identity2'),
+                        needs='score', provides='score_copy')
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestSimplify(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+
+    def testSimplify(self):
+        decaf_net = simplify_net()
+        expected = dict((name, arr.copy()) for name, arr in
+                        decaf_net.predict(data=self.data).iteritems())
+        num_layers = len(decaf_net._forward_order)
+        for inplace, optimize in [(False, False), (True, False),
+                                  (False, True), (True, True)]:
+            decaf_net.finish(inplace=inplace, optimize=optimize,
+                             simplify=True)
+            types = [type(layer) for _, layer, _, _
+                     in decaf_net._forward_order]
+            for removed in [base.SplitLayer, core_layers.DropoutLayer,
+                            core_layers.FlattenLayer]:
+                self.assertFalse(removed in types)
+            # the identity producing an output blob is kept.
+            self.assertEqual(types.count(core_layers.IdentityLayer), 1)
+            self.assertTrue(len(types) <= num_layers - 5)
+            output = decaf_net.predict(data=self.data)
+            for name in expected:
+                npt.assert_array_almost_equal(output[name], expected[name])
+            self.assertRaises(base.DecafError, decaf_net.forward_backward)
+        decaf_net.finish(inplace=False, optimize=False, simplify=False)
+        self.assertEqual(len(decaf_net._forward_order), num_layers)
+        output = decaf_net.predict(data=self.data)
+        for name in expected:
+            npt.assert_array_almost_equal(output[name], expected[name])
+
+    def testSimplifyKeep(self):
+        decaf_net = simplify_net()
+        decaf_net.plan_memory(keep=['_decaf_flatten_out'])
+        decaf_net.simplify()
+        self.assertTrue('flatten' not in decaf_net._simplified_layers)
+        self.assertTrue('flatten2' in decaf_net._simplified_layers)
+        decaf_net.predict(data=self.data)
+        self.assertEqual(decaf_net.feature('_decaf_flatten_out').shape,
+                         (3, 64))
+
+
+if __name__ == '__main__':
+    unittest.main()
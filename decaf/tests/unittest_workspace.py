@@ -0,0 +1,117 @@
+from decaf import base
+from decaf.layers import core_layers, fillers
+import numpy as np
+import numpy.testing as npt
+import threading
+import unittest
+
+
+def conv_net():
+    np.random.seed(1701)
+    decaf_net = base.Net()
+    decaf_net.add_layers([
+        core_layers.ConvolutionLayer(
+            name='conv1', num_kernels=4, ksize=3, stride=1, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu1'),
+        core_layers.GroupConvolutionLayer(
+            name='conv2', group=2, num_kernels=3, ksize=3, stride=1,
+            mode='same', filler=fillers.GaussianRandFiller()),
+        core_layers.ReLULayer(name='relu2'),
+        core_layers.DeconvolutionLayer(
+            name='deconv', num_channels=2, ksize=3, stride=2, mode='same',
+            filler=fillers.GaussianRandFiller()),
+        core_layers.FlattenLayer(name='flatten'),
+        core_layers.InnerProductLayer(
+            name='ip', num_output=5, filler=fillers.GaussianRandFiller())],
+        needs='data', provides='score')
+    decaf_net.add_layer(
+        core_layers.SquaredLossLayer(name='loss'), needs=['score', 'target'])
+    decaf_net.finish()
+    return decaf_net
+
+
+class TestWorkspace(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1701)
+        self.data = np.random.randn(3, 8, 8, 2)
+        self.target = np.random.randn(3, 5)
+
+    def testFrames(self):
+        workspace = base.Workspace()
+        self.assertRaises(RuntimeError, workspace.array, (2, 3), np.float64)
+        for grown in [False, True]:
+            with workspace.frame():
+                outer = workspace.array((10, 3), np.float64)
+                outer[:] = 1.
+                with workspace.frame():
+                    inner = workspace.array((5,), np.float32)
+                    inner[:] = 2.
+                    if grown:
+                        self.assertEqual(inner.ctypes.data % 64, 0)
+                with workspace.frame():
+                    reused = workspace.array((5,), np.float32)
+                if grown:
+                    # the inner frame was released, so its memory is reused.
+                    self.assertEqual(reused.ctypes.data, inner.ctypes.data)
+                npt.assert_array_equal(outer, 1.)
+        # the workspace grew to the peak usage after the first pass.
+        self.assertEqual(workspace.nbytes(),
+                         256 + 20 + base.Workspace.ALIGNMENT)
+        workspace.clear()
+        self.assertEqual(workspace.nbytes(), 0)
+
+    def testThreads(self):
+        workspace = base.Workspace()
+        addresses = []
+        def request():
+            for _ in range(2):
+                with workspace.frame():
+                    addresses.append(
+                        workspace.array((100,), np.float64).ctypes.data)
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertNotEqual(addresses[1], addresses[3])
+        self.assertEqual(workspace.nbytes(),
+                         2 * (800 + base.Workspace.ALIGNMENT))
+
+    def testSharedWorkspace(self):
+        decaf_net = conv_net()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        shared = decaf_net.workspace_usage()
+        self.assertTrue(shared > 0)
+        # with a workspace per layer, the scratch memory adds up.
+        workspaces = {}
+        for name, layer in decaf_net.layers.iteritems():
+            workspaces[name] = base.Workspace()
+            layer.set_workspace(workspaces[name])
+        self.assertAlmostEqual(decaf_net.forward_backward(inputs), loss)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+        sizes = [workspace.nbytes() for workspace in workspaces.values()]
+        self.assertEqual(shared, max(sizes))
+        self.assertTrue(sum(sizes) > shared)
+        # finishing the net shares its workspace again.
+        decaf_net.finish()
+        self.assertTrue(decaf_net.layers['conv2']._conv_layers[1].workspace()
+                        is decaf_net._workspace)
+
+    def testFusedGroupConvolution(self):
+        decaf_net = conv_net()
+        inputs = {'data': self.data, 'target': self.target}
+        loss = decaf_net.forward_backward(inputs)
+        expected = [param.diff().copy() for param in decaf_net.params()]
+        decaf_net.finish(inplace=True, optimize=True)
+        self.assertTrue('relu2' in decaf_net._fused_layers)
+        self.assertAlmostEqual(decaf_net.forward_backward(inputs), loss)
+        for param, diff in zip(decaf_net.params(), expected):
+            npt.assert_array_almost_equal(param.diff(), diff)
+
+
+if __name__ == '__main__':
+    unittest.main()
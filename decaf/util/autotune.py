@@ -0,0 +1,124 @@
+"""Implements the persistent cache of the convolution autotuner.
+
+A ConvolutionLayer with engine='auto' times its candidate algorithms on the
+first forward pass for every new input shape, and picks the fastest one (see
+decaf.layers.convolution). The decisions are keyed by the machine and the
+shape. By default they are only kept in memory; to store them in a json file,
+so that later processes on the same kind of machine start with the tuned
+choice, set the DECAF_AUTOTUNE_CACHE environment variable or call
+set_cache_file().
+"""
+
+from decaf.layers.cpp import wrapper
+from decaf.util import blasdot
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+
+_CACHE_ENV = 'DECAF_AUTOTUNE_CACHE'
+_DEFAULT_CACHE = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+
+def _cpu_model():
+    """Returns the cpu model name, falling back to the processor type."""
+    try:
+        with open('/proc/cpuinfo') as fid:
+            for line in fid:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_key():
+    """Returns a string that identifies the machine the timings are valid
+    for: the cpu model and the numbers of BLAS and OpenMP threads.
+    """
+    return '%s|blas=%s|omp=%d' % (_cpu_model(),
+                                  blasdot.get_blas_num_threads(),
+                                  wrapper.get_num_threads())
+
+
+class AutotuneCache(object):
+    """AutotuneCache holds the tuned decisions in memory and in a json file.
+    The file is re-read before every write, so several processes can share
+    it; concurrent writers may lose an entry, which only costs a retune.
+    """
+    def __init__(self, filename=None):
+        """Initializes the cache.
+
+        Input:
+            filename: the json file, or None to keep the decisions in memory
+                only.
+        """
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self):
+        """Reads the entries of the file, ignoring a missing or broken file.
+        """
+        if self._filename is None or not os.path.exists(self._filename):
+            return {}
+        try:
+            with open(self._filename) as fid:
+                return json.load(fid)
+        except (IOError, ValueError) as error:
+            logging.warning('Ignoring the autotune cache %s: %s',
+                            self._filename, error)
+            return {}
+
+    def get(self, key):
+        """Returns the decision stored for the key, or None."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, value):
+        """Stores a json-serializable decision for the key, and writes the
+        file."""
+        with self._lock:
+            self._entries[key] = value
+            if self._filename is None:
+                return
+            entries = self._read()
+            entries.update(self._entries)
+            self._entries = entries
+            try:
+                dirname = os.path.dirname(os.path.abspath(self._filename))
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                # write to a temporary file first, so that readers never see
+                # a partial file.
+                fd, tmpname = tempfile.mkstemp(dir=dirname)
+                with os.fdopen(fd, 'w') as fid:
+                    json.dump(entries, fid, indent=1, sort_keys=True)
+                os.rename(tmpname, self._filename)
+            except (IOError, OSError) as error:
+                logging.warning('Unable to write the autotune cache %s: %s',
+                                self._filename, error)
+
+
+def set_cache_file(filename):
+    """Sets the file of the default cache. Pass None to keep the decisions
+    in memory only.
+    """
+    global _DEFAULT_CACHE
+    with _DEFAULT_CACHE_LOCK:
+        _DEFAULT_CACHE = AutotuneCache(filename)
+
+
+def default_cache():
+    """Returns the cache used by the layers, creating it on first use. The
+    cache is written to the file named by DECAF_AUTOTUNE_CACHE if it is set,
+    and kept in memory otherwise.
+    """
+    global _DEFAULT_CACHE
+    with _DEFAULT_CACHE_LOCK:
+        if _DEFAULT_CACHE is None:
+            _DEFAULT_CACHE = AutotuneCache(os.environ.get(_CACHE_ENV))
+        return _DEFAULT_CACHE
@@ -1,7 +1,11 @@
 # pylint: disable=C0103
 """Efficient dot functions by calling the basic blas functions from scipy."""
 
+import contextlib
+import ctypes as ct
+import logging
 import numpy as np
+import threading
 
 # import submodules that implements the blas functions
 import _numpy_blasdot
@@ -11,6 +15,19 @@ try:
 except OSError as err:
     _HAS_GPU = False
 
+# The dtype combinations we have warned about, so each is only reported once.
+_WARNED_DTYPES = set()
+
+# The (setter, getter, local setter) functions of the number of threads of
+# the loaded BLAS libraries, found lazily by _blas_thread_functions().
+_BLAS_THREAD_FUNCTIONS = None
+
+# The number of blocks running in single_threaded_blas(), and the numbers of
+# threads to restore when the last of them exits, for the libraries without a
+# per-thread setting.
+_SINGLE_THREADED = [0, []]
+_SINGLE_THREADED_LOCK = threading.Lock()
+
 # The default backend would be the numpy blasdot.
 _gemm_f_contiguous = _numpy_blasdot._gemm_f_contiguous
 _gemm_c_contiguous = _numpy_blasdot._gemm_c_contiguous
@@ -37,6 +54,117 @@ def switch_backend(mode):
         raise ValueError('Unknown mode: %s' % mode)
 
 
+def _blas_thread_functions():
+    """Finds the BLAS libraries loaded by numpy and scipy that let us control
+    their number of threads (OpenBLAS and MKL), and returns a list of their
+    (setter, getter, local setter) functions. The local setter changes the
+    number of threads of the calling thread only, and is None if the library
+    does not have one.
+    """
+    global _BLAS_THREAD_FUNCTIONS
+    if _BLAS_THREAD_FUNCTIONS is not None:
+        return _BLAS_THREAD_FUNCTIONS
+    _BLAS_THREAD_FUNCTIONS = []
+    try:
+        with open('/proc/self/maps') as fid:
+            paths = set(line.split()[-1] for line in fid
+                        if '.so' in line and ('blas' in line or 'mkl' in line))
+    except IOError:
+        # not on linux; we do not know which libraries are loaded.
+        return _BLAS_THREAD_FUNCTIONS
+    for path in sorted(paths):
+        try:
+            library = ct.CDLL(path)
+        except OSError:
+            continue
+        for setter, getter, local_setter in [
+                ('openblas_set_num_threads', 'openblas_get_num_threads',
+                 'openblas_set_num_threads_local'),
+                ('MKL_Set_Num_Threads', 'MKL_Get_Max_Threads',
+                 'MKL_Set_Num_Threads_Local')]:
+            if hasattr(library, setter) and hasattr(library, getter):
+                _BLAS_THREAD_FUNCTIONS.append(
+                    (getattr(library, setter), getattr(library, getter),
+                     getattr(library, local_setter, None)))
+                break
+    return _BLAS_THREAD_FUNCTIONS
+
+def set_blas_num_threads(num_threads):
+    """Sets the number of threads used by the BLAS libraries that numpy and
+    scipy are linked against, if they support it (OpenBLAS and MKL). Note
+    that the setting is global to the process.
+
+    Output:
+        previous: the previous number of threads, or None if no library
+            supports setting it.
+    """
+    previous = None
+    for setter, getter, _ in _blas_thread_functions():
+        if previous is None:
+            previous = getter()
+        setter(ct.c_int(num_threads))
+    return previous
+
+def get_blas_num_threads():
+    """Returns the number of threads used by the BLAS libraries that numpy
+    and scipy are linked against, or None if no library supports querying it.
+    """
+    for _, getter, _ in _blas_thread_functions():
+        return getter()
+    return None
+
+@contextlib.contextmanager
+def single_threaded_blas():
+    """Runs the BLAS calls of the calling thread single-threaded within a
+    block. Libraries with a per-thread setting (MKL, and OpenBLAS from
+    version 0.3.27) only change it for the calling thread. For the other
+    libraries the setting is global to the process, so BLAS calls made by
+    other threads during the block run single-threaded too. Concurrent
+    blocks share the global setting: the first block to enter saves the
+    number of threads, and the last block to exit restores it.
+    """
+    functions = _blas_thread_functions()
+    local = [(local_setter, local_setter(ct.c_int(1)))
+             for _, _, local_setter in functions if local_setter is not None]
+    shared = [(setter, getter) for setter, getter, local_setter in functions
+              if local_setter is None]
+    with _SINGLE_THREADED_LOCK:
+        if _SINGLE_THREADED[0] == 0:
+            _SINGLE_THREADED[1] = [getter() for _, getter in shared]
+            for setter, _ in shared:
+                setter(ct.c_int(1))
+        _SINGLE_THREADED[0] += 1
+    try:
+        yield
+    finally:
+        for local_setter, previous in local:
+            local_setter(ct.c_int(previous))
+        with _SINGLE_THREADED_LOCK:
+            _SINGLE_THREADED[0] -= 1
+            if _SINGLE_THREADED[0] == 0:
+                for (setter, _), previous in zip(shared,
+                                                 _SINGLE_THREADED[1]):
+                    setter(ct.c_int(previous))
+
+def _cast_mixed(A, B, dtype):
+    """Casts the inputs of a mixed-dtype gemm to the dtype of the output,
+    warning once per combination of dtypes since the cast copies the inputs
+    on every call. A mixed-dtype gemm usually means that the data and the
+    parameters of a net disagree, see decaf.base.Net.astype().
+    """
+    key = (A.dtype.str, B.dtype.str, np.dtype(dtype).str)
+    if key not in _WARNED_DTYPES:
+        _WARNED_DTYPES.add(key)
+        logging.warning('blasdot: mixed-dtype gemm (%s x %s -> %s). The '
+                        'inputs will be converted on every call.', *key)
+    # keep the memory layout, since the gemm avoids copying transposed
+    # matrices.
+    if A.dtype != dtype:
+        A = A.astype(dtype, order='K')
+    if B.dtype != dtype:
+        B = B.astype(dtype, order='K')
+    return A, B
+
 def dot(A, B, out=None):
     '''
     a simple wrapper that mimics np.dot (if A and B are both matrices!)
@@ -46,13 +174,17 @@ def dot(A, B, out=None):
         A, B: two matrices. should be either c-contiguous or f-contiguous
         out: (optional) the output matrix. If it is passed, the matrix should
             have the right shape and should be C_CONTIGUOUS.
+        If the dtypes of A, B and out differ, A and B are converted to the
+        dtype of out, with a warning.
     Output:
         out: the output matrix
     Raises:
         TypeError, if the type of matrices is wrong.
     '''
-    if out == None:
-        out = np.empty((A.shape[0], B.shape[1]), A.dtype, B.dtype)
+    if out is None:
+        out = np.empty((A.shape[0], B.shape[1]), np.result_type(A, B))
+    if A.dtype != out.dtype or B.dtype != out.dtype:
+        A, B = _cast_mixed(A, B, out.dtype)
     # Numpy seems to have bugs dealing with the flags of 1x1 matrices. Thus,
     # if we encounter 1x1 matrices, we manually deal with the calculation.
     if out.size == 1:
@@ -71,8 +203,8 @@ def dot_lastdim(A, B, out=None):
     A and B should both be c-contiguous, otherwise the code will report
     an error.
     """
-    if out == None:
-        out = np.empty(A.shape[:-1] + B.shape[1:], A.dtype)
+    if out is None:
+        out = np.empty(A.shape[:-1] + B.shape[1:], np.result_type(A, B))
     lda = A.size / A.shape[-1]
     dim = A.shape[-1]
     ldb = B.size / B.shape[0]
@@ -97,8 +229,8 @@ def dot_firstdims(A, B, out=None):
     A and B should both be c-contiguous, otherwise the code will report
     an error.
     """
-    if out == None:
-        out = np.empty((A.shape[-1], B.shape[-1]), A.dtype)
+    if out is None:
+        out = np.empty((A.shape[-1], B.shape[-1]), np.result_type(A, B))
     lda = A.shape[-1]
     dim = A.size / A.shape[-1]
     ldb = B.shape[-1]
@@ -110,3 +242,33 @@ def dot_firstdims(A, B, out=None):
     return out
 
 
+
+def dot_lastdim_quantized(A, B, B_scale, out=None, A_scale=None):
+    """Performs dot_lastdim(A, W) with integer arithmetic, where the matrix W
+    of shape (k, n) is given in quantized form: B is the (n, k) int8 matrix
+    holding W.T, and B_scale holds the n per-column scales of W, so that
+    W[:, j] is approximately B[j] * B_scale[j] (see decaf.util.quantize).
+    A is quantized to int8 with the scale A_scale before the product. The
+    returned matrix has shape A.shape[:-1] + (n,).
+
+    A should be c-contiguous, and out, if given, should be c-contiguous too.
+    If A_scale is None, it is computed from the maximum absolute value of A.
+    """
+    # imported here since the kernels live with the layers' c++ code.
+    from decaf.layers.cpp import wrapper
+    if out is None:
+        out = np.empty(A.shape[:-1] + (B.shape[0],), B_scale.dtype)
+    if not out.flags.c_contiguous:
+        raise ValueError('The output should be c-contiguous.')
+    if B_scale.dtype != out.dtype:
+        B_scale = B_scale.astype(out.dtype)
+    if A_scale is None:
+        A_scale = max(float(np.abs(A).max()), np.finfo(np.float32).tiny) / 127.
+    dim = A.shape[-1]
+    lda = A.size / dim
+    A_quantized = np.empty((lda, dim), np.int8)
+    wrapper.quantize_int8(np.ascontiguousarray(A), A_quantized, A_scale)
+    outview = out.view()
+    outview.shape = (lda, B.shape[0])
+    wrapper.int8_gemm(A_quantized, B, B_scale, outview, A_scale)
+    return out
@@ -0,0 +1,290 @@
+"""Implements the FFT and Winograd engines of the convolution layer, as
+alternatives to the im2col lowering (see decaf.layers.convolution).
+
+All the functions work on padded data of shape (num, height, width, channels)
+and on kernels stored as in ConvolutionLayer, i.e. a matrix of shape
+(ksize * ksize * channels, num_kernels) whose rows are ordered by kernel row,
+kernel column and channel. Only stride 1 is supported. The functions compute
+correlations, like the convolution layer does.
+
+The FFT engine transforms whole images, which pays off for large kernels.
+The Winograd engine computes F(2x2, 3x3): every 4x4 input tile produces a 2x2
+output tile with 16 products per channel instead of 36, for 3x3 kernels.
+
+The kernel transforms only depend on the kernels (and on the image size for
+the FFT engine), so they are computed by fft_kernels() and winograd_kernels()
+and passed to the other functions, which lets the caller cache them. The
+FFTs run in single precision for float32 data, and the products with the
+transformed kernels are one GEMM per frequency or per tile element.
+"""
+
+from decaf.layers.cpp import wrapper
+import numpy as np
+from scipy import fftpack
+
+
+# pylint: disable=C0103
+# The Winograd F(2x2, 3x3) transforms (see Lavin and Gray, Fast algorithms
+# for convolutional neural networks): the output tile is
+# AT [(G g GT) * (BT d B)] A for a 3x3 kernel g and a 4x4 input tile d. The
+# input and output transforms are computed by the C++ kernels in
+# decaf/layers/cpp/winograd.cpp.
+_WINOGRAD_G = np.array([[1, 0, 0],
+                        [0.5, 0.5, 0.5],
+                        [0.5, -0.5, 0.5],
+                        [0, 0, 1]], dtype=np.float64)
+
+
+def _complex_dtype(dtype):
+    """Returns the complex dtype of the transforms of real data."""
+    return np.result_type(dtype, np.complex64)
+
+
+def _rfft2(data, shape):
+    """Computes the 2D FFT over the first two axes of real data, zero padded
+    to the given shape. Only the width / 2 + 1 nonnegative frequencies of the
+    second axis are kept, as in np.fft.rfft2, but the result has the
+    precision of the data.
+    """
+    height, width = shape
+    # fftpack.rfft packs the spectrum of real data as
+    # [y(0), Re y(1), Im y(1), ...], which ends with Re y(n/2) for even n.
+    packed = fftpack.rfft(data, n=width, axis=1)
+    spectrum = np.empty((data.shape[0], width / 2 + 1) + data.shape[2:],
+                        _complex_dtype(data.dtype))
+    spectrum[:, 0] = packed[:, 0]
+    pairs = (width - 1) / 2
+    spectrum.real[:, 1:pairs + 1] = packed[:, 1:pairs * 2:2]
+    spectrum.imag[:, 1:pairs + 1] = packed[:, 2:pairs * 2 + 1:2]
+    if width % 2 == 0:
+        spectrum[:, width / 2] = packed[:, width - 1]
+    return fftpack.fft(spectrum, n=height, axis=0, overwrite_x=True)
+
+
+def _irfft2(spectrum, width):
+    """Inverts _rfft2() for real data of the given width."""
+    spectrum = fftpack.ifft(spectrum, axis=0, overwrite_x=True)
+    packed = np.empty((spectrum.shape[0], width) + spectrum.shape[2:],
+                      spectrum.real.dtype)
+    packed[:, 0] = spectrum.real[:, 0]
+    pairs = (width - 1) / 2
+    packed[:, 1:pairs * 2:2] = spectrum.real[:, 1:pairs + 1]
+    packed[:, 2:pairs * 2 + 1:2] = spectrum.imag[:, 1:pairs + 1]
+    if width % 2 == 0:
+        packed[:, width - 1] = spectrum.real[:, width / 2]
+    return fftpack.irfft(packed, axis=1, overwrite_x=True)
+
+
+def _irfft2_corner(spectrum, width, size):
+    """Returns the first size x size elements of _irfft2(spectrum, width).
+    They are computed as products with the inverse DFT matrices, which is
+    cheaper than the whole inverse for small sizes.
+    """
+    height, half_width = spectrum.shape[:2]
+    rows = np.exp(2j * np.pi * np.outer(np.arange(size), np.arange(height)) /
+                  height) / height
+    # the negative frequencies of the columns are the conjugates of the
+    # positive ones, which doubles the real parts of the positive ones.
+    weights = np.ones(half_width) * 2
+    weights[0] = 1
+    if width % 2 == 0:
+        weights[-1] = 1
+    cols = weights * np.exp(2j * np.pi * np.outer(
+        np.arange(size), np.arange(half_width)) / width) / width
+    partial = np.dot(rows.astype(spectrum.dtype),
+                     spectrum.reshape(height, -1)).reshape(
+                         size, half_width, -1)
+    cols = cols.astype(spectrum.dtype)
+    result = np.empty((size, size, partial.shape[2]), spectrum.real.dtype)
+    for i in range(size):
+        result[i] = np.dot(cols, partial[i]).real
+    return result.reshape((size, size) + spectrum.shape[2:])
+
+
+def _dot_stacked(left, right, out):
+    """Computes out[i] = dot(left[i], right[i]) for stacked matrices, with
+    one GEMM per matrix (np.matmul does not call BLAS for stacks).
+    """
+    left = np.ascontiguousarray(left)
+    for i in range(out.shape[0]):
+        np.dot(left[i], right[i], out=out[i])
+    return out
+
+
+def fft_kernels(kernels, ksize, shape):
+    """Returns the FFTs of the flipped kernels for padded images of the given
+    (height, width), of shape (num_frequencies, channels, num_kernels).
+    """
+    num_kernels = kernels.shape[1]
+    channels = kernels.shape[0] / (ksize * ksize)
+    weights = kernels.reshape(ksize, ksize, channels, num_kernels)
+    # a correlation is a convolution with the flipped kernels.
+    kernels_f = _rfft2(weights[::-1, ::-1], shape)
+    return np.ascontiguousarray(kernels_f).reshape(-1, channels, num_kernels)
+
+
+def _fft_data(padded):
+    """Returns the FFTs of the padded data, of shape
+    (height, width / 2 + 1, num, channels).
+    """
+    return _rfft2(padded.transpose(1, 2, 0, 3), padded.shape[1:3])
+
+
+def fft_forward(padded, kernels_f, ksize, out):
+    """Computes the output of a stride-1 convolution with FFTs.
+
+    Input:
+        padded: the padded data of shape (num, height, width, channels).
+        kernels_f: the kernel transforms returned by fft_kernels().
+        ksize: the kernel size.
+        out: the output array of shape
+            (num, height - ksize + 1, width - ksize + 1, num_kernels).
+    """
+    num, height, width, channels = padded.shape
+    num_kernels = kernels_f.shape[2]
+    data_f = _fft_data(padded)
+    freq_shape = data_f.shape[:2]
+    product = _dot_stacked(
+        data_f.reshape(-1, num, channels), kernels_f,
+        np.empty((kernels_f.shape[0], num, num_kernels), data_f.dtype))
+    result = _irfft2(product.reshape(freq_shape + (num, num_kernels)), width)
+    out[:] = result[ksize - 1:, ksize - 1:].transpose(2, 0, 1, 3)
+
+
+def fft_backward(padded, top_diff, kernels_f, ksize, kernel_diff,
+                 padded_diff=None):
+    """Computes the gradients of a stride-1 convolution with FFTs.
+
+    Input:
+        padded: the padded data.
+        top_diff: the gradient with respect to the output.
+        kernels_f: the kernel transforms returned by fft_kernels().
+        ksize: the kernel size.
+        kernel_diff: the array the kernel gradient is written to.
+        padded_diff: if given, the array the gradient with respect to the
+            padded data is written to.
+    """
+    num, height, width, channels = padded.shape
+    num_kernels = kernels_f.shape[2]
+    num_freq = kernels_f.shape[0]
+    # the output gradient is placed where the forward pass crops the output,
+    # so that the products below are the transposes of the forward product.
+    diff = np.zeros((height, width, num, num_kernels), top_diff.dtype)
+    diff[ksize - 1:, ksize - 1:] = top_diff.transpose(1, 2, 0, 3)
+    diff_f = _rfft2(diff, (height, width))
+    freq_shape = diff_f.shape[:2]
+    diff_f = diff_f.reshape(num_freq, num, num_kernels)
+    # the kernel gradient correlates the output gradient with the data, which
+    # gives the gradient of the flipped kernels.
+    data_f = np.conj(_fft_data(padded)).reshape(num_freq, num, channels)
+    grad_f = _dot_stacked(
+        data_f.transpose(0, 2, 1), diff_f,
+        np.empty((num_freq, channels, num_kernels), diff_f.dtype))
+    grad = _irfft2_corner(
+        grad_f.reshape(freq_shape + (channels, num_kernels)), width, ksize)
+    kernel_diff[:] = grad[::-1, ::-1].reshape(kernel_diff.shape)
+    if padded_diff is not None:
+        grad_f = _dot_stacked(
+            diff_f, np.conj(kernels_f).transpose(0, 2, 1),
+            np.empty((num_freq, num, channels), diff_f.dtype))
+        grad = _irfft2(grad_f.reshape(freq_shape + (num, channels)), width)
+        padded_diff[:] = grad.transpose(2, 0, 1, 3)
+
+
+def _transform(matrix, data):
+    """Computes matrix * data * matrix^T over the first two axes of data."""
+    matrix = matrix.astype(data.dtype)
+    data = np.tensordot(matrix, data, axes=(1, 0))
+    return np.tensordot(matrix, data, axes=(1, 1)).swapaxes(0, 1)
+
+
+def _winograd_input(padded):
+    """Returns the transformed input tiles, of shape
+    (16, num * tile_rows * tile_cols, channels).
+    """
+    num, height, width, channels = padded.shape
+    padded = np.ascontiguousarray(padded)
+    data_t = np.empty((16, num * ((height - 1) / 2) * ((width - 1) / 2),
+                       channels), padded.dtype)
+    wrapper.winograd_input_forward(padded, data_t)
+    return data_t
+
+
+def winograd_kernels(kernels):
+    """Returns the transforms G g G^T of the 3x3 kernels, of shape
+    (16, channels, num_kernels).
+    """
+    channels = kernels.shape[0] / 9
+    num_kernels = kernels.shape[1]
+    return np.ascontiguousarray(_transform(
+        _WINOGRAD_G, kernels.reshape(3, 3, channels, num_kernels)).reshape(
+            16, channels, num_kernels))
+
+
+def winograd_forward(padded, kernels_t, out):
+    """Computes the output of a 3x3 stride-1 convolution with the Winograd
+    F(2x2, 3x3) algorithm.
+
+    Input:
+        padded: the padded data of shape (num, height, width, channels).
+        kernels_t: the kernel transforms returned by winograd_kernels().
+        out: the C-contiguous output array of shape
+            (num, height - 2, width - 2, num_kernels).
+    """
+    data_t = _winograd_input(padded)
+    product = _dot_stacked(
+        data_t, kernels_t,
+        np.empty((16, data_t.shape[1], kernels_t.shape[2]), padded.dtype))
+    wrapper.winograd_output_forward(product, out)
+
+
+def winograd_backward(padded, top_diff, kernels_t, kernel_diff,
+                      padded_diff=None):
+    """Computes the gradients of a 3x3 stride-1 convolution with the Winograd
+    F(2x2, 3x3) algorithm.
+
+    Input:
+        padded: the padded data.
+        top_diff: the gradient with respect to the output.
+        kernels_t: the kernel transforms returned by winograd_kernels().
+        kernel_diff: the array the kernel gradient is written to.
+        padded_diff: if given, the C-contiguous array the gradient with
+            respect to the padded data is written to.
+    """
+    _, channels, num_kernels = kernels_t.shape
+    data_t = _winograd_input(padded)
+    diff_t = np.empty((16, data_t.shape[1], num_kernels), top_diff.dtype)
+    wrapper.winograd_output_backward(diff_t,
+                                     np.ascontiguousarray(top_diff))
+    grad_t = _dot_stacked(
+        data_t.transpose(0, 2, 1), diff_t,
+        np.empty((16, channels, num_kernels), padded.dtype))
+    kernel_diff[:] = _transform(
+        _WINOGRAD_G.T, grad_t.reshape(4, 4, channels, num_kernels)).reshape(
+            kernel_diff.shape)
+    if padded_diff is None:
+        return
+    # the tile transforms are no longer needed, so they hold the gradient.
+    _dot_stacked(diff_t, kernels_t.transpose(0, 2, 1), data_t)
+    wrapper.winograd_input_backward(padded_diff, data_t)
+
+
+def fft_flops(padded_shape, ksize, num_kernels):
+    """Counts the floating point operations of fft_forward() per image,
+    counting 5 n log2(n) operations for an FFT of size n."""
+    _, height, width, channels = padded_shape
+    size = height * width
+    num_freq = height * (width / 2 + 1)
+    transforms = 2.5 * size * np.log2(size) * (channels + num_kernels)
+    return int(transforms + 8 * num_freq * channels * num_kernels)
+
+
+def winograd_flops(padded_shape, num_kernels):
+    """Counts the floating point operations of winograd_forward() per image.
+    The input transform takes 32 additions per tile and channel, and the
+    output transform 24 per tile and kernel.
+    """
+    _, height, width, channels = padded_shape
+    num_tiles = ((height - 1) / 2) * ((width - 1) / 2)
+    return num_tiles * (32 * channels + 24 * num_kernels +
+                        2 * 16 * channels * num_kernels)
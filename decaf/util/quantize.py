@@ -0,0 +1,198 @@
+"""Implements post-training int8 quantization of nets for CPU inference.
+
+The weights of the convolution and inner product layers are quantized to int8
+with one scale per output channel, and the input of each such layer is
+quantized with a single scale that is calibrated by running the float net on
+sample data. The quantized layers then compute their products with integer
+GEMMs (see decaf.util.blasdot.dot_lastdim_quantized).
+
+A typical usage is:
+    float_net = base.Net.load(filename)
+    quantized_net = base.Net.load(filename)
+    quantize.quantize_net(quantized_net, puff.Puff('sample.puff'))
+    report = quantize.compare(float_net, quantized_net, images, 'probs',
+                              labels=labels)
+    print quantize.format_report(report)
+"""
+
+from decaf import base, puff
+import logging
+import numpy as np
+import time
+
+
+def quantize_weights(weight):
+    """Quantizes a weight matrix of shape (k, n) with one scale per column.
+
+    Input:
+        weight: the float weight matrix, whose n columns correspond to the
+            output channels.
+    Output:
+        quantized: a c-contiguous int8 matrix of shape (n, k) holding the
+            transposed quantized weights.
+        scale: a vector of length n and of the dtype of weight, such that
+            weight[:, j] is approximately quantized[j] * scale[j].
+    """
+    scale = np.abs(weight).max(axis=0) / 127.
+    scale = np.maximum(scale, np.finfo(weight.dtype).tiny)
+    quantized = np.clip(np.rint(weight / scale), -127, 127)
+    return (np.ascontiguousarray(quantized.T.astype(np.int8)),
+            scale.astype(weight.dtype))
+
+
+def _candidate_layers(decaf_net):
+    """Returns the names of the layers that may support quantization, which
+    are the layers with parameters, together with their input blobs.
+    """
+    candidates = []
+    for name, layer in decaf_net.layers.iteritems():
+        if (layer.param() and not isinstance(layer, base.DataLayer)
+            and len(decaf_net.needs[name]) == 1):
+            candidates.append((name, decaf_net.needs[name][0]))
+    return candidates
+
+
+def calibrate(decaf_net, data, input_name='data', num_data=100,
+              batch_size=10, percentile=99.99):
+    """Computes the input scales of the layers that can be quantized, by
+    running the float net on sample data. The net should not have a memory
+    plan, since the inputs of all the layers are inspected.
+
+    Input:
+        decaf_net: the finished float net.
+        data: the calibration data, either a numpy array or a Puff. For a
+            Puff, num_data data points are read from its current position.
+        input_name: the name of the input blob. Default 'data'.
+        num_data: the number of data points to read from a Puff. Default 100.
+        batch_size: the batch size to run the net with. Default 10.
+        percentile: the percentile of the absolute input values that is
+            mapped to the largest int8 value. Values slightly below 100 clip
+            rare outliers, keeping the resolution for the bulk of the values.
+            Default 99.99.
+    Output:
+        scales: a dict mapping layer names to their input scales.
+    """
+    if isinstance(data, puff.Puff):
+        data = data.read(min(num_data, data.num_local_data()))
+    candidates = _candidate_layers(decaf_net)
+    blob_names = list(set(blob_name for _, blob_name in candidates))
+    ranges = dict((blob_name, 0.) for blob_name in blob_names)
+    for start in range(0, data.shape[0], batch_size):
+        outputs = decaf_net.predict(
+            blob_names, **{input_name: data[start:start + batch_size]})
+        for blob_name in blob_names:
+            ranges[blob_name] = max(
+                ranges[blob_name],
+                float(np.percentile(np.abs(outputs[blob_name]), percentile)))
+    return dict((name, max(ranges[blob_name], np.finfo(np.float32).tiny)
+                       / 127.)
+                for name, blob_name in candidates)
+
+
+def quantize_net(decaf_net, data=None, input_name='data', **kwargs):
+    """Quantizes the convolution and inner product layers of a net in place,
+    and re-finishes the net. The quantized net only supports prediction.
+
+    Input:
+        decaf_net: the finished float net, which should have been run at
+            least once so that its weights are initialized.
+        data: the calibration data, see calibrate(). If None, the input
+            scales are computed from every input on the fly, which is more
+            accurate but slower.
+        input_name: the name of the input blob. Default 'data'.
+        kwargs: the other arguments passed to calibrate().
+    Output:
+        quantized: the names of the quantized layers.
+    """
+    if data is not None:
+        scales = calibrate(decaf_net, data, input_name, **kwargs)
+    else:
+        scales = dict((name, None) for name, _ in
+                      _candidate_layers(decaf_net))
+    quantized = [name for name in sorted(scales)
+                 if decaf_net.layers[name].quantize(scales[name])]
+    decaf_net.finish()
+    logging.info('Quantized %d layers: %s', len(quantized),
+                 ', '.join(quantized))
+    return quantized
+
+
+def param_bytes(decaf_net):
+    """Returns the number of bytes held by the parameters of a net."""
+    return sum(param.data().nbytes for param in decaf_net.params()
+               if param.has_data())
+
+
+def compare(float_net, quantized_net, data, output_name, labels=None,
+            input_name='data', batch_size=10, repeat=3):
+    """Compares the accuracy and the speed of a quantized net against the
+    float net it was quantized from.
+
+    Input:
+        float_net: the float net.
+        quantized_net: the quantized net.
+        data: the evaluation data as a numpy array.
+        output_name: the name of the output blob to compare, such as the
+            class probabilities.
+        labels: if given, the ground truth labels of the data, used to compute
+            the top-1 accuracy of both nets.
+        input_name: the name of the input blob. Default 'data'.
+        batch_size: the batch size to run the nets with. Default 10.
+        repeat: the number of timed runs over the data; the fastest one is
+            reported. Default 3.
+    Output:
+        report: a dict containing the images per second and the parameter
+            bytes of both nets, the maximum and mean absolute differences of
+            the outputs, the top-1 agreement between the nets, and the top-1
+            accuracies if labels are given.
+    """
+    report = {}
+    outputs = {}
+    for key, decaf_net in [('float', float_net), ('quantized', quantized_net)]:
+        best = None
+        for _ in range(repeat):
+            results = []
+            start = time.time()
+            for i in range(0, data.shape[0], batch_size):
+                results.append(decaf_net.predict(
+                    [output_name],
+                    **{input_name: data[i:i + batch_size]})[output_name].copy())
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        outputs[key] = np.vstack(results).reshape(data.shape[0], -1)
+        report[key + '_images_per_sec'] = data.shape[0] / best
+        report[key + '_param_bytes'] = param_bytes(decaf_net)
+    diff = np.abs(outputs['float'] - outputs['quantized'])
+    report['max_abs_diff'] = float(diff.max())
+    report['mean_abs_diff'] = float(diff.mean())
+    predictions = dict((key, output.argmax(axis=1))
+                       for key, output in outputs.iteritems())
+    report['top1_agreement'] = float(
+        (predictions['float'] == predictions['quantized']).mean())
+    if labels is not None:
+        for key in ['float', 'quantized']:
+            report[key + '_top1_accuracy'] = float(
+                (predictions[key] == labels).mean())
+    report['speedup'] = (report['quantized_images_per_sec'] /
+                         report['float_images_per_sec'])
+    return report
+
+
+def format_report(report):
+    """Formats the report returned by compare() as a human readable string.
+    """
+    lines = ['%-12s %14s %14s' % ('', 'float', 'int8'),
+             '%-12s %14.2f %14.2f' % ('images/sec',
+                                      report['float_images_per_sec'],
+                                      report['quantized_images_per_sec']),
+             '%-12s %14d %14d' % ('param bytes', report['float_param_bytes'],
+                                  report['quantized_param_bytes'])]
+    if 'float_top1_accuracy' in report:
+        lines.append('%-12s %14.4f %14.4f' % (
+            'top-1', report['float_top1_accuracy'],
+            report['quantized_top1_accuracy']))
+    lines.append('speedup: %.2fx, top-1 agreement: %.4f, output difference:'
+                 ' max %g, mean %g' % (
+                     report['speedup'], report['top1_agreement'],
+                     report['max_abs_diff'], report['mean_abs_diff']))
+    return '\n'.join(lines)
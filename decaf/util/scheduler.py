@@ -0,0 +1,150 @@
+"""Implements a scheduler that runs a set of dependent tasks on a thread pool.
+"""
+
+import Queue
+import atexit
+import sys
+import threading
+import weakref
+
+# The schedulers whose threads are running, which are closed when the
+# interpreter exits so that no worker is killed while it waits for a task.
+_RUNNING = weakref.WeakSet()
+
+class DAGScheduler(object):
+    """DAGScheduler runs tasks whose dependencies form a directed acyclic graph
+    on a pool of worker threads. A task is started as soon as all the tasks it
+    depends on have finished.
+
+    Since Python threads share the interpreter lock, the scheduler only helps
+    when the tasks spend most of their time in code that releases the lock,
+    such as numpy, BLAS and the ctypes calls into our C++ kernels.
+
+    Call close() to stop the worker threads once the scheduler is no longer
+    needed; a dropped scheduler stops them as well.
+    """
+
+    def __init__(self, num_threads):
+        """Initializes a scheduler.
+
+        Input:
+            num_threads: the number of worker threads. The threads are started
+                lazily when run() is called for the first time.
+        """
+        self._num_threads = num_threads
+        self._tasks = None
+        self._threads = []
+
+    def num_threads(self):
+        """Returns the number of worker threads."""
+        return self._num_threads
+
+    def _start(self):
+        """Starts the worker threads."""
+        self._tasks = Queue.Queue()
+        # the threads only refer to the queue, so that a dropped scheduler
+        # can be collected (and stop them, see __del__).
+        self._threads = [threading.Thread(target=DAGScheduler._worker,
+                                          args=(self._tasks,))
+                         for _ in range(self._num_threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        _RUNNING.add(self)
+
+    @staticmethod
+    def _worker(tasks):
+        """The main loop of a worker thread, which returns when it gets None.
+        """
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            idx, func, args, done = task
+            try:
+                done.put((idx, func(*args), None))
+            except Exception:
+                done.put((idx, None, sys.exc_info()))
+
+    def run(self, tasks, deps):
+        """Runs the tasks and waits for them to finish.
+
+        Input:
+            tasks: a list of (func, args) tuples. Running task i means calling
+                func(*args).
+            deps: a list of the same length as tasks, where deps[i] lists the
+                indices of the tasks that should finish before task i starts.
+        Output:
+            results: a list containing the return values of the tasks.
+        If any task raises an exception, no further tasks are started, and the
+        exception is re-raised after the running tasks finish.
+        """
+        if self._tasks is None:
+            self._start()
+        num_waiting = [len(dep) for dep in deps]
+        children = [[] for _ in tasks]
+        for idx, dep in enumerate(deps):
+            for parent in dep:
+                children[parent].append(idx)
+        done = Queue.Queue()
+        results = [None] * len(tasks)
+        running = 0
+        for idx, count in enumerate(num_waiting):
+            if count == 0:
+                self._tasks.put((idx, tasks[idx][0], tasks[idx][1], done))
+                running += 1
+        error = None
+        while running:
+            idx, result, exc_info = done.get()
+            running -= 1
+            if exc_info is not None:
+                if error is None:
+                    error = exc_info
+                continue
+            results[idx] = result
+            if error is not None:
+                continue
+            for child in children[idx]:
+                num_waiting[child] -= 1
+                if num_waiting[child] == 0:
+                    self._tasks.put(
+                        (child, tasks[child][0], tasks[child][1], done))
+                    running += 1
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return results
+
+    def close(self, wait=True):
+        """Stops the worker threads. The scheduler may still be used, in which
+        case new threads are started.
+
+        Input:
+            wait: if True, waits for the threads to finish.
+        """
+        if self._tasks is None:
+            return
+        for _ in self._threads:
+            self._tasks.put(None)
+        if wait:
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+        self._tasks = None
+        self._threads = []
+        _RUNNING.discard(self)
+
+    def __del__(self):
+        """Stops the worker threads of a dropped scheduler."""
+        self.close(wait=False)
+
+    def __getstate__(self):
+        """When pickling, we only keep the number of threads."""
+        return {'_num_threads': self._num_threads, '_tasks': None,
+                '_threads': []}
+
+
+@atexit.register
+def _close_running():
+    """Stops the worker threads of all the schedulers."""
+    for scheduler in list(_RUNNING):
+        scheduler.close()
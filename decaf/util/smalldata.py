@@ -12,7 +12,7 @@ def lena():
     filename = os.path.join(_DATA_PATH, 'lena.png')
     return io.imread(filename)
 
-def whitened_images(dtype=np.float64):
+def whitened_images(dtype=np.float32):
     """Returns the whitened images provided in the Sparsenet website:
         http://redwood.berkeley.edu/bruno/sparsenet/
     The returned data will be in the shape (10,512,512,1) to fit